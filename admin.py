@@ -1,4 +1,5 @@
-from db import db, update_user, get_user, get_user_by_username, get_room, update_room, get_chat_history, insert_blocked_word, remove_blocked_word, get_blocked_words
+from db import db, user_cache_stats, chat_log_stats, match_stats_snapshot, link_strike_stats, update_user, get_user, get_user_by_username, get_room, update_room, get_chat_history, insert_blocked_word, get_blocked_words
+from db import remove_blocked_word as delete_blocked_word
 from models import default_report
 from datetime import datetime, timedelta
 import logging
@@ -91,7 +92,7 @@ async def add_blocked_word(word):
     await insert_blocked_word(word)
 
 async def remove_blocked_word(word):
-    await remove_blocked_word(word)
+    await delete_blocked_word(word)
 
 async def get_stats():
     """
@@ -147,5 +148,9 @@ async def get_stats():
         "blocked_words": blocked_words_count,
         "language_distribution": lang_dist,
         "gender_distribution": gender_dist,
-        "region_distribution": region_dist
+        "region_distribution": region_dist,
+        "user_cache": user_cache_stats(),
+        "chat_log_queue": chat_log_stats(),
+        "matching": match_stats_snapshot(),
+        "link_strikes": link_strike_stats()
     }
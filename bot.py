@@ -6,11 +6,14 @@ import logging
 import json
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, filters
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler,
+    TypeHandler, filters
 )
 from db import (
-    db, get_user, update_user, get_room, test_connection, create_indexes,
-    mark_all_users_offline, cleanup_stale_rooms, get_user_room, set_user_room
+    get_user, get_user_view, update_user, test_connection, create_indexes,
+    mark_all_users_offline, cleanup_stale_rooms,
+    confirm_user_route, load_routes, chat_log_writer, flush_recent_partners,
+    room_activity, backfill_room_activity, match_stats, link_strikes, prefetch_user
 )
 from handlers.profile import (
     unified_profile_entry, profile_menu_cb, gender_cb, region_cb, country_cb,
@@ -22,24 +25,30 @@ from handlers.report import report_partner
 from handlers.admincmds import (
     admin_block, admin_unblock, admin_message, admin_stats, admin_blockword, admin_unblockword,
     admin_userinfo, admin_roominfo, admin_viewhistory, admin_setpremium, admin_resetpremium,
-    admin_adminroom, admin_ad, admin_export, admin_linkusers
+    admin_adminroom, admin_ad, admin_export, admin_linkusers, admin_dbstats
 )
 from handlers.match import (
     find_command, search_conv, end_command, next_command, open_filter_menu,
-    menu_callback_handler, select_filter_cb, stop_search_callback,
-    remove_from_premium_queue, create_room, get_admin_room_meta
+    menu_callback_handler, select_filter_cb, stop_search_callback, keep_searching_callback, expire_searches,
+    reap_idle_rooms,
+    remove_from_premium_queue, match_user
 )
 from handlers.forward import forward_to_admin
 from handlers.referral import show_referral_info, process_referral, admin_check_referrals
 from admin import downgrade_expired_premium
 from handlers.message_router import route_message
-from rooms import users_online
+from handlers.ratelimit import rate_limit
+from rooms import waiting_pool, load_premium_requests
 from gemini_client import GeminiTranslator
+from mongo_monitor import command_monitor
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 ADMIN_GROUP_ID = int(os.getenv("ADMIN_GROUP_ID"))
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+PREMIUM_QUEUE_SWEEP_SECONDS = int(os.getenv("PREMIUM_QUEUE_SWEEP_SECONDS", "300"))
+MATCH_STATS_FLUSH_SECONDS = int(os.getenv("MATCH_STATS_FLUSH_SECONDS", "60"))
+STRIKES_FLUSH_SECONDS = int(os.getenv("STRIKES_FLUSH_SECONDS", "30"))
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "20"))
 LOCALE_DIR = os.path.join(os.path.dirname(__file__), "locales")
@@ -88,7 +97,8 @@ def make_inline_kb(rows, lang):
 
 async def reply_translated(update, context, key, **kwargs):
     user = update.effective_user
-    lang = get_user_locale(await get_user(user.id))
+    dbuser = await get_user_view(user.id, "locale")
+    lang = get_user_locale(dbuser.to_dict() if dbuser else None)
     locale = load_locale(lang)
     msg = locale.get(key, key)
     if kwargs:
@@ -249,86 +259,26 @@ async def referral_menu_callback(update: Update, context):
     )
 
 async def check_premium_queue_job(context):
-    """Background job to check premium queue for matches"""
+    """
+    Safety-net sweep of the premium queue. Requests are normally answered
+    as soon as a matching user becomes available (see offer_to_premium_queue);
+    this only catches anything those events missed.
+    """
+    requests = matched = 0
     try:
-        queued_users = []
-        async for queued in db.premium_queue.find({}):
-            queued_users.append(queued)
-
-        online_users = []
-        async for user in db.users.find({"is_online": True}):
-            user_id = user["user_id"]
-            existing_room = await get_user_room(user_id)
-            if not existing_room:
-                online_users.append(user)
-
-        for queued in queued_users:
-            queued_user_id = queued["user_id"]
-            filters = queued.get("filters", {})
-
-            existing_room = await get_user_room(queued_user_id)
-            if existing_room:
+        for queued_user_id, request_filters in await waiting_pool.requests():
+            requests += 1
+            if await confirm_user_route(queued_user_id):
                 await remove_from_premium_queue(queued_user_id)
                 continue
 
-            for online_user in online_users:
-                online_user_id = online_user["user_id"]
-
-                if online_user_id == queued_user_id:
-                    continue
-
-                if await get_user_room(online_user_id):
-                    continue
-
-                match = True
-                for key, val in filters.items():
-                    if val and online_user.get(key) != val:
-                        match = False
-                        break
-
-                if match:
-                    await remove_from_premium_queue(queued_user_id)
-                    users_online.discard(online_user_id)
-                    users_online.discard(queued_user_id)
-
-                    room_id = await create_room(queued_user_id, online_user_id)
-
-                    await set_user_room(queued_user_id, room_id)
-                    await set_user_room(online_user_id, room_id)
-
-                    queued_user = await get_user(queued_user_id)
-
-                    for uid, user_data in [(queued_user_id, queued_user), (online_user_id, online_user)]:
-                        try:
-                            lang = get_user_locale(user_data)
-                            locale = load_locale(lang)
-                            await context.bot.send_message(
-                                uid,
-                                f"🎉 {locale.get('match_found', 'Match found! Say hi to your partner.')}"
-                            )
-                        except Exception as e:
-                            logger.warning(f"Could not notify user {uid}: {e}")
-
-                    admin_group = context.bot_data.get('ADMIN_GROUP_ID')
-                    if admin_group:
-                        try:
-                            room = await get_room(room_id)
-                            txt = get_admin_room_meta(room, queued_user_id, online_user_id, [queued_user, online_user])
-                            await context.bot.send_message(chat_id=admin_group, text=txt)
-                            for u in [queued_user, online_user]:
-                                for pid in u.get('profile_photos', [])[:5]:
-                                    try:
-                                        await context.bot.send_photo(chat_id=admin_group, photo=pid)
-                                    except:
-                                        pass
-                        except Exception as e:
-                            logger.warning(f"Could not notify admin group: {e}")
-
-                    online_users.remove(online_user)
-                    break
+            if await match_user(context, queued_user_id, None, request_filters, notify_user=True):
+                await remove_from_premium_queue(queued_user_id)
+                matched += 1
 
     except Exception as e:
         logger.error(f"Error in premium queue check: {e}")
+    match_stats.premium_sweep(requests, matched)
 
 async def startup(application):
     """Startup tasks"""
@@ -344,11 +294,23 @@ async def startup(application):
     if cleaned > 0:
         logger.info(f"🧹 Cleaned up {cleaned} stale room mappings")
 
+    await load_routes()
+    backfilled = await backfill_room_activity()
+    if backfilled:
+        logger.info(f"Backfilled last_message_at on {backfilled} rooms")
+    await load_premium_requests()
+    await chat_log_writer.start()
+
     logger.info("✅ Bot startup complete!")
 
 async def shutdown(application):
     """Shutdown tasks"""
     logger.info("🛑 Shutting down AnonIndoChat Bot...")
+    await chat_log_writer.stop()
+    await flush_recent_partners()
+    await room_activity.flush()
+    await match_stats.flush()
+    await link_strikes.flush()
     await mark_all_users_offline()
     logger.info("✅ Bot shutdown complete!")
 
@@ -372,6 +334,32 @@ def main():
     app.post_init = startup
     app.post_shutdown = shutdown
 
+    # Open and close the update_scope of each update (which also counts
+    # its MongoDB commands): these run before and after every other
+    # handler group
+    async def begin_update_scope(update, context):
+        user = update.effective_user
+        command_monitor.begin_update(user.id if user else None)
+
+    async def end_update_scope(update, context):
+        command_monitor.end_update()
+
+    app.add_handler(TypeHandler(Update, begin_update_scope), group=-100)
+    app.add_handler(TypeHandler(Update, end_update_scope), group=100)
+
+    # Flood control ahead of every command, callback and relayed message;
+    # an update over its limit closes its scope and raises
+    # ApplicationHandlerStop here, so group 100 never sees it
+    app.add_handler(TypeHandler(Update, rate_limit), group=-2)
+
+    # Load the sender once into the update_scope; the handlers below read
+    # it from there
+    async def prefetch_update(update, context):
+        if update.effective_user:
+            await prefetch_user(update.effective_user.id)
+
+    app.add_handler(TypeHandler(Update, prefetch_update), group=-1)
+
     profile_conv = ConversationHandler(
         entry_points=[
             CommandHandler('profile', unified_profile_entry),
@@ -405,6 +393,7 @@ def main():
     app.add_handler(CallbackQueryHandler(menu_callback_handler, pattern="^(menu_find|menu_upgrade|menu_filter|menu_search|menu_back)$"))
     app.add_handler(CallbackQueryHandler(referral_menu_callback, pattern="^menu_referral$"))
     app.add_handler(CallbackQueryHandler(stop_search_callback, pattern="^(stop_search|cancel_search)$"))
+    app.add_handler(CallbackQueryHandler(keep_searching_callback, pattern="^keep_searching_(pool|premium)$"))
 
     admin_filter = filters.User(ADMIN_ID)
     app.add_handler(CommandHandler("block", admin_block, admin_filter))
@@ -423,6 +412,7 @@ def main():
     app.add_handler(CommandHandler("adminroom", admin_adminroom, admin_filter))
     app.add_handler(CommandHandler("linkusers", admin_linkusers, admin_filter))
     app.add_handler(CommandHandler("checkreferrals", admin_check_referrals, admin_filter))
+    app.add_handler(CommandHandler("dbstats", admin_dbstats, admin_filter))
 
     app.add_handler(CallbackQueryHandler(admin_callback))
 
@@ -434,7 +424,7 @@ def main():
         await downgrade_expired_premium(context.bot)
     app.job_queue.run_repeating(expiry_job, interval=3600, first=10)
 
-    app.job_queue.run_repeating(check_premium_queue_job, interval=45, first=15)
+    app.job_queue.run_repeating(check_premium_queue_job, interval=PREMIUM_QUEUE_SWEEP_SECONDS, first=15)
 
     async def cleanup_job(context):
         cleaned = await cleanup_stale_rooms()
@@ -442,9 +432,30 @@ def main():
             logger.info(f"Periodic cleanup: removed {cleaned} stale mappings")
     app.job_queue.run_repeating(cleanup_job, interval=1800, first=300)
 
+    async def recent_partners_job(context):
+        try:
+            await flush_recent_partners()
+        except Exception as e:
+            logger.error(f"Recent partners flush failed: {e}")
+    app.job_queue.run_repeating(recent_partners_job, interval=60, first=60)
+    app.job_queue.run_repeating(expire_searches, interval=30, first=30)
+
+    async def room_activity_job(context):
+        await room_activity.flush()
+    app.job_queue.run_repeating(room_activity_job, interval=60, first=60)
+    app.job_queue.run_repeating(reap_idle_rooms, interval=300, first=120)
+
+    async def match_stats_job(context):
+        await match_stats.flush()
+    app.job_queue.run_repeating(match_stats_job, interval=MATCH_STATS_FLUSH_SECONDS, first=MATCH_STATS_FLUSH_SECONDS)
+
+    async def strikes_job(context):
+        await link_strikes.flush()
+    app.job_queue.run_repeating(strikes_job, interval=STRIKES_FLUSH_SECONDS, first=STRIKES_FLUSH_SECONDS)
+
     logger.info("🚀 AnonIndoChat Bot started successfully!")
     logger.info("📡 Polling for updates...")
-    logger.info("⏰ Premium queue checker running every 45 seconds")
+    logger.info(f"⏰ Premium queue safety sweep running every {PREMIUM_QUEUE_SWEEP_SECONDS} seconds")
     logger.info("🧹 Cleanup job running every 30 minutes")
     app.run_polling()
 
@@ -0,0 +1,170 @@
+"""
+Background batch writer for chat logs.
+
+log_chat() only enqueues a record; a worker task flushes the queue with a
+single unordered bulk_write once BATCH_SIZE records are waiting or
+FLUSH_MS milliseconds after the first one arrived, whichever comes first.
+
+Storage is bucketed per room: each chatlogs document holds up to
+BUCKET_SIZE messages of one room
+
+    {room_id, first_ts, count, messages: [...], expire_at}
+
+so a flush is one upsert per room touched, history reads and room-close
+deletes hit a handful of documents through the (room_id, first_ts) index,
+and a TTL index on expire_at removes buckets RETENTION after their last
+message. A bucket can overshoot BUCKET_SIZE by at most one batch.
+
+Overflow policy: the queue holds at most MAX_QUEUE records. When it is
+full the OLDEST pending record is dropped to make room (and counted in
+`dropped`), so a stalled database never blocks message relaying and the
+most recent context -- what reports look at -- is kept. A batch whose
+insert fails is logged and counted in `failed`, not retried.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+class ChatLogWriter:
+    def __init__(self, collection, batch_size=200, flush_ms=500, max_queue=20000,
+                 bucket_size=100, retention_days=30):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.retention = timedelta(days=retention_days)
+        self.flush_interval = flush_ms / 1000
+        self.max_queue = max_queue
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def enqueue(self, record):
+        if len(self._queue) >= self.max_queue:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(record)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self._queue))
+        if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def discard_room(self, room_id):
+        """Drop pending records of a room whose logs are being deleted"""
+        kept = [r for r in self._queue if r.get("room_id") != room_id]
+        if len(kept) != len(self._queue):
+            self._queue = deque(kept)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Chat log writer started (batch={self.batch_size}, "
+                f"flush={int(self.flush_interval * 1000)}ms, max_queue={self.max_queue})"
+            )
+
+    async def stop(self):
+        """Stop the worker and write out everything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_all()
+        logger.info(f"Chat log writer stopped ({self.written} written, {self.dropped} dropped)")
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Give the batch up to flush_interval to fill before writing
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            self._wakeup.clear()
+            while self._queue:
+                if not await self.flush() or len(self._queue) < self.batch_size:
+                    break
+            if self._queue:
+                self._wakeup.set()
+
+    async def flush(self):
+        """Write up to one batch; returns False if the write failed"""
+        async with self._flush_lock:
+            if not self._queue:
+                return True
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                await self.collection.bulk_write(self._bucket_ops(batch), ordered=False)
+                self.written += len(batch)
+                self.batches += 1
+                return True
+            except Exception as e:
+                self.errors += 1
+                self.failed += len(batch)
+                logger.error(f"Chat log flush of {len(batch)} records failed: {e}")
+                return False
+
+    def _bucket_ops(self, batch):
+        """Group a batch by room into upserts on each room's open bucket"""
+        by_room = {}
+        for record in batch:
+            message = dict(record)
+            by_room.setdefault(message.pop("room_id"), []).append(message)
+
+        expire_at = datetime.utcnow() + self.retention
+        ops = []
+        for room_id, messages in by_room.items():
+            for i in range(0, len(messages), self.bucket_size):
+                chunk = messages[i:i + self.bucket_size]
+                ops.append(UpdateOne(
+                    {"room_id": room_id, "count": {"$lt": self.bucket_size}},
+                    {
+                        "$push": {"messages": {"$each": chunk}},
+                        "$inc": {"count": len(chunk)},
+                        "$setOnInsert": {"first_ts": chunk[0].get("timestamp") or time.time()},
+                        "$max": {"expire_at": expire_at}
+                    },
+                    upsert=True
+                ))
+        return ops
+
+    async def flush_all(self):
+        while self._queue:
+            if not await self.flush():
+                return
+
+    def stats(self):
+        return {
+            "queue_depth": len(self._queue),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "errors": self.errors,
+            "failed": self.failed
+        }
@@ -1,10 +1,49 @@
 import os
+import time
+import asyncio
 import logging
+from collections import OrderedDict
 from motor.motor_asyncio import AsyncIOMotorClient
-from models import default_user
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.collation import Collation
+from models import default_user, User, Room, USER_VIEWS
+from chatlog_writer import ChatLogWriter
+from recent_partners import RecentPartners
+from room_activity import RoomActivity
+from match_stats import MatchStats
+from content_filter import BlockedWordFilter
+from strikes import StrikeTracker
+from mongo_monitor import command_monitor
+import update_scope
 from datetime import datetime
+from types import SimpleNamespace
 
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+MONGODB_DB = os.getenv("MONGODB_DB", "anonindochat")
+# Case-insensitive comparison, matches the username_ci index
+CASE_INSENSITIVE = Collation(locale="en", strength=2)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+CHATLOG_BATCH_SIZE = int(os.getenv("CHATLOG_BATCH_SIZE", "200"))
+CHATLOG_FLUSH_MS = int(os.getenv("CHATLOG_FLUSH_MS", "500"))
+CHATLOG_MAX_QUEUE = int(os.getenv("CHATLOG_MAX_QUEUE", "20000"))
+CHATLOG_BUCKET_SIZE = int(os.getenv("CHATLOG_BUCKET_SIZE", "100"))
+CHATLOG_RETENTION_DAYS = int(os.getenv("CHATLOG_RETENTION_DAYS", "30"))
+CLEANUP_PAGE_SIZE = int(os.getenv("CLEANUP_PAGE_SIZE", "1000"))
+RECENT_PARTNERS_K = int(os.getenv("RECENT_PARTNERS_K", "5"))
+RECENT_PARTNERS_MAX_USERS = int(os.getenv("RECENT_PARTNERS_MAX_USERS", "50000"))
+MATCH_STATS_RETENTION_DAYS = int(os.getenv("MATCH_STATS_RETENTION_DAYS", "90"))
+BLOCKED_WORDS_CHECK_SECONDS = float(os.getenv("BLOCKED_WORDS_CHECK_SECONDS", "30"))
+LINK_STRIKE_LIMIT = int(os.getenv("LINK_STRIKE_LIMIT", "3"))
+LINK_STRIKE_WINDOW_SECONDS = int(os.getenv("LINK_STRIKE_WINDOW_SECONDS", "86400"))
+LINK_STRIKE_MAX_USERS = int(os.getenv("LINK_STRIKE_MAX_USERS", "50000"))
+# Seconds a cached route is trusted before resolve_user_route re-reads
+# user_rooms. Replicas sharing the pool (POOL_BACKEND=mongo) can close each
+# other's rooms; a lone replica is the only writer and trusts its routes (0).
+ROUTE_RECHECK_SECONDS = float(os.getenv(
+    "ROUTE_RECHECK_SECONDS", "30" if os.getenv("POOL_BACKEND", "memory").lower() == "mongo" else "0"
+))
 logger = logging.getLogger(__name__)
 
 try:
@@ -14,18 +53,51 @@ try:
         connectTimeoutMS=10000,
         socketTimeoutMS=10000,
         maxPoolSize=50,
-        minPoolSize=10
+        minPoolSize=10,
+        event_listeners=[command_monitor]
     )
 except Exception as e:
     logger.error(f"MongoDB client initialization failed: {e}")
 
-db = client["anonindochat"]
+db = client[MONGODB_DB]
+
+chat_log_writer = ChatLogWriter(
+    db.chatlogs,
+    batch_size=CHATLOG_BATCH_SIZE,
+    flush_ms=CHATLOG_FLUSH_MS,
+    max_queue=CHATLOG_MAX_QUEUE,
+    bucket_size=CHATLOG_BUCKET_SIZE,
+    retention_days=CHATLOG_RETENTION_DAYS
+)
+
+recent_partners = RecentPartners(k=RECENT_PARTNERS_K, max_users=RECENT_PARTNERS_MAX_USERS)
+
+room_activity = RoomActivity(db.rooms)
+
+match_stats = MatchStats(db.match_stats)
+
+blocked_word_filter = BlockedWordFilter(db.blocked_words, db.meta, check_seconds=BLOCKED_WORDS_CHECK_SECONDS)
+
+link_strikes = StrikeTracker(
+    db.strikes,
+    "link",
+    window=LINK_STRIKE_WINDOW_SECONDS,
+    keep=max(LINK_STRIKE_LIMIT, 10),
+    max_users=LINK_STRIKE_MAX_USERS
+)
+
+# Set by test_connection(): multi-document transactions need a replica set
+# or a sharded cluster
+supports_transactions = False
 
 async def test_connection():
     """Test MongoDB connection - call this at startup"""
+    global supports_transactions
     try:
         await client.server_info()
-        logger.info("✅ MongoDB connection successful")
+        hello = await client.admin.command("hello")
+        supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+        logger.info(f"✅ MongoDB connection successful (transactions: {supports_transactions})")
         return True
     except Exception as e:
         logger.error(f"❌ MongoDB connection failed: {e}")
@@ -36,150 +108,490 @@ async def create_indexes():
     try:
         await db.users.create_index("user_id", unique=True)
         await db.users.create_index("username")
+        await db.users.create_index("username", collation=CASE_INSENSITIVE, name="username_ci")
         await db.users.create_index("is_premium")
+        await db.users.create_index([("is_premium", 1), ("premium_expiry", 1)])
         await db.users.create_index("is_online")
+        await db.users.create_index("blocked")
+        await db.users.create_index([("referral_count", -1)])
         await db.rooms.create_index("room_id", unique=True)
         await db.rooms.create_index("active")
+        await db.rooms.create_index("last_message_at")
         await db.premium_queue.create_index("user_id", unique=True)
+        await db.premium_queue.create_index("added_at")
+        await db.premium_queue.create_index("expire_at", expireAfterSeconds=0)
+        # Waiting pool (POOL_BACKEND=mongo): claims filter on a subset of the
+        # profile keys and take the oldest, so every index ends in added_at
+        await db.waiting_pool.create_index("added_at")
+        await db.waiting_pool.create_index("expire_at", expireAfterSeconds=0)
+        await db.waiting_pool.create_index([("gender", 1), ("added_at", 1)])
+        await db.waiting_pool.create_index([("region", 1), ("added_at", 1)])
+        await db.waiting_pool.create_index([("language", 1), ("added_at", 1)])
+        await db.waiting_pool.create_index([("gender", 1), ("region", 1), ("language", 1), ("added_at", 1)])
         await db.user_rooms.create_index("user_id", unique=True)
         await db.user_rooms.create_index("room_id")
         await db.blocked_words.create_index("word", unique=True)
+        await db.reports.create_index("reviewed")
+        await db.chatlogs.create_index([("room_id", 1), ("first_ts", 1)])
+        await db.chatlogs.create_index("expire_at", expireAfterSeconds=0)
+        # One rollup per hour; the TTL drops hours older than the retention
+        await db.match_stats.create_index(
+            "hour", unique=True, expireAfterSeconds=MATCH_STATS_RETENTION_DAYS * 86400
+        )
+        await db.strikes.create_index([("kind", 1), ("user_id", 1)], unique=True)
+        await db.strikes.create_index("expire_at", expireAfterSeconds=0)
         logger.info("✅ Database indexes created")
     except Exception as e:
         logger.warning(f"Index creation warning: {e}")
 
+def _user_defaults(user_id, username="", phone_number="", full_name="", first_name=""):
+    """Build the models.default_user document for a bare user id"""
+    return default_user(SimpleNamespace(
+        id=user_id,
+        username=username,
+        phone_number=phone_number,
+        full_name=full_name,
+        first_name=first_name
+    ))
+
+def _fill_defaults(user):
+    """Add any missing default_user fields to a stored user document"""
+    defaults = _user_defaults(
+        user['user_id'],
+        username=user.get('username', ''),
+        phone_number=user.get('phone_number', ''),
+        full_name=user.get('name', ''),
+        first_name=user.get('first_name', '')
+    )
+    for k, v in defaults.items():
+        if k not in user:
+            user[k] = v
+    return user
+
+class UserCache:
+    """
+    Bounded LRU cache of users, stored as slotted models.User records,
+    with a per-entry TTL. Writers in this module keep it in sync
+    (write-through or invalidate), the TTL bounds staleness from writes
+    made elsewhere.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, record = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return record
+
+    def put(self, user_id, doc):
+        """Cache doc as a User record and return the record, which takes over doc's nested values"""
+        record = User.from_doc(doc)
+        if self.maxsize <= 0:
+            return record
+        self._entries[user_id] = (time.monotonic() + self.ttl, record)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return record
+
+    def patch(self, user_id, updates):
+        """Apply $set-style updates to a cached entry, keeping its expiry"""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry[1].update(updates)
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+def user_cache_stats():
+    return user_cache.stats()
+
 async def get_user(user_id):
+    scope = update_scope.for_user(user_id)
+    if scope is not None and scope.user is not None:
+        scope.hits += 1
+        return scope.user.to_dict()
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        if scope is not None:
+            scope.user = cached
+        return cached.to_dict()
     user = await db.users.find_one({"user_id": user_id})
-    username = ""
-    phone_number = ""
-    full_name = ""
-    first_name = ""
-    if user:
-        username = user.get('username', '')
-        phone_number = user.get('phone_number', '')
-        full_name = user.get('name', '')
-        first_name = user.get('first_name', '')
-        defaults = default_user(type('TelegramUser', (), {
-            'id': user_id,
-            'username': username,
-            'phone_number': phone_number,
-            'full_name': full_name,
-            'first_name': first_name
-        })())
-        for k, v in defaults.items():
-            if k not in user:
-                user[k] = v
-    return user
+    if not user:
+        return user
+    _fill_defaults(user)
+    record = user_cache.put(user_id, user)
+    if scope is not None:
+        scope.user = record
+    # The record shares user's nested dicts and lists; hand out a copy, as a hit does
+    return record.to_dict()
+
+async def prefetch_user(user_id):
+    """
+    Load the user into the current update_scope, so the update's handlers
+    read it from there instead of each fetching it
+    """
+    scope = update_scope.for_user(user_id)
+    if scope is not None and scope.user is None:
+        await get_user(user_id)
+
+async def get_user_view(user_id, view):
+    """
+    Fetch a read-only models.User holding at least the fields of
+    models.USER_VIEWS[view]. Served from the user cache when possible,
+    otherwise only those fields are pulled from MongoDB.
+    """
+    scope = update_scope.for_user(user_id)
+    if scope is not None and scope.user is not None:
+        scope.hits += 1
+        return scope.user
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    projection = {field: 1 for field in USER_VIEWS[view]}
+    projection["_id"] = 0
+    return User.from_doc(await db.users.find_one({"user_id": user_id}, projection))
 
 async def get_user_by_username(username):
     user = await db.users.find_one({"username": username})
-    user_id = user['user_id'] if user else 0
-    phone_number = user.get('phone_number', '') if user else ''
-    full_name = user.get('name', '') if user else ''
-    first_name = user.get('first_name', '') if user else ''
-    defaults = default_user(type('TelegramUser', (), {
-        'id': user_id,
-        'username': username,
-        'phone_number': phone_number,
-        'full_name': full_name,
-        'first_name': first_name
-    })())
     if user:
-        for k, v in defaults.items():
-            if k not in user:
-                user[k] = v
+        _fill_defaults(user)
     return user
 
-async def update_user(user_id, updates):
-    doc = await db.users.find_one({"user_id": user_id})
-    username = updates.get('username', '')
-    phone_number = updates.get('phone_number', '')
-    full_name = updates.get('name', '')
-    first_name = updates.get('first_name', '')
-    if not doc:
-        temp_user = type('TelegramUser', (), {
-            'id': user_id,
-            'username': username,
-            'phone_number': phone_number,
-            'full_name': full_name,
-            'first_name': first_name
-        })()
-        full_doc = default_user(temp_user)
-        full_doc.update(updates)
-        await db.users.update_one({"user_id": user_id}, {"$set": full_doc}, upsert=True)
+async def get_user_by_username_ci(username):
+    """Case-insensitive username lookup served by the username_ci index"""
+    user = await db.users.find_one({"username": username}, collation=CASE_INSENSITIVE)
+    if user:
+        _fill_defaults(user)
+    return user
+
+async def update_user(user_id, updates=None, inc=None, max_=None):
+    """
+    Atomically update a user in a single round-trip.
+
+    Only the given fields are written: `updates` goes to $set, `inc` to $inc
+    and `max_` to $max. The remaining models.default_user fields are written
+    with $setOnInsert, so a first write still creates a complete document.
+    """
+    updates = {k: v for k, v in (updates or {}).items() if k != "_id"}
+    ops = {}
+    if updates:
+        ops["$set"] = updates
+    if inc:
+        ops["$inc"] = inc
+    if max_:
+        ops["$max"] = max_
+
+    touched = set(updates) | set(inc or {}) | set(max_ or {})
+    defaults = _user_defaults(
+        user_id,
+        username=updates.get('username', ''),
+        phone_number=updates.get('phone_number', ''),
+        full_name=updates.get('name', ''),
+        first_name=updates.get('first_name', '')
+    )
+    on_insert = {k: v for k, v in defaults.items() if k not in touched and k != "user_id"}
+    if on_insert:
+        ops["$setOnInsert"] = on_insert
+
+    await db.users.update_one({"user_id": user_id}, ops, upsert=True)
+
+    scope = update_scope.for_user(user_id)
+    if inc or max_:
+        # Result depends on the stored value, let the next read refetch it
+        user_cache.invalidate(user_id)
+        if scope is not None:
+            scope.user = None
     else:
-        doc.update(updates)
-        defaults = default_user(type('TelegramUser', (), {
-            'id': user_id,
-            'username': doc.get('username', ''),
-            'phone_number': doc.get('phone_number', ''),
-            'full_name': doc.get('name', ''),
-            'first_name': doc.get('first_name', '')
-        })())
-        for k, v in defaults.items():
-            if k not in doc:
-                doc[k] = v
-        await db.users.update_one({"user_id": user_id}, {"$set": doc}, upsert=True)
+        user_cache.patch(user_id, updates)
+        if scope is not None and scope.user is not None:
+            scope.user.update(updates)
 
 # ===== ROOM MAPPING FUNCTIONS (DATABASE-BACKED) =====
 
-async def set_user_room(user_id, room_id):
-    """Store user's current room in database - PERSISTENT across restarts"""
-    await db.user_rooms.update_one(
-        {"user_id": user_id},
-        {"$set": {
-            "room_id": room_id, 
-            "updated_at": datetime.utcnow()
-        }},
-        upsert=True
-    )
-    logger.info(f"Set user {user_id} to room {room_id}")
+# user_id -> (room_id, partner_id). Written through to user_rooms on every
+# change and rebuilt by load_routes() at startup, so relaying a message
+# resolves the recipient without touching MongoDB.
+_routes = {}
+# user_id -> monotonic time its route was last written or read from user_rooms
+_route_checked = {}
+
+def _cache_route(user_id, route):
+    _routes[user_id] = route
+    _route_checked[user_id] = time.monotonic()
+
+def _drop_route(user_id):
+    _routes.pop(user_id, None)
+    _route_checked.pop(user_id, None)
+
+def _scope_room(user_id=None, room_id=update_scope.UNKNOWN):
+    """
+    Keep the update_scope's room in step with a mapping write: set it for
+    a write to the scope's own user, forget it (look it up again) otherwise
+    """
+    scope = update_scope.current()
+    if scope is not None and (user_id is None or scope.user_id == user_id):
+        scope.room_id = room_id
+
+def get_user_route(user_id):
+    """Return (room_id, partner_id) for a user in a room, else None"""
+    return _routes.get(user_id)
+
+async def _reload_route(user_id):
+    doc = await db.user_rooms.find_one({"user_id": user_id}, {"_id": 0, "room_id": 1, "partner_id": 1})
+    if not doc or not doc.get("room_id"):
+        _drop_route(user_id)
+        return None
+    route = (doc["room_id"], doc.get("partner_id"))
+    _cache_route(user_id, route)
+    return route
+
+async def resolve_user_route(user_id):
+    """
+    Like get_user_route, but a miss falls back once to user_rooms and
+    caches what it finds, so relaying still works for rooms this process
+    has not seen: opened by another replica, or before a restart finished
+    load_routes(). A route cached longer than ROUTE_RECHECK_SECONDS is
+    re-read too, so a room another replica closed stops being relayed.
+    """
+    route = _routes.get(user_id)
+    if route is not None and (
+        not ROUTE_RECHECK_SECONDS
+        or time.monotonic() - _route_checked.get(user_id, 0) < ROUTE_RECHECK_SECONDS
+    ):
+        return route
+    return await _reload_route(user_id)
+
+async def confirm_user_route(user_id):
+    """
+    get_user_route for pairing decisions, which must not act on a room
+    another replica closed: with ROUTE_RECHECK_SECONDS set, a cached route
+    is re-read from user_rooms first. A miss is not looked up; open_room
+    catches a room this process has not seen.
+    """
+    if not ROUTE_RECHECK_SECONDS or user_id not in _routes:
+        return _routes.get(user_id)
+    return await _reload_route(user_id)
+
+async def load_routes():
+    """Rebuild the in-memory routing table from user_rooms"""
+    _routes.clear()
+    _route_checked.clear()
+    by_room = {}
+    async for doc in db.user_rooms.find({}, {"_id": 0, "user_id": 1, "room_id": 1, "partner_id": 1}):
+        by_room.setdefault(doc["room_id"], []).append(doc)
+    for room_id, docs in by_room.items():
+        for doc in docs:
+            partner_id = doc.get("partner_id")
+            if partner_id is None:
+                # Mapping written before partner_id existed
+                others = [d["user_id"] for d in docs if d["user_id"] != doc["user_id"]]
+                partner_id = others[0] if others else None
+            _cache_route(doc["user_id"], (room_id, partner_id))
+    logger.info(f"Loaded {len(_routes)} room routes")
+    return len(_routes)
 
 async def get_user_room(user_id):
     """Get user's current room from database"""
+    scope = update_scope.for_user(user_id)
+    if scope is not None and scope.room_id is not update_scope.UNKNOWN:
+        scope.hits += 1
+        return scope.room_id
     doc = await db.user_rooms.find_one({"user_id": user_id})
-    return doc["room_id"] if doc else None
+    room_id = doc["room_id"] if doc else None
+    route = _routes.get(user_id)
+    if route and route[0] != room_id:
+        # Cached by resolve_user_route, and since closed by another replica
+        _drop_route(user_id)
+    if scope is not None:
+        scope.room_id = room_id
+    return room_id
 
 async def remove_user_room(user_id):
     """Remove user from room mapping"""
+    _drop_route(user_id)
     result = await db.user_rooms.delete_one({"user_id": user_id})
+    _scope_room(user_id, None)
     if result.deleted_count > 0:
         logger.info(f"Removed user {user_id} from room mapping")
 
-async def get_room_users(room_id):
-    """Get all users in a specific room"""
-    cursor = db.user_rooms.find({"room_id": room_id})
-    users = []
-    async for doc in cursor:
-        users.append(doc["user_id"])
-    return users
+async def _in_transaction(write):
+    """
+    Run write(session) inside a transaction when the deployment supports
+    it, otherwise run it directly with session=None.
+    """
+    if not supports_transactions:
+        return await write(None)
+    async with await client.start_session() as session:
+        async with session.start_transaction():
+            return await write(session)
+
+async def open_room(room, user1, user2):
+    """
+    Insert a room and map both of its users to it, but only if neither user
+    is mapped to a room yet. The mapping upserts match only a free slot
+    ({user_id, room_id: None}); for a user already in a room the upsert
+    collides with the unique user_id index and the whole claim is undone
+    (rolled back, or compensated without transactions).
+    Returns False when the claim lost to another room.
+    """
+    room_id = room["room_id"]
+    now = datetime.utcnow()
+
+    async def write(session):
+        await db.rooms.insert_one(room, session=session)
+        await db.user_rooms.bulk_write([
+            UpdateOne(
+                {"user_id": uid, "room_id": None},
+                {"$set": {"room_id": room_id, "partner_id": partner_id, "updated_at": now}},
+                upsert=True
+            )
+            for uid, partner_id in ((user1, user2), (user2, user1))
+        ], ordered=True, session=session)
+
+    try:
+        await _in_transaction(write)
+    except (BulkWriteError, DuplicateKeyError) as e:
+        if isinstance(e, BulkWriteError):
+            errors = e.details.get("writeErrors", [])
+            if not errors or any(err.get("code") != 11000 for err in errors):
+                raise
+        if not supports_transactions:
+            await db.user_rooms.delete_many({"room_id": room_id})
+            await db.rooms.delete_one({"room_id": room_id})
+        logger.info(f"Room {room_id} not opened: {user1} or {user2} is already in a room")
+        return False
 
-async def clear_room_mappings(room_id):
-    """Remove all users from a specific room"""
-    result = await db.user_rooms.delete_many({"room_id": room_id})
-    logger.info(f"Cleared {result.deleted_count} users from room {room_id}")
+    _cache_route(user1, (room_id, user2))
+    _cache_route(user2, (room_id, user1))
+    _scope_room()
+    logger.info(f"Opened room {room_id} for {user1} and {user2}")
+    return True
 
-async def insert_room(room):
-    await db.rooms.insert_one(room)
+async def close_room_records(room_id):
+    """Delete a room and every user mapping that points at it"""
+    async def write(session):
+        await db.user_rooms.delete_many({"room_id": room_id}, session=session)
+        await db.rooms.delete_one({"room_id": room_id}, session=session)
+
+    await _in_transaction(write)
+    room_activity.discard(room_id)
+    for uid in [uid for uid, route in _routes.items() if route[0] == room_id]:
+        _drop_route(uid)
+    _scope_room()
 
 async def get_room(room_id):
     return await db.rooms.find_one({"room_id": room_id})
 
+async def get_room_view(room_id, fields):
+    """Fetch a models.Room holding only the given fields"""
+    projection = {field: 1 for field in fields}
+    projection["_id"] = 0
+    return Room.from_doc(await db.rooms.find_one({"room_id": room_id}, projection))
+
 async def update_room(room_id, updates):
     await db.rooms.update_one({"room_id": room_id}, {"$set": updates})
 
-async def delete_room(room_id):
-    await db.rooms.delete_one({"room_id": room_id})
-
 async def log_chat(room_id, msg):
-    await db.chatlogs.insert_one({"room_id": room_id, **msg})
+    """Queue a chat log record; chat_log_writer writes it in the background"""
+    chat_log_writer.enqueue({"room_id": room_id, **msg})
+    room_activity.touch(room_id)
+
+def chat_log_stats():
+    return chat_log_writer.stats()
+
+async def backfill_room_activity():
+    """Give rooms created before last_message_at existed their creation time"""
+    result = await db.rooms.update_many(
+        {"last_message_at": {"$exists": False}},
+        [{"$set": {"last_message_at": "$created_at"}}]
+    )
+    return result.modified_count
+
+async def find_idle_rooms(cutoff, limit=500):
+    """Rooms whose last message (or creation) is older than the cutoff timestamp"""
+    await room_activity.flush()
+    cursor = db.rooms.find(
+        {"last_message_at": {"$lt": cutoff}},
+        {"_id": 0, "room_id": 1, "users": 1, "last_message_at": 1}
+    ).sort("last_message_at", 1).limit(limit)
+    return [Room.from_doc(doc) async for doc in cursor]
+
+def room_activity_stats():
+    return room_activity.stats()
+
+def match_stats_snapshot():
+    return match_stats.snapshot()
+
+async def add_link_strike(user_id):
+    """Record a forbidden link; returns the user's link strikes within the window"""
+    return await link_strikes.add(user_id)
+
+def link_strike_stats():
+    return link_strikes.stats()
+
+async def flush_recent_partners():
+    """Append newly recorded partners to users' stored histories in one bulk write"""
+    pending = recent_partners.pop_pending()
+    if not pending:
+        return 0
+    ops = [
+        UpdateOne(
+            {"user_id": user_id},
+            {"$push": {"recent_partners": {"$each": partners, "$slice": -recent_partners.k}}}
+        )
+        for user_id, partners in pending.items()
+    ]
+    await db.users.bulk_write(ops, ordered=False)
+    for user_id in pending:
+        user_cache.invalidate(user_id)
+    return len(ops)
 
 async def get_chat_history(room_id):
-    cursor = db.chatlogs.find({"room_id": room_id})
-    return [doc async for doc in cursor]
+    await chat_log_writer.flush_all()
+    cursor = db.chatlogs.find({"room_id": room_id}).sort("first_ts", 1)
+    history = []
+    async for doc in cursor:
+        if "messages" not in doc:
+            # Unbucketed record from before chat logs were bucketed
+            history.append(doc)
+            continue
+        history.extend({"room_id": room_id, **msg} for msg in doc["messages"])
+    return history
 
 async def delete_chat_logs(room_id):
     """Delete all chat logs for a room"""
+    chat_log_writer.discard_room(room_id)
     result = await db.chatlogs.delete_many({"room_id": room_id})
     return result.deleted_count
 
@@ -192,14 +604,20 @@ async def insert_blocked_word(word):
         {"$set": {"word": word.lower()}}, 
         upsert=True
     )
+    await blocked_word_filter.bump_version()
 
 async def remove_blocked_word(word):
     await db.blocked_words.delete_one({"word": word.lower()})
+    await blocked_word_filter.bump_version()
 
 async def get_blocked_words():
     cursor = db.blocked_words.find({})
     return [doc["word"] async for doc in cursor]
 
+async def find_blocked_word(text, normalized=False):
+    """First blocked word in text, or None; see content_filter"""
+    return await blocked_word_filter.find(text, normalized)
+
 async def mark_user_online(user_id):
     """Mark user as online"""
     await update_user(user_id, {
@@ -220,16 +638,65 @@ async def mark_all_users_offline():
         {},
         {"$set": {"is_online": False}}
     )
+    user_cache.clear()
     logger.info(f"Marked {result.modified_count} users as offline")
 
-async def cleanup_stale_rooms():
-    """Clean up stale room mappings (rooms that don't exist)"""
+async def cleanup_stale_rooms(page_size=CLEANUP_PAGE_SIZE):
+    """
+    Clean up stale room mappings (rooms that don't exist or are inactive).
+
+    Walks user_rooms in _id order, one page at a time: a single $lookup
+    aggregation finds the orphaned mappings of the page and one delete_many
+    removes them. The loop yields between pages so it never holds the
+    event loop for long.
+    """
+    started = time.monotonic()
+    scanned = 0
     count = 0
-    async for mapping in db.user_rooms.find({}):
-        room = await get_room(mapping["room_id"])
-        if not room or not room.get("active", False):
-            await remove_user_room(mapping["user_id"])
-            count += 1
+    last_id = None
+    while True:
+        match = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"_id": 1}},
+            {"$limit": page_size},
+            {"$lookup": {
+                "from": "rooms",
+                "localField": "room_id",
+                "foreignField": "room_id",
+                "as": "room"
+            }},
+            {"$project": {
+                "user_id": 1,
+                "room_id": 1,
+                "active": {"$anyElementTrue": [{"$ifNull": ["$room.active", []]}]}
+            }}
+        ]
+        page = [doc async for doc in db.user_rooms.aggregate(pipeline)]
+        if not page:
+            break
+        scanned += len(page)
+        last_id = page[-1]["_id"]
+
+        stale = [doc for doc in page if not doc["active"]]
+        if stale:
+            # Match on room_id too so a user re-mapped meanwhile is kept
+            result = await db.user_rooms.delete_many({"$or": [
+                {"_id": doc["_id"], "room_id": doc["room_id"]} for doc in stale
+            ]})
+            count += result.deleted_count
+            for doc in stale:
+                route = _routes.get(doc["user_id"])
+                if route and route[0] == doc["room_id"]:
+                    _drop_route(doc["user_id"])
+
+        if len(page) < page_size:
+            break
+        await asyncio.sleep(0)
+
+    elapsed_ms = (time.monotonic() - started) * 1000
     if count > 0:
-        logger.info(f"Cleaned up {count} stale room mappings")
+        logger.info(f"Cleaned up {count} stale room mappings ({scanned} scanned in {elapsed_ms:.0f}ms)")
+    else:
+        logger.debug(f"No stale room mappings ({scanned} scanned in {elapsed_ms:.0f}ms)")
     return count
@@ -1,11 +1,14 @@
 from telegram import Update
 from admin import (block_user, unblock_user, send_admin_message, get_stats,
                    add_blocked_word, remove_blocked_word, approve_premium, send_global_announcement)
-from db import (get_user, get_user_by_username, get_room, get_chat_history, update_user, db,
-                get_user_room, set_user_room, remove_user_room)
+from db import (get_user, get_user_by_username, get_user_by_username_ci, get_room, get_chat_history, update_user, db,
+                get_user_room, remove_user_room)
 from datetime import datetime, timedelta
-from rooms import create_room, close_room, users_online, remove_from_pool
+from rooms import create_room, close_room
+from handlers.message_router import screen
+from handlers.ratelimit import rate_limiter
 from helpers import make_mention
+from mongo_monitor import command_monitor
 import json
 from io import BytesIO
 import asyncio
@@ -41,23 +44,8 @@ async def _lookup_user(identifier):
     if user:
         return user
 
-    user = await db.users.find_one({"username": {"$regex": f"^{uname}$", "$options": "i"}})
+    user = await get_user_by_username_ci(uname)
     if user:
-        from models import default_user
-        username = user.get('username', '')
-        phone_number = user.get('phone_number', '')
-        full_name = user.get('name', '')
-        first_name = user.get('first_name', '')
-        defaults = default_user(type('TelegramUser', (), {
-            'id': user['user_id'],
-            'username': username,
-            'phone_number': phone_number,
-            'full_name': full_name,
-            'first_name': first_name
-        })())
-        for k, v in defaults.items():
-            if k not in user:
-                user[k] = v
         return user
 
     return None
@@ -297,8 +285,9 @@ async def admin_adminroom(update: Update, context):
         return
 
     room_id = await create_room(admin_id, user_id)
-    await set_user_room(admin_id, room_id)
-    await set_user_room(user_id, room_id)
+    if not room_id:
+        await update.message.reply_text(f"❌ You or user {user_id} are already in a chat room.")
+        return
     context.user_data["room_id"] = room_id
 
     try:
@@ -374,18 +363,14 @@ async def admin_linkusers(update: Update, context):
 
     from handlers.match import remove_from_premium_queue
 
-    if user1_id in users_online:
-        remove_from_pool(user1_id)
-    if user2_id in users_online:
-        remove_from_pool(user2_id)
+    room_id = await create_room(user1_id, user2_id)
+    if not room_id:
+        await update.message.reply_text("❌ One of the users was matched with someone else in the meantime.")
+        return
 
     await remove_from_premium_queue(user1_id)
     await remove_from_premium_queue(user2_id)
 
-    room_id = await create_room(user1_id, user2_id)
-    await set_user_room(user1_id, room_id)
-    await set_user_room(user2_id, room_id)
-
     from bot import load_locale
 
     def get_user_locale_local(user):
@@ -491,6 +476,52 @@ async def admin_stats(update: Update, context):
     for region in stats['region_distribution'][:5]:
         stats_msg += f"  • {region}\n"
 
+    cache = stats['user_cache']
+    stats_msg += (
+        f"\n🗄 *User Cache*\n"
+        f"  • Size: {cache['size']}/{cache['maxsize']}\n"
+        f"  • Hits: {cache['hits']} | Misses: {cache['misses']} | Evictions: {cache['evictions']}\n"
+    )
+
+    logq = stats['chat_log_queue']
+    stats_msg += (
+        f"\n📝 *Chat Log Queue*\n"
+        f"  • Depth: {logq['queue_depth']} (max {logq['max_depth']})\n"
+        f"  • Written: {logq['written']} in {logq['batches']} batches\n"
+        f"  • Dropped: {logq['dropped']} | Failed: {logq['failed']}\n"
+    )
+
+    matching = stats['matching']
+    stats_msg += "\n🎯 *Matching* (since restart)\n"
+    for kind, counts in matching['searches'].items():
+        wait = matching['time_to_match'].get(kind, {})
+        stats_msg += (
+            f"  • {kind}: {counts['searches']} searches, {counts['matched']} matched, "
+            f"{counts['cancelled']} cancelled, {counts['expired']} expired "
+            f"(wait p50 {wait.get('p50', 0)}s, p95 {wait.get('p95', 0)}s)\n"
+        )
+    stats_msg += (
+        f"  • Rooms: {matching['rooms_opened']} opened, "
+        f"{matching['short_rooms']} ended within {matching['short_room_seconds']}s\n"
+    )
+
+    screening = screen.snapshot()
+    stats_msg += (
+        f"\n🛡 *Message Screening*\n"
+        f"  • Screened: {screening['screened']} (p95 {screening['total_ms']['p95']}ms)\n"
+    )
+    for name, rule in screening['rules'].items():
+        stats_msg += f"  • {name.replace('_', ' ')}: {rule['hits']} stopped, p95 {rule['ms']['p95']}ms\n"
+
+    limits = rate_limiter.stats()
+    stats_msg += f"\n🚦 *Rate Limiting*\n  • Users tracked: {limits['users']}\n"
+    for action, limit in limits['limits'].items():
+        stats_msg += (
+            f"  • {action}: {limits['allowed'].get(action, 0)} allowed, "
+            f"{limits['rejected'].get(action, 0)} rejected, {limits['cooldowns'].get(action, 0)} cooldowns "
+            f"(burst {limit['burst']}, {limit['per_minute']:g}/min)\n"
+        )
+
     await update.message.reply_text(stats_msg, parse_mode='Markdown')
 
     await update.message.reply_text(
@@ -686,3 +717,26 @@ async def admin_viewhistory(update: Update, context):
         )
     else:
         await update.message.reply_text("No chat history found.")
+
+
+async def admin_dbstats(update: Update, context):
+    """Dump MongoDB latency histograms and the slow-query log as JSON."""
+    if not _is_admin(update, context):
+        await update.message.reply_text("Unauthorized.")
+        return
+
+    snapshot = command_monitor.snapshot()
+    file = BytesIO(json.dumps(snapshot, indent=2, default=str, ensure_ascii=False).encode('utf-8'))
+    file.name = f"dbstats_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
+
+    per_update = snapshot["commands_per_update"]
+    await update.message.reply_document(
+        document=file,
+        filename=file.name,
+        caption=(
+            f"🗃 MongoDB command stats\n"
+            f"Commands per update: avg {per_update['avg']}, p95 {per_update['p95']}\n"
+            f"Lookups served from the update scope: avg {snapshot['scope_hits_per_update']['avg']} per update\n"
+            f"Slow queries (>{snapshot['slow_threshold_ms']:.0f}ms): {len(snapshot['slow_queries'])}"
+        )
+    )
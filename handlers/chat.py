@@ -1,6 +1,6 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from db import get_room, update_room, log_chat, get_blocked_words
+from db import get_room, update_room, log_chat, find_blocked_word, add_link_strike, LINK_STRIKE_LIMIT
 import re
 
 # Regex for links and Telegram bot usernames (robust, covers most common cases)
@@ -8,9 +8,6 @@ link_or_bot_regex = re.compile(
     r'(http[s]?://|www\.|\.com|\.net|\.org|\.me|\.io|\.ly|\.ru|\.ir|\.in|\.id|@[\w\d_]{5,32}bot\b)',
     re.IGNORECASE
 )
-user_link_strike_counter = {}
-
-MAX_LINK_STRIKES = 3  # 3 strikes: then notify admin with #spam
 
 async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -24,28 +21,25 @@ async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Not in a room. Use /find to start a chat.")
         return
 
-    blocked_words = await get_blocked_words()
-    for word in blocked_words:
-        if word.lower() in text.lower():
-            await update.message.reply_text("Your message contains a blocked word. Please be respectful.")
-            return
+    if await find_blocked_word(text):
+        await update.message.reply_text("Your message contains a blocked word. Please be respectful.")
+        return
 
     # Check for links or Telegram bot usernames
     if link_or_bot_regex.search(text):
-        # Count strikes per user per session
-        strike_key = f"{user_id}"
-        user_link_strike_counter.setdefault(strike_key, 0)
-        user_link_strike_counter[strike_key] += 1
-        if user_link_strike_counter[strike_key] < MAX_LINK_STRIKES:
+        # Strikes within the window (see strikes.py): LINK_STRIKE_LIMIT of them
+        # notify the admin group with #spam
+        strikes = await add_link_strike(user_id)
+        if strikes < LINK_STRIKE_LIMIT:
             await update.message.reply_text("Links and Telegram bot usernames are not allowed. This is against bot policy.")
             return
         else:
-            # On 3rd strike: notify admin group for block request
+            # At the limit: notify admin group for block request
             admin_group_id = context.bot_data.get("ADMIN_GROUP_ID")
             if admin_group_id:
                 await context.bot.send_message(
                     chat_id=admin_group_id,
-                    text=f"#spam User {user_id} sent forbidden links or bot usernames 3 times. Please consider blocking."
+                    text=f"#spam User {user_id} sent forbidden links or bot usernames {strikes} times. Please consider blocking."
                 )
             await update.message.reply_text("You have violated the bot policy multiple times. Admin has been notified.")
             return
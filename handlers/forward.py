@@ -6,7 +6,7 @@ logger = logging.getLogger(__name__)
 
 from telegram import Update
 from telegram.ext import ContextTypes
-from db import get_room, get_user, get_user_room
+from db import get_room_view, get_user, resolve_user_route
 from helpers import make_mention
 
 
@@ -14,12 +14,12 @@ async def forward_to_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
 
-    room_id = await get_user_room(user_id)
+    route = await resolve_user_route(user_id)
+    room_id, receiver_id = route if route else (None, None)
     admin_group_id = context.bot_data.get("ADMIN_GROUP_ID")
 
-    room = await get_room(room_id) if room_id else None
-    receiver_id = None
-    if room and "users" in room:
+    room = await get_room_view(room_id, ("users", "created_at")) if room_id else None
+    if receiver_id is None and room and room.get("users"):
         receiver_id = [uid for uid in room["users"] if uid != user_id]
         receiver_id = receiver_id[0] if receiver_id else None
     receiver = await get_user(receiver_id) if receiver_id else None
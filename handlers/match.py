@@ -1,15 +1,18 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ConversationHandler, CallbackQueryHandler, CommandHandler
 from db import (
-    get_user, get_room, delete_room, update_user, db,
-    get_user_room, set_user_room, remove_user_room
+    get_user, get_room, update_user, db,
+    get_user_room, resolve_user_route, confirm_user_route, recent_partners, find_idle_rooms, match_stats
+)
+from rooms import (
+    join_pool, add_to_pool, remove_from_pool, is_in_pool, find_match_for, release_claim, waiting_pool,
+    create_room, close_room,
+    search_deadlines, PREMIUM_SEARCH_TIMEOUT_SECONDS, SEARCH_TTL_GRACE_SECONDS, ROOM_IDLE_MINUTES
 )
-from rooms import add_to_pool, remove_from_pool, users_online, create_room, close_room
 from handlers.profile import unified_profile_entry, ASK_GENDER
 from helpers import update_user_profile_info, make_mention
 from membership import is_member, send_join_prompt
-import random
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,6 +21,8 @@ SELECT_FILTER, SELECT_GENDER, SELECT_REGION, SELECT_LANGUAGE = range(4)
 REGIONS = ['Africa', 'Europe', 'Asia', 'North America', 'South America', 'Oceania', 'Antarctica']
 GENDERS = ['male', 'female']
 LANGUAGES = ['en', 'ar', 'hi', 'id']
+# Candidates tried per search when claims keep losing to concurrent updates
+MATCH_CLAIM_ATTEMPTS = 3
 
 def get_user_locale(user):
     lang = "en"
@@ -109,19 +114,6 @@ async def open_filter_menu(update: Update, context):
         )
     return SELECT_FILTER
 
-async def set_users_room_map(context, user1, user2, room_id):
-    """FIXED: Store room mapping in DATABASE"""
-    await set_user_room(user1, room_id)
-    await set_user_room(user2, room_id)
-    logger.info(f"Set room mapping: {user1} and {user2} -> {room_id}")
-
-async def remove_users_room_map(context, user1, user2=None):
-    """FIXED: Remove room mapping from DATABASE"""
-    await remove_user_room(user1)
-    if user2 is not None:
-        await remove_user_room(user2)
-    logger.info(f"Removed room mapping for: {user1}" + (f" and {user2}" if user2 else ""))
-
 def get_admin_room_meta(room, user1_id, user2_id, users_data):
     """
     Returns an HTML string with tappable inline mentions for both users.
@@ -145,42 +137,149 @@ def get_admin_room_meta(room, user1_id, user2_id, users_data):
     return txt
 
 async def add_to_premium_queue(user_id, filters):
-    """Add user to premium search queue in MongoDB"""
+    """Add user to premium search queue in MongoDB and the waiting pool"""
+    now = datetime.utcnow()
+    entry = {
+        "user_id": user_id,
+        "filters": filters,
+        "added_at": now,
+        "notified": False
+    }
+    if PREMIUM_SEARCH_TIMEOUT_SECONDS:
+        # TTL index backstop; expire_searches normally drops the request first
+        entry["expire_at"] = now + timedelta(seconds=PREMIUM_SEARCH_TIMEOUT_SECONDS + SEARCH_TTL_GRACE_SECONDS)
+        search_deadlines.schedule("premium", user_id, PREMIUM_SEARCH_TIMEOUT_SECONDS)
     await db.premium_queue.update_one(
         {"user_id": user_id},
-        {
-            "$set": {
-                "user_id": user_id,
-                "filters": filters,
-                "added_at": datetime.utcnow(),
-                "notified": False
-            }
-        },
+        {"$set": entry},
         upsert=True
     )
+    await waiting_pool.add_request(user_id, filters, now)
 
 async def remove_from_premium_queue(user_id):
-    """Remove user from premium queue"""
-    await db.premium_queue.delete_one({"user_id": user_id})
+    """Remove user from premium queue; returns the removed request document, if any"""
+    search_deadlines.cancel("premium", user_id)
+    await waiting_pool.remove_request(user_id)
+    return await db.premium_queue.find_one_and_delete({"user_id": user_id}, projection={"_id": 0})
 
-async def check_premium_queue_for_match(user_id):
-    """Check if anyone in queue matches this user's profile"""
-    user = await get_user(user_id)
+async def restore_premium_request(request, deadline=None):
+    """
+    Put back a premium request claimed for a pairing that fell through,
+    unchanged: same filters, same added_at (so the same place in the queue)
+    and the same deadline
+    """
+    user_id = request["user_id"]
+    await db.premium_queue.replace_one({"user_id": user_id}, request, upsert=True)
+    await waiting_pool.add_request(user_id, request.get("filters", {}), request.get("added_at"))
+    if deadline is not None:
+        search_deadlines.schedule("premium", user_id, 0, start=deadline)
+
+async def check_premium_queue_for_match(user_id, user):
+    """Claim the oldest queued request this user's profile satisfies; returns the request"""
     if not user:
         return None
+    exclude = recent_partners.exclusions(user_id, user)
+    return await waiting_pool.claim_request(user_id, user, exclude)
+
+async def pair_users(context, user_id, partner_id, user=None, partner=None, notify_user=True):
+    """
+    Open a room for two users, tell them (the partner always, user_id unless
+    the caller answers it itself) and post the room to the admin group.
+    Returns None, without notifying anyone, if either was paired first.
+    """
+    from bot import load_locale
+    room_id = await create_room(user_id, partner_id)
+    if not room_id:
+        return None
 
-    async for queued in db.premium_queue.find({"user_id": {"$ne": user_id}}):
-        filters = queued.get("filters", {})
-        match = True
+    if user is None:
+        user = await get_user(user_id)
+    if partner is None:
+        partner = await get_user(partner_id)
 
-        for key, val in filters.items():
-            if val and user.get(key) != val:
-                match = False
-                break
+    notify = [(partner_id, partner)]
+    if notify_user:
+        notify.insert(0, (user_id, user))
+    for uid, user_data in notify:
+        try:
+            locale = load_locale(get_user_locale(user_data))
+            await context.bot.send_message(uid, f"🎉 {locale.get('match_found', 'Match found!')}")
+        except Exception as e:
+            logger.warning(f"Could not notify user {uid}: {e}")
+
+    admin_group = context.bot_data.get('ADMIN_GROUP_ID')
+    if admin_group:
+        try:
+            room = await get_room(room_id)
+            txt = get_admin_room_meta(room, user_id, partner_id, [user, partner])
+            await context.bot.send_message(chat_id=admin_group, text=txt, parse_mode='HTML')
+            for u in [user, partner]:
+                for pid in u.get('profile_photos', [])[:10]:
+                    try:
+                        await context.bot.send_photo(chat_id=admin_group, photo=pid)
+                    except:
+                        pass
+        except Exception as e:
+            logger.warning(f"Could not notify admin group: {e}")
+    return room_id
 
-        if match:
-            return queued["user_id"]
+async def offer_to_premium_queue(context, user_id, user=None, notify_user=True):
+    """
+    Pair a free user with the oldest waiting premium request their profile
+    satisfies. Called whenever someone becomes available (enters the pool,
+    finishes their profile, is left by a partner), so premium searches are
+    answered right away instead of on the next queue sweep.
+    Returns the new room id, or None.
+    """
+    if user is None:
+        user = await get_user(user_id)
+    if not user or not user.get('gender') or not user.get('region') or not user.get('country'):
+        return None
+    if await confirm_user_route(user_id):
+        return None
 
+    while True:
+        request = await check_premium_queue_for_match(user_id, user)
+        if not request:
+            return None
+        requester = request["user_id"]
+        deadline = search_deadlines.deadline("premium", requester)
+        # MongoPool's claim already deleted the stored request and returned it
+        request = await remove_from_premium_queue(requester) or request
+        if not await confirm_user_route(requester):
+            break
+
+    room_id = await pair_users(context, user_id, requester, user=user, notify_user=notify_user)
+    if not room_id and not await confirm_user_route(requester):
+        # Lost the race for user_id; put the premium search back as it was
+        await restore_premium_request(request, deadline)
+    return room_id
+
+async def match_user(context, user_id, user, filters=None, join=False, notify_user=False):
+    """
+    Claim a partner from the waiting pool and open a room with them. A claim
+    that loses a race (the partner, or user_id, was paired by a concurrent
+    update) moves on to the next candidate, up to MATCH_CLAIM_ATTEMPTS.
+    A claimed partner who is still free after a lost race goes back to the
+    pool. With join=True the user waits in the pool when nobody is available.
+    Returns the partner id, or None.
+    """
+    for _ in range(MATCH_CLAIM_ATTEMPTS):
+        entry = await find_match_for(user_id, filters, user=user)
+        if not entry and join:
+            entry = await join_pool(user_id, user)
+        if not entry:
+            return None
+        partner = entry["user_id"]
+        if await pair_users(context, user_id, partner, user=user, notify_user=notify_user):
+            return partner
+        if not await confirm_user_route(partner):
+            # The claim took them out of the pool; nobody else will pair them
+            await release_claim(entry)
+        if await confirm_user_route(user_id):
+            return None
+    if join and not await confirm_user_route(user_id):
+        await add_to_pool(user_id, user)
     return None
 
 async def find_command(update: Update, context):
@@ -252,37 +351,16 @@ async def find_command(update: Update, context):
         await reply_func(locale.get("already_in_room", "You are already in a chat. Use /end or /next to leave first."))
         return
 
-    if user_id in users_online:
+    if await is_in_pool(user_id):
         kb = InlineKeyboardMarkup([[
             InlineKeyboardButton(f"❌ {locale.get('stop_searching', 'Stop Searching')}", callback_data="stop_search")
         ]])
         await reply_func(f"⏳ {locale.get('already_searching', 'You are already searching...')}", reply_markup=kb)
         return
 
-    queued_match = await check_premium_queue_for_match(user_id)
-    if queued_match:
-        await remove_from_premium_queue(queued_match)
-        room_id = await create_room(user_id, queued_match)
-        await set_users_room_map(context, user_id, queued_match, room_id)
-
+    match_stats.search_started(user_id, "pool")
+    if await offer_to_premium_queue(context, user_id, user, notify_user=False):
         await reply_func(f"🎉 {locale.get('match_found', 'Match found!')}")
-
-        partner_obj = await get_user(queued_match)
-        partner_lang = get_user_locale(partner_obj)
-        partner_locale = load_locale(partner_lang)
-        await context.bot.send_message(queued_match, f"🎉 {partner_locale.get('match_found', 'Match found!')}")
-
-        admin_group = context.bot_data.get('ADMIN_GROUP_ID')
-        if admin_group:
-            room = await get_room(room_id)
-            txt = get_admin_room_meta(room, user_id, queued_match, [user, partner_obj])
-            await context.bot.send_message(chat_id=admin_group, text=txt, parse_mode='HTML')
-            for u in [user, partner_obj]:
-                for pid in u.get('profile_photos', [])[:10]:
-                    try:
-                        await context.bot.send_photo(chat_id=admin_group, photo=pid)
-                    except:
-                        pass
         return
 
     kb = InlineKeyboardMarkup([[
@@ -294,14 +372,8 @@ async def find_command(update: Update, context):
         reply_markup=kb
     )
 
-    candidates = [uid for uid in users_online if uid != user_id]
-    if candidates:
-        partner = random.choice(candidates)
-        remove_from_pool(partner)
-        room_id = await create_room(user_id, partner)
-        await set_users_room_map(context, user_id, partner, room_id)
-        remove_from_pool(user_id)
-
+    partner = await match_user(context, user_id, user, join=True)
+    if partner:
         if is_callback:
             msg_id = searching_msg.message_id if hasattr(searching_msg, 'message_id') else update.callback_query.message.message_id
             chat_id = update.callback_query.message.chat_id
@@ -321,25 +393,6 @@ async def find_command(update: Update, context):
                 text=f"🎉 {locale.get('match_found', 'Match found!')}"
             )
 
-        partner_obj = await get_user(partner)
-        partner_lang = get_user_locale(partner_obj)
-        partner_locale = load_locale(partner_lang)
-        await context.bot.send_message(partner, f"🎉 {partner_locale.get('match_found', 'Match found!')}")
-
-        admin_group = context.bot_data.get('ADMIN_GROUP_ID')
-        if admin_group:
-            room = await get_room(room_id)
-            txt = get_admin_room_meta(room, user_id, partner, [user, partner_obj])
-            await context.bot.send_message(chat_id=admin_group, text=txt, parse_mode='HTML')
-            for u in [user, partner_obj]:
-                for pid in u.get('profile_photos', [])[:10]:
-                    try:
-                        await context.bot.send_photo(chat_id=admin_group, photo=pid)
-                    except:
-                        pass
-    else:
-        add_to_pool(user_id)
-
 async def stop_search_callback(update: Update, context):
     query = update.callback_query
     user_id = query.from_user.id
@@ -350,21 +403,22 @@ async def stop_search_callback(update: Update, context):
 
     await query.answer()
 
-    if user_id in users_online:
-        remove_from_pool(user_id)
+    if await remove_from_pool(user_id):
+        match_stats.search_ended(user_id, "cancelled")
         await query.edit_message_text(f"❌ {locale.get('search_cancelled', 'Search cancelled.')}")
     else:
-        in_queue = await db.premium_queue.find_one({"user_id": user_id})
-        if in_queue:
+        if await waiting_pool.has_request(user_id):
             await remove_from_premium_queue(user_id)
+            match_stats.search_ended(user_id, "cancelled")
             await query.edit_message_text(f"❌ {locale.get('search_cancelled', 'Search cancelled.')}")
         else:
             await query.edit_message_text(locale.get("not_searching", "You are not currently searching."))
 
-async def end_command(update: Update, context):
+async def end_command(update: Update, context, reason="end"):
     user_id = update.effective_user.id
 
-    room_id = await get_user_room(user_id)
+    route = await resolve_user_route(user_id)
+    room_id, other_id = route if route else (None, None)
 
     user = await get_user(user_id)
     lang = get_user_locale(user)
@@ -372,30 +426,28 @@ async def end_command(update: Update, context):
     locale = load_locale(lang)
 
     if not room_id:
-        if user_id in users_online:
-            remove_from_pool(user_id)
+        if await remove_from_pool(user_id):
+            match_stats.search_ended(user_id, "cancelled")
             await update.message.reply_text(f"❌ {locale.get('search_stopped', 'Stopped searching.')}")
             return
 
-        in_queue = await db.premium_queue.find_one({"user_id": user_id})
-        if in_queue:
+        if await waiting_pool.has_request(user_id):
             await remove_from_premium_queue(user_id)
+            match_stats.search_ended(user_id, "cancelled")
             await update.message.reply_text(f"❌ {locale.get('search_stopped', 'Stopped searching.')}")
             return
 
         await update.message.reply_text(locale.get("not_in_room", "You are not in a room."))
         return
 
-    room = await get_room(room_id)
-    other_id = None
-    if room and "users" in room:
-        for uid in room["users"]:
-            await remove_user_room(uid)
-            if uid != user_id:
-                other_id = uid
+    if other_id is None:
+        room = await get_room(room_id)
+        if room and "users" in room:
+            others = [uid for uid in room["users"] if uid != user_id]
+            other_id = others[0] if others else None
 
-    await close_room(room_id)
-    await delete_room(room_id)
+    # One batch removes the room and both user mappings
+    await close_room(room_id, reason)
     await update.message.reply_text(f"👋 {locale.get('end_chat', 'You have left the chat.')}")
 
     if other_id:
@@ -408,10 +460,76 @@ async def end_command(update: Update, context):
                 f"💔 {other_locale.get('partner_left', 'Your partner left.')}"
             )
         except Exception:
-            pass
+            other_user = None
+        # The partner is free again: answer a waiting premium search with them.
+        # The caller is not offered here; /next searches for them explicitly.
+        try:
+            await offer_to_premium_queue(context, other_id, other_user)
+        except Exception as e:
+            logger.warning(f"Premium queue check after /end failed for {other_id}: {e}")
+
+async def expire_searches(context):
+    """Job: drop searches past their deadline and ask the user whether to go on"""
+    from bot import load_locale
+    for kind, user_id in search_deadlines.pop_expired():
+        if kind == "pool":
+            if not await remove_from_pool(user_id):
+                continue
+        else:
+            if not await waiting_pool.has_request(user_id):
+                continue
+            await remove_from_premium_queue(user_id)
+        match_stats.search_ended(user_id, "expired")
+
+        user = await get_user(user_id)
+        locale = load_locale(get_user_locale(user))
+        kb = InlineKeyboardMarkup([[
+            InlineKeyboardButton(f"🔄 {locale.get('keep_searching', 'Keep searching')}",
+                                 callback_data=f"keep_searching_{kind}")
+        ]])
+        try:
+            await context.bot.send_message(
+                user_id,
+                f"⌛ {locale.get('search_expired', 'No partner found for a while, so your search was stopped. Still searching?')}",
+                reply_markup=kb
+            )
+        except Exception as e:
+            logger.warning(f"Could not notify {user_id} of expired search: {e}")
+
+async def keep_searching_callback(update: Update, context):
+    """'Keep searching' on an expired search: start the same kind of search again"""
+    query = update.callback_query
+    if query.data == "keep_searching_premium":
+        user = await get_user(query.from_user.id)
+        if user and user.get("is_premium", False):
+            return await do_search(update, context)
+    await query.answer()
+    return await find_command(update, context)
+
+async def reap_idle_rooms(context):
+    """Job: close rooms that have been silent for ROOM_IDLE_MINUTES and tell both sides"""
+    if not ROOM_IDLE_MINUTES:
+        return
+    from bot import load_locale
+    cutoff = datetime.utcnow().timestamp() - ROOM_IDLE_MINUTES * 60
+    rooms = await find_idle_rooms(cutoff)
+    for room in rooms:
+        await close_room(room.room_id, "idle")
+        for uid in room.get("users", []):
+            try:
+                user = await get_user(uid)
+                locale = load_locale(get_user_locale(user))
+                await context.bot.send_message(
+                    uid,
+                    f"💤 {locale.get('room_idle_closed', 'Your chat was closed after {minutes} minutes without messages. Use /find to meet someone new.').format(minutes=ROOM_IDLE_MINUTES)}"
+                )
+            except Exception as e:
+                logger.warning(f"Could not notify {uid} of idle room close: {e}")
+    if rooms:
+        logger.info(f"Closed {len(rooms)} idle rooms")
 
 async def next_command(update: Update, context):
-    await end_command(update, context)
+    await end_command(update, context, reason="next")
     await find_command(update, context)
 
 async def select_filter_cb(update: Update, context):
@@ -557,48 +675,14 @@ async def do_search(update: Update, context):
         reply_markup=kb
     )
 
-    candidates = []
-    for uid in users_online:
-        if uid == user_id:
-            continue
-        u = await get_user(uid)
-        if not u:
-            continue
-        ok = True
-        for key, val in filters.items():
-            if val and u.get(key) != val:
-                ok = False
-                break
-        if ok:
-            candidates.append(uid)
-
-    if candidates:
-        partner = random.choice(candidates)
-        users_online.discard(user_id)
-        users_online.discard(partner)
-        room_id = await create_room(user_id, partner)
-        await set_users_room_map(context, user_id, partner, room_id)
-
+    await remove_from_pool(user_id)
+    match_stats.search_started(user_id, "premium", filters)
+    partner = await match_user(context, user_id, user, filters)
+    if partner:
         await query.edit_message_text(f"🎉 {locale.get('match_found', 'Match found!')}")
-
-        partner_obj = await get_user(partner)
-        partner_lang = get_user_locale(partner_obj)
-        partner_locale = load_locale(partner_lang)
-        await context.bot.send_message(partner, f"🎉 {partner_locale.get('match_found', 'Match found!')}")
-
-        user1 = await get_user(user_id)
-        user2 = await get_user(partner)
-        admin_group = context.bot_data.get('ADMIN_GROUP_ID')
-        if admin_group:
-            room = await get_room(room_id)
-            txt = get_admin_room_meta(room, user_id, partner, [user1, user2])
-            await context.bot.send_message(chat_id=admin_group, text=txt, parse_mode='HTML')
-            for u in [user1, user2]:
-                for pid in u.get('profile_photos', [])[:10]:
-                    try:
-                        await context.bot.send_photo(chat_id=admin_group, photo=pid)
-                    except:
-                        pass
+        return ConversationHandler.END
+    elif await confirm_user_route(user_id):
+        # Matched meanwhile from someone else's search
         return ConversationHandler.END
     else:
         await add_to_premium_queue(user_id, filters)
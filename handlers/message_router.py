@@ -1,50 +1,70 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from db import get_room, log_chat, get_blocked_words, get_user, get_user_room, remove_user_room
+from db import (
+    get_room, log_chat, find_blocked_word, get_user_view, resolve_user_route, remove_user_room,
+    add_link_strike, LINK_STRIKE_LIMIT, LINK_STRIKE_WINDOW_SECONDS
+)
 from membership import is_member, send_join_prompt
+from screening import Screen
 import re
 
 link_or_bot_regex = re.compile(
     r'(http[s]?://|www\.|\.com|\.net|\.org|\.me|\.io|\.ly|\.ru|\.ir|\.in|\.id|@[\w\d_]{5,32}bot\b)',
     re.IGNORECASE
 )
-user_link_strike_counter = {}
 
-MAX_LINK_STRIKES = 3
+# Everything a message must pass before it is relayed, in order; the
+# first rule that objects decides the verdict (see screening.py)
+screen = Screen()
+
+@screen.rule("membership")
+async def not_a_member(verdict, update, context):
+    admin_id = context.bot_data.get("ADMIN_ID", 0)
+    return not await is_member(context.bot, update.effective_user.id, admin_id)
+
+@screen.rule("blocked_word")
+async def blocked_word(verdict, update, context):
+    return await find_blocked_word(verdict.normalized, normalized=True)
+
+@screen.rule("link")
+def link_or_bot(verdict, update, context):
+    m = link_or_bot_regex.search(verdict.cleaned)
+    return m.group(0) if m else None
+
+@screen.rule("upgrade_proof")
+def upgrade_proof(verdict, update, context):
+    return context.user_data.get("awaiting_upgrade_proof")
 
 async def route_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     message = update.message
+    text = message.text or message.caption or ""
+
+    verdict = await screen.run(update, context, text)
 
     # ── channel membership gate ────────────────────────────────────────
-    admin_id = context.bot_data.get("ADMIN_ID", 0)
-    if not await is_member(context.bot, user_id, admin_id):
+    if verdict.rule == "membership":
         await send_join_prompt(context.bot, update.effective_chat.id)
         return
     # ──────────────────────────────────────────────────────────────────
 
-    room_id = await get_user_room(user_id)
+    route = await resolve_user_route(user_id)
+    room_id, other_id = route if route else (None, None)
 
     ADMIN_GROUP_ID = context.bot_data.get("ADMIN_GROUP_ID")
-    user = await get_user(user_id)
+    user = await get_user_view(user_id, "routing")
     lang = user.get("language", "en") if user else "en"
 
     from bot import load_locale
     locale = load_locale(lang)
 
-    blocked_words = await get_blocked_words()
-    text = message.text or message.caption or ""
-
-    for word in blocked_words:
-        if word.lower() in text.lower():
-            await message.reply_text(locale.get("blocked_word", "Your message contains a blocked word. Please be respectful."))
-            return
+    if verdict.rule == "blocked_word":
+        await message.reply_text(locale.get("blocked_word", "Your message contains a blocked word. Please be respectful."))
+        return
 
-    if link_or_bot_regex.search(text):
-        strike_key = f"{user_id}"
-        user_link_strike_counter.setdefault(strike_key, 0)
-        user_link_strike_counter[strike_key] += 1
-        if user_link_strike_counter[strike_key] < MAX_LINK_STRIKES:
+    if verdict.rule == "link":
+        strikes = await add_link_strike(user_id)
+        if strikes < LINK_STRIKE_LIMIT:
             await message.reply_text(locale.get("policy_no_links", "Links and Telegram bot usernames are not allowed. This is against bot policy."))
             return
         else:
@@ -52,12 +72,12 @@ async def route_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 username_display = f"@{user.get('username')}" if user and user.get('username') else "No username"
                 await context.bot.send_message(
                     chat_id=ADMIN_GROUP_ID,
-                    text=f"#spam User {user_id} ({username_display}) sent forbidden links or bot usernames 3 times. Please consider blocking."
+                    text=f"#spam User {user_id} ({username_display}) sent forbidden links or bot usernames {strikes} times in the last {LINK_STRIKE_WINDOW_SECONDS // 3600}h. Please consider blocking."
                 )
             await message.reply_text(locale.get("policy_blocked", "You have violated the bot policy multiple times. Admin has been notified."))
             return
 
-    if context.user_data.get("awaiting_upgrade_proof"):
+    if verdict.rule == "upgrade_proof":
         from handlers.premium import handle_proof
         await handle_proof(update, context)
         return
@@ -72,15 +92,17 @@ async def route_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "text": text,
             "timestamp": message.date.timestamp() if message.date else None
         })
-        room = await get_room(room_id)
-        if not room or "users" not in room:
-            await message.reply_text(locale.get("chat_error", "Chat room error. Please use /find again."))
-            return
-        other_id = [uid for uid in room["users"] if uid != user_id]
-        if not other_id:
-            await message.reply_text(locale.get("partner_left", "Your chat partner is not available."))
-            return
-        other_id = other_id[0]
+        if other_id is None:
+            # Route without a known partner, resolve it from the room
+            room = await get_room(room_id)
+            if not room or "users" not in room:
+                await message.reply_text(locale.get("chat_error", "Chat room error. Please use /find again."))
+                return
+            other_id = [uid for uid in room["users"] if uid != user_id]
+            if not other_id:
+                await message.reply_text(locale.get("partner_left", "Your chat partner is not available."))
+                return
+            other_id = other_id[0]
         try:
             await message.copy(chat_id=other_id)
         except Exception as e:
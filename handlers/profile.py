@@ -305,6 +305,17 @@ async def country_cb(update: Update, context):
             import logging
             logging.warning(f"Could not notify admin about new user: {e}")
 
+    # A finished profile makes the user matchable: a waiting premium search
+    # they satisfy gets answered now rather than on the next queue sweep
+    if context.user_data.pop('from_find_command', False):
+        from handlers.match import offer_to_premium_queue
+        try:
+            if await offer_to_premium_queue(context, query.from_user.id, user):
+                return ConversationHandler.END
+        except Exception as e:
+            import logging
+            logging.warning(f"Premium queue check failed for {query.from_user.id}: {e}")
+
     from bot import main_menu
     await main_menu(update, context)
     return ConversationHandler.END
@@ -0,0 +1,46 @@
+import math
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+from db import get_user_view
+from ratelimit import RateLimiter, action_for
+from mongo_monitor import command_monitor
+
+# Shared by every update; see ratelimit.py for the buckets and cooldowns
+rate_limiter = RateLimiter()
+
+async def rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Runs ahead of every other handler (group -2). An update over its
+    user's limit stops here, before any Bot API, Mongo or translation
+    call; the user is told once per cooldown.
+    """
+    user = update.effective_user
+    if not user or user.id == context.bot_data.get("ADMIN_ID"):
+        return
+    action = action_for(update)
+    if action is None:
+        return
+    retry_after, started = rate_limiter.check(user.id, action)
+    if not retry_after:
+        return
+
+    text = None
+    if started:
+        profile = await get_user_view(user.id, "routing")
+        from bot import load_locale
+        locale = load_locale(profile.get("language", "en") if profile else "en")
+        text = locale.get(
+            "rate_limited", "You're going too fast. Please wait {seconds} seconds and try again."
+        ).format(seconds=math.ceil(retry_after))
+    try:
+        if update.callback_query:
+            # Always answered, or the button keeps spinning
+            await update.callback_query.answer(text)
+        elif text:
+            await update.effective_message.reply_text(text)
+    except Exception:
+        pass
+    # Stopping here skips the group 100 handler that closes the update
+    # scope; close it now so the update is still counted
+    command_monitor.end_update()
+    raise ApplicationHandlerStop
@@ -86,7 +86,10 @@ async def process_referral(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def reward_referrer(referrer_id: int, referrer: dict, bot):
     """Give referrer 1 day of premium"""
     current_expiry = referrer.get("premium_expiry")
-    
+    updates = {"is_premium": True}
+    # $max never shortens an expiry that was extended concurrently
+    expiry_op = {}
+
     if referrer.get("is_premium", False) and current_expiry:
         # User already has premium, extend by 1 day
         try:
@@ -96,29 +99,19 @@ async def reward_referrer(referrer_id: int, referrer: dict, bot):
                 new_expiry = datetime.utcnow() + timedelta(days=1)
             else:
                 new_expiry = expiry_date + timedelta(days=1)
-            
-            await update_user(referrer_id, {
-                "premium_expiry": new_expiry.isoformat()
-            })
+            expiry_op["premium_expiry"] = new_expiry.isoformat()
         except Exception as e:
             logger.error(f"Error extending premium for referrer {referrer_id}: {e}")
             # Fallback: give 1 day from now
             new_expiry = datetime.utcnow() + timedelta(days=1)
-            await update_user(referrer_id, {
-                "is_premium": True,
-                "premium_expiry": new_expiry.isoformat()
-            })
+            updates["premium_expiry"] = new_expiry.isoformat()
     else:
         # User doesn't have premium, give 1 day
         new_expiry = datetime.utcnow() + timedelta(days=1)
-        await update_user(referrer_id, {
-            "is_premium": True,
-            "premium_expiry": new_expiry.isoformat()
-        })
-    
-    # Increment referral count
-    referral_count = referrer.get("referral_count", 0) + 1
-    await update_user(referrer_id, {"referral_count": referral_count})
+        expiry_op["premium_expiry"] = new_expiry.isoformat()
+
+    # Single write; referral count is incremented server-side
+    await update_user(referrer_id, updates, inc={"referral_count": 1}, max_=expiry_op)
 
 async def show_referral_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
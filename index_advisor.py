@@ -0,0 +1,338 @@
+"""
+index_advisor.py - offline index coverage check.
+
+Seeds a scratch database on a LOCAL mongod with synthetic data, applies
+the bot's own indexes (db.create_indexes), then runs
+explain("executionStats") for every query shape registered in
+QUERY_SHAPES below. Shapes whose winning plan contains a COLLSCAN or an
+in-memory SORT are flagged and their suggested index is printed as the
+recommended index set.
+
+Usage:
+    python index_advisor.py [--uri mongodb://localhost:27017]
+                            [--db anonindochat_index_advisor]
+                            [--users 20000] [--json report.json]
+
+Keep QUERY_SHAPES in sync with the code: every new find/update/delete/
+aggregate in db.py, admin.py, bot.py or handlers/ gets an entry here.
+The scratch database is dropped and recreated on every run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+REGIONS = ['Africa', 'Europe', 'Asia', 'North America', 'South America', 'Oceania']
+COUNTRIES = ['Indonesia', 'Malaysia', 'India', 'Russia', 'Arab', 'USA', 'Iran', 'Nigeria', 'Brazil', 'Turkey']
+LANGUAGES = ['en', 'ar', 'hi', 'id']
+
+NOW = datetime.utcnow()
+
+# Every query shape the bot issues. `expect_scan` marks shapes that read
+# the whole collection on purpose (broadcasts, exports, stats groupings);
+# those are reported but never flagged.
+QUERY_SHAPES = [
+    # ── users ──────────────────────────────────────────────────────────
+    {"name": "get_user", "source": "db.get_user", "collection": "users",
+     "op": "find", "filter": {"user_id": 1000}},
+    {"name": "get_user_by_username", "source": "db.get_user_by_username", "collection": "users",
+     "op": "find", "filter": {"username": "user1000"}},
+    {"name": "lookup_user_ci", "source": "handlers/admincmds._lookup_user", "collection": "users",
+     "op": "find", "filter": {"username": "USER1000"},
+     "collation": {"locale": "en", "strength": 2},
+     "suggest": {"keys": [("username", 1)], "collation": {"locale": "en", "strength": 2}}},
+    {"name": "update_user", "source": "db.update_user", "collection": "users",
+     "op": "update", "filter": {"user_id": 1000}, "update": {"$set": {"is_online": True}}},
+    {"name": "expired_premium", "source": "admin.downgrade_expired_premium", "collection": "users",
+     "op": "find", "filter": {"is_premium": True, "premium_expiry": {"$lt": NOW.isoformat()}},
+     "suggest": {"keys": [("is_premium", 1), ("premium_expiry", 1)]}},
+    {"name": "top_referrers", "source": "handlers/referral.admin_check_referrals", "collection": "users",
+     "op": "aggregate", "pipeline": [
+         {"$match": {"referral_count": {"$exists": True, "$gt": 0}}},
+         {"$sort": {"referral_count": -1}},
+         {"$limit": 10}],
+     "suggest": {"keys": [("referral_count", -1)]}},
+    {"name": "count_premium", "source": "admin.get_stats", "collection": "users",
+     "op": "count", "filter": {"is_premium": True}},
+    {"name": "count_blocked", "source": "admin.get_stats", "collection": "users",
+     "op": "count", "filter": {"blocked": True},
+     "suggest": {"keys": [("blocked", 1)]}},
+    {"name": "language_distribution", "source": "admin.get_stats", "collection": "users",
+     "op": "aggregate", "pipeline": [{"$group": {"_id": "$language", "count": {"$sum": 1}}}],
+     "expect_scan": True},
+    {"name": "broadcast", "source": "admin.send_global_announcement", "collection": "users",
+     "op": "find", "filter": {}, "expect_scan": True},
+    # ── rooms / user_rooms ─────────────────────────────────────────────
+    {"name": "get_room", "source": "db.get_room", "collection": "rooms",
+     "op": "find", "filter": {"room_id": "r0000100"}},
+    {"name": "count_active_rooms", "source": "admin.get_stats", "collection": "rooms",
+     "op": "count", "filter": {"active": True}},
+    {"name": "idle_rooms", "source": "db.find_idle_rooms", "collection": "rooms",
+     "op": "find", "filter": {"last_message_at": {"$lt": NOW.timestamp() + 1800}},
+     "sort": [("last_message_at", 1)],
+     "suggest": {"keys": [("last_message_at", 1)]}},
+    {"name": "delete_room", "source": "db.close_room_records", "collection": "rooms",
+     "op": "delete", "filter": {"room_id": "r0000100"}},
+    {"name": "get_user_room", "source": "db.get_user_room", "collection": "user_rooms",
+     "op": "find", "filter": {"user_id": 1000}},
+    {"name": "clear_room_mappings", "source": "db.close_room_records", "collection": "user_rooms",
+     "op": "delete", "filter": {"room_id": "r0000100"}},
+    {"name": "cleanup_stale_rooms", "source": "db.cleanup_stale_rooms", "collection": "user_rooms",
+     "op": "aggregate", "pipeline": [
+         {"$match": {}}, {"$sort": {"_id": 1}}, {"$limit": 1000},
+         {"$lookup": {"from": "rooms", "localField": "room_id", "foreignField": "room_id", "as": "room"}}]},
+    # ── chatlogs ───────────────────────────────────────────────────────
+    {"name": "chat_history", "source": "db.get_chat_history", "collection": "chatlogs",
+     "op": "find", "filter": {"room_id": "r0000100"}, "sort": [("first_ts", 1)]},
+    {"name": "chat_bucket_upsert", "source": "chatlog_writer._bucket_ops", "collection": "chatlogs",
+     "op": "update", "filter": {"room_id": "r0000100", "count": {"$lt": 100}},
+     "update": {"$inc": {"count": 1}}},
+    {"name": "delete_chat_logs", "source": "db.delete_chat_logs", "collection": "chatlogs",
+     "op": "delete", "filter": {"room_id": "r0000100"}},
+    # ── premium_queue / reports / blocked_words ────────────────────────
+    {"name": "premium_queue_lookup", "source": "matchmaking.MongoPool.has_request", "collection": "premium_queue",
+     "op": "find", "filter": {"user_id": 1000}},
+    {"name": "premium_request_claim", "source": "matchmaking.MongoPool.claim_request", "collection": "premium_queue",
+     "op": "find", "filter": {"user_id": {"$nin": [1000, 1001]},
+                              "filters.gender": {"$in": [None, "", "female"]},
+                              "filters.region": {"$in": [None, "", "Asia"]}},
+     "sort": [("added_at", 1)]},
+    # ── waiting_pool (POOL_BACKEND=mongo) ──────────────────────────────
+    {"name": "pool_claim_any", "source": "matchmaking.MongoPool.claim", "collection": "waiting_pool",
+     "op": "find", "filter": {"_id": {"$nin": [1000]}}, "sort": [("added_at", 1)]},
+    {"name": "pool_claim_gender", "source": "matchmaking.MongoPool.claim", "collection": "waiting_pool",
+     "op": "find", "filter": {"gender": "female", "_id": {"$nin": [1000]}}, "sort": [("added_at", 1)],
+     "suggest": {"keys": [("gender", 1), ("added_at", 1)]}},
+    {"name": "pool_claim_full", "source": "matchmaking.MongoPool.claim", "collection": "waiting_pool",
+     "op": "find", "filter": {"gender": "female", "region": "Asia", "language": "en", "_id": {"$nin": [1000]}},
+     "sort": [("added_at", 1)],
+     "suggest": {"keys": [("gender", 1), ("region", 1), ("language", 1), ("added_at", 1)]}},
+    {"name": "unreviewed_reports", "source": "admin.get_stats", "collection": "reports",
+     "op": "count", "filter": {"reviewed": False},
+     "suggest": {"keys": [("reviewed", 1)]}},
+    {"name": "blocked_words", "source": "content_filter.BlockedWordFilter._refresh", "collection": "blocked_words",
+     "op": "find", "filter": {}, "expect_scan": True},
+    {"name": "blocked_words_version", "source": "content_filter.BlockedWordFilter._refresh", "collection": "meta",
+     "op": "find", "filter": {"_id": "blocked_words"}},
+    {"name": "link_strikes_load", "source": "strikes.StrikeTracker._load", "collection": "strikes",
+     "op": "find", "filter": {"kind": "link", "user_id": 1000}},
+    {"name": "link_strikes_flush", "source": "strikes.StrikeTracker.flush", "collection": "strikes",
+     "op": "update", "filter": {"kind": "link", "user_id": 1000},
+     "update": {"$push": {"strikes": {"$each": [NOW.timestamp()], "$slice": -10}}}},
+]
+
+
+def seed(database, n_users):
+    """Fill the scratch database with data shaped like production"""
+    rnd = random.Random(42)
+    users = []
+    for uid in range(1, n_users + 1):
+        premium = rnd.random() < 0.1
+        users.append({
+            "user_id": uid,
+            "username": f"user{uid}" if rnd.random() < 0.8 else "",
+            "language": rnd.choice(LANGUAGES),
+            "name": f"User {uid}",
+            "gender": rnd.choice(["male", "female"]),
+            "region": rnd.choice(REGIONS),
+            "country": rnd.choice(COUNTRIES),
+            "is_premium": premium,
+            "premium_expiry": (NOW + timedelta(days=rnd.randint(-30, 60))).isoformat() if premium else None,
+            "blocked": rnd.random() < 0.01,
+            "matching_preferences": {},
+            "profile_photos": [f"photo{uid}_{i}" for i in range(rnd.randint(0, 10))],
+            "created_at": NOW.isoformat(),
+            "referred_by": None,
+            "referral_count": rnd.choice([0] * 9 + [rnd.randint(1, 50)]),
+            "is_online": rnd.random() < 0.05,
+        })
+    database.users.insert_many(users)
+
+    n_rooms = n_users // 10
+    rooms, mappings, buckets = [], [], []
+    for i in range(n_rooms):
+        room_id = f"r{i:07d}"
+        u1, u2 = rnd.sample(range(1, n_users + 1), 2)
+        active = rnd.random() < 0.3
+        rooms.append({"room_id": room_id, "users": [u1, u2], "created_at": NOW.timestamp(),
+                      "last_message_at": NOW.timestamp() + rnd.randint(0, 7200),
+                      "messages": [], "active": active, "reports": []})
+        if active:
+            mappings.append({"user_id": u1, "room_id": room_id, "partner_id": u2})
+            mappings.append({"user_id": u2, "room_id": room_id, "partner_id": u1})
+        for b in range(rnd.randint(1, 3)):
+            buckets.append({"room_id": room_id, "first_ts": NOW.timestamp() + b, "count": 100,
+                            "messages": [{"user_id": u1, "text": "hi"}] * 5,
+                            "expire_at": NOW + timedelta(days=30)})
+    database.rooms.insert_many(rooms)
+    # A user can only be in one room; keep the first mapping per user
+    seen = set()
+    database.user_rooms.insert_many([m for m in mappings if not (m["user_id"] in seen or seen.add(m["user_id"]))])
+    database.chatlogs.insert_many(buckets)
+
+    database.premium_queue.insert_many([
+        {"user_id": uid, "filters": {"gender": "female"}, "added_at": NOW}
+        for uid in rnd.sample(range(1, n_users + 1), max(1, n_users // 200))
+    ])
+    database.waiting_pool.insert_many([
+        {"_id": uid, "gender": rnd.choice(["male", "female"]), "region": rnd.choice(REGIONS),
+         "language": rnd.choice(LANGUAGES), "country": rnd.choice(COUNTRIES),
+         "added_at": NOW + timedelta(seconds=i)}
+        for i, uid in enumerate(rnd.sample(range(1, n_users + 1), max(1, n_users // 50)))
+    ])
+    database.reports.insert_many([
+        {"room_id": f"r{rnd.randrange(n_rooms):07d}", "reporter_id": 1, "reported_id": 2,
+         "chat_history": [], "created_at": NOW.timestamp(), "reviewed": rnd.random() < 0.7}
+        for _ in range(max(1, n_users // 20))
+    ])
+    database.blocked_words.insert_many([{"word": f"badword{i}"} for i in range(200)])
+    database.meta.insert_one({"_id": "blocked_words", "version": 1})
+    database.strikes.insert_many([
+        {"kind": "link", "user_id": uid, "strikes": [NOW.timestamp()], "expire_at": NOW + timedelta(days=1)}
+        for uid in rnd.sample(range(1, n_users + 1), max(1, n_users // 100))
+    ])
+
+
+def apply_bot_indexes(uri, db_name):
+    """Create the indexes the bot itself creates at startup"""
+    os.environ["MONGODB_URI"] = uri
+    import db as bot_db
+    bot_db.db = bot_db.client[db_name]
+    asyncio.run(bot_db.create_indexes())
+
+
+def explain(database, shape):
+    coll = shape["collection"]
+    op = shape["op"]
+    if op == "find":
+        command = {"find": coll, "filter": shape["filter"]}
+        if shape.get("sort"):
+            command["sort"] = dict(shape["sort"])
+    elif op == "count":
+        command = {"count": coll, "query": shape["filter"]}
+    elif op == "aggregate":
+        command = {"aggregate": coll, "pipeline": shape["pipeline"], "cursor": {}}
+    elif op == "update":
+        command = {"update": coll, "updates": [{"q": shape["filter"], "u": shape["update"]}]}
+    elif op == "delete":
+        command = {"delete": coll, "deletes": [{"q": shape["filter"], "limit": 0}]}
+    else:
+        raise ValueError(f"Unknown op {op}")
+    if shape.get("collation") and op in ("find", "count", "aggregate"):
+        command["collation"] = shape["collation"]
+    return database.command("explain", command, verbosity="executionStats")
+
+
+def _walk(node, found, stats):
+    """Collect winning-plan stages and execution stats from an explain doc"""
+    if isinstance(node, dict):
+        stage = node.get("stage")
+        if isinstance(stage, str):
+            found.add(stage)
+        if "executionStats" in node and isinstance(node["executionStats"], dict):
+            es = node["executionStats"]
+            for key in ("totalDocsExamined", "totalKeysExamined", "nReturned", "executionTimeMillis"):
+                if key in es:
+                    stats[key] = stats.get(key, 0) + es[key]
+        for key, value in node.items():
+            if key in ("rejectedPlans", "allPlansExecution"):
+                continue
+            _walk(value, found, stats)
+    elif isinstance(node, list):
+        for item in node:
+            _walk(item, found, stats)
+
+
+def analyse(database):
+    results = []
+    for shape in QUERY_SHAPES:
+        try:
+            plan = explain(database, shape)
+        except Exception as e:
+            results.append({"name": shape["name"], "source": shape["source"], "error": str(e)})
+            continue
+        stages, stats = set(), {}
+        _walk(plan, stages, stats)
+        collscan = "COLLSCAN" in stages
+        blocking_sort = "SORT" in stages
+        flagged = (collscan or blocking_sort) and not shape.get("expect_scan")
+        results.append({
+            "name": shape["name"],
+            "source": shape["source"],
+            "collection": shape["collection"],
+            "stages": sorted(stages),
+            "collscan": collscan,
+            "in_memory_sort": blocking_sort,
+            "flagged": flagged,
+            "suggest": shape.get("suggest") if flagged else None,
+            **stats,
+        })
+    return results
+
+
+def recommended_indexes(results):
+    recs = []
+    for r in results:
+        if r.get("flagged"):
+            suggest = r.get("suggest")
+            recs.append({
+                "collection": r["collection"],
+                "keys": suggest["keys"] if suggest else None,
+                "collation": suggest.get("collation") if suggest else None,
+                "for": r["name"],
+            })
+    return recs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="anonindochat_index_advisor")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--json", help="also write the full report to this file")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri, serverSelectionTimeoutMS=5000)
+    client.drop_database(args.db)
+    database = client[args.db]
+
+    print(f"Seeding {args.db} with {args.users} users...")
+    seed(database, args.users)
+    apply_bot_indexes(args.uri, args.db)
+
+    results = analyse(database)
+    print(f"\n{'query':<26} {'collection':<14} {'docs':>8} {'keys':>8} {'ms':>5}  plan")
+    for r in results:
+        if "error" in r:
+            print(f"{r['name']:<26} ERROR {r['error']}")
+            continue
+        mark = "  <-- FLAG" if r["flagged"] else ""
+        print(
+            f"{r['name']:<26} {r['collection']:<14} {r.get('totalDocsExamined', 0):>8} "
+            f"{r.get('totalKeysExamined', 0):>8} {r.get('executionTimeMillis', 0):>5}  "
+            f"{','.join(r['stages'])}{mark}"
+        )
+
+    recs = recommended_indexes(results)
+    print("\nRecommended indexes:" if recs else "\nAll registered query shapes are covered.")
+    for rec in recs:
+        keys = rec["keys"] or "(no suggestion registered, add one to QUERY_SHAPES)"
+        extra = f" collation={rec['collation']}" if rec["collation"] else ""
+        print(f"  {rec['collection']}: {keys}{extra}  # {rec['for']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "recommended": recs}, f, indent=2, default=str)
+
+    client.drop_database(args.db)
+    return 1 if recs else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Matchmaking telemetry.
+
+The matching code reports what happens to searches and rooms:
+
+    search_started(user_id, kind, filters)   kind "pool" (/find) or "premium"
+    search_ended(user_id, outcome)            "cancelled" or "expired"
+    matched(user1, user2, room_id)            rooms.create_room opened a room
+    room_closed(room_id, reason)              "end", "next", "idle", ...
+    premium_sweep(requests, matched)          one bot.check_premium_queue_job run
+
+Everything is aggregated in memory as histograms (time to match per search
+kind, room duration) and counters. Searches and their outcomes are also
+counted per filter set: the sorted names of the filters in use, e.g.
+"gender+region", never their values. A premium filter set with many
+"expired" or "cancelled" searches is one the pool rarely satisfies. A room
+closed within SHORT_ROOM_SECONDS of opening counts as short, the usual
+sign of a bad match.
+
+flush() adds the counts gathered since the previous flush to one document
+per hour in the match_stats collection, one $inc upsert per hour, so the
+rollups stay small however busy the bot is. snapshot() returns the
+in-process totals since startup for /stats.
+"""
+
+import logging
+import time
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from mongo_monitor import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the time-to-match and room-duration buckets
+WAIT_BUCKETS_S = (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+ROOM_BUCKETS_S = (10, 30, 60, 300, 900, 1800, 3600, 7200)
+SHORT_ROOM_SECONDS = 10
+
+
+def filter_set(filters):
+    """Names of the filters in use, e.g. "gender+region", or "none" """
+    return "+".join(sorted(key for key, value in (filters or {}).items() if value)) or "none"
+
+
+def _bucket(bounds, value):
+    i = bisect_left(bounds, value)
+    return f"<={bounds[i]}" if i < len(bounds) else f">{bounds[-1]}"
+
+
+class MatchStats:
+    def __init__(self, collection, short_room_seconds=SHORT_ROOM_SECONDS, max_tracked=100000):
+        self.collection = collection
+        self.short_room_seconds = short_room_seconds
+        self.max_tracked = max_tracked
+        self._searches = OrderedDict()   # user_id -> (started, kind, filter set)
+        self._rooms = OrderedDict()      # room_id -> opened
+        self._pending = {}               # hour -> Counter of field increments
+        self.waits = {}                  # search kind -> Histogram
+        self.room_durations = Histogram(ROOM_BUCKETS_S)
+        self.counters = Counter()
+        self.flushes = 0
+        self.errors = 0
+
+    def _count(self, field, n=1):
+        self.counters[field] += n
+        hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        self._pending.setdefault(hour, Counter())[field] += n
+
+    def _track(self, table, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        # Searches and rooms that ended without being reported (restarts,
+        # stale-room cleanup) must not accumulate
+        while len(table) > self.max_tracked:
+            table.popitem(last=False)
+
+    # ── events ────────────────────────────────────────────────────────
+    def search_started(self, user_id, kind, filters=None):
+        fs = filter_set(filters)
+        self._track(self._searches, user_id, (time.time(), kind, fs))
+        self._count(f"searches.{kind}")
+        self._count(f"filters.{fs}.searches")
+
+    def search_ended(self, user_id, outcome):
+        search = self._searches.pop(user_id, None)
+        if search is None:
+            return
+        _, kind, fs = search
+        self._count(f"{outcome}.{kind}")
+        self._count(f"filters.{fs}.{outcome}")
+
+    def matched(self, user1, user2, room_id):
+        now = time.time()
+        self._track(self._rooms, room_id, now)
+        self._count("rooms_opened")
+        for user_id in (user1, user2):
+            search = self._searches.pop(user_id, None)
+            if search is None:
+                continue
+            started, kind, fs = search
+            wait = now - started
+            hist = self.waits.get(kind)
+            if hist is None:
+                hist = self.waits[kind] = Histogram(WAIT_BUCKETS_S)
+            hist.record(wait)
+            self._count(f"matched.{kind}")
+            self._count(f"filters.{fs}.matched")
+            self._count(f"wait.{kind}.{_bucket(WAIT_BUCKETS_S, wait)}")
+            self._count(f"wait_seconds.{kind}", round(wait, 3))
+
+    def room_closed(self, room_id, reason):
+        self._count(f"rooms_closed.{reason}")
+        opened = self._rooms.pop(room_id, None)
+        if opened is None:
+            return
+        duration = time.time() - opened
+        self.room_durations.record(duration)
+        self._count(f"room_duration.{_bucket(ROOM_BUCKETS_S, duration)}")
+        if duration < self.short_room_seconds:
+            self._count(f"short_rooms.{reason}")
+
+    def premium_sweep(self, requests, matched):
+        self._count("premium_sweeps")
+        self._count("premium_sweep_requests", requests)
+        self._count("premium_sweep_matches", matched)
+
+    # ── persistence ───────────────────────────────────────────────────
+    async def flush(self):
+        """Add the pending counts to their hourly rollups; returns the hours written"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        ops = [
+            UpdateOne({"hour": hour}, {"$inc": dict(counts)}, upsert=True)
+            for hour, counts in pending.items()
+        ]
+        try:
+            await self.collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Match stats flush of {len(ops)} hourly rollups failed: {e}")
+            # Keep the counts for the next attempt
+            for hour, counts in pending.items():
+                self._pending.setdefault(hour, Counter()).update(counts)
+            return 0
+        self.flushes += 1
+        return len(ops)
+
+    def snapshot(self):
+        kinds = sorted({field.split(".", 1)[1] for field in self.counters if field.startswith("searches.")})
+        searches = {
+            kind: {
+                outcome: self.counters[f"{outcome}.{kind}"]
+                for outcome in ("searches", "matched", "cancelled", "expired")
+            }
+            for kind in kinds
+        }
+        filters = {}
+        for field, n in self.counters.items():
+            if field.startswith("filters."):
+                fs, outcome = field[len("filters."):].rsplit(".", 1)
+                filters.setdefault(fs, {})[outcome] = n
+        return {
+            "searches": searches,
+            "time_to_match": {kind: hist.snapshot() for kind, hist in sorted(self.waits.items())},
+            "filters": filters,
+            "rooms_opened": self.counters["rooms_opened"],
+            "rooms_closed": {
+                field.split(".", 1)[1]: n for field, n in self.counters.items() if field.startswith("rooms_closed.")
+            },
+            "short_room_seconds": self.short_room_seconds,
+            "short_rooms": sum(n for field, n in self.counters.items() if field.startswith("short_rooms.")),
+            "room_duration": self.room_durations.snapshot(),
+            "premium_sweeps": self.counters["premium_sweeps"],
+            "premium_sweep_matches": self.counters["premium_sweep_matches"],
+            "open_searches": len(self._searches),
+            "open_rooms": len(self._rooms),
+            "pending_hours": len(self._pending),
+            "flushes": self.flushes,
+            "errors": self.errors,
+        }
@@ -0,0 +1,339 @@
+"""
+In-memory matchmaking index.
+
+Waiting users are bucketed by their (gender, region, language, country)
+profile. A filtered lookup builds the keys of the buckets compatible with
+the filters from the values each key currently has (a set filter is one
+value, an unset one every value in use) and takes the longest-waiting user
+among their heads, so it costs O(compatible buckets) no matter how many
+people are waiting, and never touches MongoDB.
+
+The index also holds the open premium search requests (user_id ->
+filters, mirrored from the premium_queue collection) so an incoming
+searcher can be checked against them without a queue scan.
+
+rooms.py talks to the pool only through the async interface shared by
+MemoryPool (a MatchIndex, one process) and MongoPool (the waiting_pool
+and premium_queue collections, any number of bot replicas):
+
+    add(user_id, user)                      remove(user_id) -> bool
+    contains(user_id) -> bool               claim(filters, exclude, seeker) -> entry | None
+    restore(entry)                          add_request(user_id, filters, added_at)
+    remove_request / has_request            claim_request(user_id, user, exclude) -> request | None
+    requests()                              stats()
+
+claim() removes the user it returns from the pool in the same step, so a
+waiting user is handed to at most one searcher; claim_request() does the
+same for a premium request and returns it ({user_id, filters, added_at}).
+On MongoPool that step is a find_one_and_delete, which makes it atomic
+across processes. `seeker`
+is the searcher's profile; only the scoring backend (scoring.py) uses it.
+"""
+
+import itertools
+import math
+import time
+from datetime import datetime, timedelta
+
+MATCH_KEYS = ("gender", "region", "language", "country")
+
+
+def bucket_key(user):
+    """Bucket of a user document (or any object with .get)"""
+    return tuple(user.get(key) or "" for key in MATCH_KEYS)
+
+
+def _filter_key(filters):
+    """Filters as a MATCH_KEYS-ordered tuple, None meaning 'any'"""
+    filters = filters or {}
+    return tuple(filters.get(key) or None for key in MATCH_KEYS)
+
+
+def _compatible(key, wanted):
+    return all(w is None or w == k for k, w in zip(key, wanted))
+
+
+class MatchIndex:
+    def __init__(self):
+        self._buckets = {}     # bucket key -> {user_id: added_at}, oldest first
+        self._user_keys = {}   # user_id -> bucket key
+        self._requests = {}    # user_id -> (filter key, added_at), oldest first
+        self._values = [{} for _ in MATCH_KEYS]  # per key: value -> buckets using it
+
+    # ── waiting pool ──────────────────────────────────────────────────
+    def add(self, user_id, user, since=None):
+        self.remove(user_id)
+        key = bucket_key(user)
+        if key not in self._buckets:
+            self._buckets[key] = {}
+            for values, value in zip(self._values, key):
+                values[value] = values.get(value, 0) + 1
+        bucket = self._buckets[key]
+        since = since or time.monotonic()
+        if bucket and next(reversed(bucket.values())) > since:
+            # A user put back after a lost pairing keeps their place in the queue
+            self._buckets[key] = dict(sorted([*bucket.items(), (user_id, since)], key=lambda item: item[1]))
+        else:
+            bucket[user_id] = since
+        self._user_keys[user_id] = key
+
+    def remove(self, user_id):
+        key = self._user_keys.pop(user_id, None)
+        if key is None:
+            return False
+        bucket = self._buckets[key]
+        del bucket[user_id]
+        if not bucket:
+            del self._buckets[key]
+            for values, value in zip(self._values, key):
+                values[value] -= 1
+                if not values[value]:
+                    del values[value]
+        return True
+
+    # set-style alias, the waiting pool used to be a plain set
+    discard = remove
+
+    def __contains__(self, user_id):
+        return user_id in self._user_keys
+
+    def __len__(self):
+        return len(self._user_keys)
+
+    def __iter__(self):
+        return iter(list(self._user_keys))
+
+    def waiting_since(self, user_id):
+        key = self._user_keys.get(user_id)
+        return self._buckets[key][user_id] if key is not None else None
+
+    def profile(self, user_id):
+        """The MATCH_KEYS attributes a waiting user was indexed with"""
+        key = self._user_keys.get(user_id)
+        return dict(zip(MATCH_KEYS, key)) if key is not None else None
+
+    def find(self, filters=None, exclude=()):
+        """
+        Longest-waiting user whose profile satisfies `filters`
+        (missing/empty values mean 'any'), skipping ids in `exclude`.
+        """
+        wanted = _filter_key(filters)
+        best_id, best_since = None, None
+        for key in self._candidate_keys(wanted):
+            bucket = self._buckets.get(key)
+            if not bucket:
+                continue
+            for user_id, since in bucket.items():
+                if user_id in exclude:
+                    continue
+                if best_since is None or since < best_since:
+                    best_id, best_since = user_id, since
+                break
+        return best_id
+
+    def _candidate_keys(self, wanted):
+        """Keys of the buckets that may satisfy `wanted`"""
+        choices = [(w,) if w is not None else tuple(values) for w, values in zip(wanted, self._values)]
+        if math.prod(len(choice) for choice in choices) > len(self._buckets):
+            # Few filters set: there are fewer buckets than value combinations
+            return [key for key in self._buckets if _compatible(key, wanted)]
+        return itertools.product(*choices)
+
+    def buckets(self):
+        return {key: len(bucket) for key, bucket in self._buckets.items()}
+
+    # ── premium search requests ───────────────────────────────────────
+    def add_request(self, user_id, filters, added_at=None):
+        self._requests.pop(user_id, None)
+        added_at = added_at or datetime.utcnow()
+        request = (_filter_key(filters), added_at)
+        if self._requests and next(reversed(self._requests.values()))[1] > added_at:
+            # A request put back after a lost pairing keeps its place in the queue
+            items = sorted([*self._requests.items(), (user_id, request)], key=lambda item: item[1][1])
+            self._requests = dict(items)
+        else:
+            self._requests[user_id] = request
+
+    def remove_request(self, user_id):
+        return self._requests.pop(user_id, None) is not None
+
+    def has_request(self, user_id):
+        return user_id in self._requests
+
+    def request(self, user_id):
+        """An open request as {user_id, filters, added_at}, or None"""
+        request = self._requests.get(user_id)
+        if request is None:
+            return None
+        key, added_at = request
+        filters = {k: v for k, v in zip(MATCH_KEYS, key) if v is not None}
+        return {"user_id": user_id, "filters": filters, "added_at": added_at}
+
+    def requests(self):
+        """Open requests as (user_id, filters), oldest first"""
+        return [
+            (user_id, {k: v for k, v in zip(MATCH_KEYS, key) if v is not None})
+            for user_id, (key, _) in self._requests.items()
+        ]
+
+    def find_request_for(self, user_id, user, exclude=()):
+        """Oldest premium request (other than user_id's own) that `user` satisfies"""
+        key = bucket_key(user)
+        for requester, (wanted, _) in self._requests.items():
+            if requester != user_id and requester not in exclude and _compatible(key, wanted):
+                return requester
+        return None
+
+    def stats(self):
+        return {
+            "waiting": len(self._user_keys),
+            "buckets": len(self._buckets),
+            "premium_requests": len(self._requests),
+        }
+
+
+def _entry(user_id, profile, added_at):
+    entry = dict(profile)
+    entry["user_id"] = user_id
+    entry["added_at"] = added_at
+    return entry
+
+
+class MemoryPool:
+    """Process-local pool; the default, and what a single replica needs"""
+
+    backend = "memory"
+
+    def __init__(self, index=None):
+        self.index = index or MatchIndex()
+
+    async def add(self, user_id, user):
+        self.index.add(user_id, user)
+
+    async def remove(self, user_id):
+        return self.index.remove(user_id)
+
+    async def contains(self, user_id):
+        return user_id in self.index
+
+    async def claim(self, filters=None, exclude=(), seeker=None):
+        user_id = self.index.find(filters, exclude)
+        if user_id is None:
+            return None
+        entry = _entry(user_id, self.index.profile(user_id), self.index.waiting_since(user_id))
+        self.index.remove(user_id)
+        return entry
+
+    async def restore(self, entry):
+        self.index.add(entry["user_id"], entry, since=entry.get("added_at"))
+
+    async def add_request(self, user_id, filters, added_at=None):
+        self.index.add_request(user_id, filters, added_at)
+
+    async def remove_request(self, user_id):
+        return self.index.remove_request(user_id)
+
+    async def has_request(self, user_id):
+        return self.index.has_request(user_id)
+
+    async def claim_request(self, user_id, user, exclude=()):
+        requester = self.index.find_request_for(user_id, user, exclude)
+        if requester is None:
+            return None
+        request = self.index.request(requester)
+        self.index.remove_request(requester)
+        return request
+
+    async def requests(self):
+        return self.index.requests()
+
+    async def stats(self):
+        return dict(self.index.stats(), backend=self.backend)
+
+
+class MongoPool:
+    """
+    Pool shared by every replica through MongoDB.
+
+    waiting_pool holds one document per waiting user, keyed by user_id:
+
+        {_id: user_id, gender, region, language, country, added_at}
+
+    Claims are find_one_and_delete sorted by added_at, so the longest-waiting
+    compatible user is taken and no two replicas can take the same one. The
+    compound indexes from db.create_indexes end in added_at, so a filtered
+    claim is an index range scan that stops at its first document.
+
+    Premium requests live in premium_queue (written by the match handlers);
+    a request is claimed the same way.
+    """
+
+    backend = "mongo"
+
+    def __init__(self, collection, requests_collection, ttl=None):
+        self.collection = collection
+        self.requests_collection = requests_collection
+        self.ttl = ttl
+
+    def _doc(self, user, added_at):
+        doc = {key: user.get(key) or "" for key in MATCH_KEYS}
+        doc["added_at"] = added_at
+        if self.ttl:
+            # TTL index backstop for searchers whose bot replica went away
+            doc["expire_at"] = datetime.utcnow() + timedelta(seconds=self.ttl)
+        return doc
+
+    async def add(self, user_id, user):
+        await self.collection.replace_one({"_id": user_id}, self._doc(user, datetime.utcnow()), upsert=True)
+
+    async def remove(self, user_id):
+        result = await self.collection.delete_one({"_id": user_id})
+        return result.deleted_count == 1
+
+    async def contains(self, user_id):
+        return await self.collection.count_documents({"_id": user_id}, limit=1) > 0
+
+    async def claim(self, filters=None, exclude=(), seeker=None):
+        query = {key: val for key, val in (filters or {}).items() if key in MATCH_KEYS and val}
+        if exclude:
+            query["_id"] = {"$nin": list(exclude)}
+        doc = await self.collection.find_one_and_delete(query, sort=[("added_at", 1)])
+        if doc is None:
+            return None
+        doc.pop("expire_at", None)
+        user_id = doc.pop("_id")
+        return _entry(user_id, doc, doc.pop("added_at"))
+
+    async def restore(self, entry):
+        doc = self._doc(entry, entry.get("added_at") or datetime.utcnow())
+        await self.collection.replace_one({"_id": entry["user_id"]}, doc, upsert=True)
+
+    async def add_request(self, user_id, filters, added_at=None):
+        pass  # premium_queue is the index; the handler has already written it
+
+    async def remove_request(self, user_id):
+        result = await self.requests_collection.delete_one({"user_id": user_id})
+        return result.deleted_count == 1
+
+    async def has_request(self, user_id):
+        return await self.requests_collection.count_documents({"user_id": user_id}, limit=1) > 0
+
+    async def claim_request(self, user_id, user, exclude=()):
+        # A request accepts a value when its filter is that value, empty or unset
+        query = {"user_id": {"$nin": [user_id, *exclude]}}
+        for key in MATCH_KEYS:
+            query[f"filters.{key}"] = {"$in": [None, "", user.get(key) or ""]}
+        return await self.requests_collection.find_one_and_delete(
+            query, sort=[("added_at", 1)], projection={"_id": 0}
+        )
+
+    async def requests(self):
+        cursor = self.requests_collection.find({}, {"_id": 0, "user_id": 1, "filters": 1}).sort("added_at", 1)
+        return [(doc["user_id"], doc.get("filters", {})) async for doc in cursor]
+
+    async def stats(self):
+        return {
+            "backend": self.backend,
+            "waiting": await self.collection.estimated_document_count(),
+            "premium_requests": await self.requests_collection.estimated_document_count(),
+        }
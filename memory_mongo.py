@@ -0,0 +1,485 @@
+"""
+In-memory stand-in for the motor database, for offline runs (simulate.py).
+
+MemoryDatabase hands out MemoryCollection objects the same way db.db hands
+out motor collections, and implements the subset of the collection API the
+bot uses: find/find_one with projection, sort and limit, the insert,
+update, replace and delete methods, find_one_and_delete, bulk_write,
+count_documents and create_index. Queries understand equality (None also
+matches a missing field), dotted paths, $in/$nin/$ne/$exists, the
+comparison operators, $or and $and. Updates understand $set, $setOnInsert,
+$unset, $inc, $max, $min and $push with $each/$slice. Unique indexes raise
+DuplicateKeyError / BulkWriteError with code 11000 like a server would.
+
+Every method call is one "round trip": it is counted in ops (per
+collection.method) and awaits asyncio.sleep(latency), so concurrent
+handlers interleave at the same points they would against MongoDB.
+Aggregation pipelines, pipeline updates and sessions are not emulated;
+session= is accepted and ignored (db.supports_transactions stays False).
+"""
+
+import asyncio
+import copy
+from collections import Counter
+from types import SimpleNamespace
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return _MISSING
+        doc = doc[part]
+    return doc
+
+
+def _set(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset(doc, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _equals(value, expected):
+    if value is _MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _compare(value, op, operand):
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == "$lt":
+            return value < operand
+        if op == "$lte":
+            return value <= operand
+        if op == "$gt":
+            return value > operand
+        return value >= operand
+    except TypeError:
+        return False
+
+
+def _match_condition(value, condition):
+    if not (isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)):
+        return _equals(value, condition)
+    for op, operand in condition.items():
+        if op == "$eq":
+            ok = _equals(value, operand)
+        elif op == "$ne":
+            ok = not _equals(value, operand)
+        elif op == "$in":
+            ok = any(_equals(value, v) for v in operand)
+        elif op == "$nin":
+            ok = not any(_equals(value, v) for v in operand)
+        elif op == "$exists":
+            ok = (value is not _MISSING) == bool(operand)
+        elif op in ("$lt", "$lte", "$gt", "$gte"):
+            ok = _compare(value, op, operand)
+        else:
+            raise NotImplementedError(f"query operator {op}")
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif not _match_condition(_get(doc, key), condition):
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include = [k for k, v in projection.items() if v and k != "_id"]
+    if include:
+        out = {k: copy.deepcopy(doc[k]) for k in include if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    return {k: copy.deepcopy(v) for k, v in doc.items() if projection.get(k, 1)}
+
+
+def _sort_key(spec):
+    def key(doc):
+        values = []
+        for field, _ in spec:
+            value = _get(doc, field)
+            # Missing and None sort first, as in MongoDB
+            values.append((0, 0) if value in (_MISSING, None) else (1, value))
+        return values
+    return key
+
+
+def _sorted(docs, spec):
+    # Stable sorts from the last key to the first honour mixed directions
+    for field, direction in reversed(spec):
+        docs = sorted(docs, key=_sort_key([(field, direction)]), reverse=direction < 0)
+    return docs
+
+
+def _sort_spec(key_or_list, direction=1):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction)]
+    return list(key_or_list)
+
+
+def _apply_update(doc, update, inserting=False):
+    if not isinstance(update, dict):
+        raise NotImplementedError("pipeline updates")
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            current = _get(doc, path)
+            if op in ("$set", "$setOnInsert"):
+                _set(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                _unset(doc, path)
+            elif op == "$inc":
+                _set(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == "$max":
+                if current is _MISSING or value > current:
+                    _set(doc, path, value)
+            elif op == "$min":
+                if current is _MISSING or value < current:
+                    _set(doc, path, value)
+            elif op == "$push":
+                items = list(current) if isinstance(current, list) else []
+                if isinstance(value, dict) and "$each" in value:
+                    items.extend(copy.deepcopy(value["$each"]))
+                    if "$slice" in value:
+                        n = value["$slice"]
+                        items = items[n:] if n < 0 else items[:n]
+                else:
+                    items.append(copy.deepcopy(value))
+                _set(doc, path, items)
+            else:
+                raise NotImplementedError(f"update operator {op}")
+
+
+class MemoryCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def _results(self):
+        docs = self._collection._select(self._query)
+        if self._sort:
+            docs = _sorted(docs, self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [_project(d, self._projection) for d in docs]
+
+    async def to_list(self, length=None):
+        await self._collection._round_trip("find")
+        docs = self._results()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self.to_list():
+            yield doc
+
+
+class MemoryCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._docs = {}            # _id -> document, in insertion order
+        self._indexes = {}         # field tuple -> {value tuple: set of _id}
+        self._unhashed = {}        # field tuple -> _ids whose values can't be hashed
+        self._unique = set()       # field tuples of unique indexes
+
+    async def _round_trip(self, method):
+        self.database.ops[f"{self.name}.{method}"] += 1
+        await asyncio.sleep(self.database.latency)
+
+    # ── indexes ───────────────────────────────────────────────────────
+    @staticmethod
+    def _key(doc, fields):
+        return tuple(None if (v := _get(doc, f)) is _MISSING else v for f in fields)
+
+    def _index(self, doc, add=True):
+        for fields in self._indexes:
+            self._index_one(doc, fields, add)
+
+    def _index_one(self, doc, fields, add=True):
+        index = self._indexes[fields]
+        key = self._key(doc, fields)
+        try:
+            ids = index.setdefault(key, set()) if add else index.get(key, set())
+        except TypeError:
+            ids = self._unhashed[fields]
+        if add:
+            ids.add(doc["_id"])
+        else:
+            ids.discard(doc["_id"])
+
+    def _check_unique(self, doc, ignore_id=None):
+        for fields in self._unique:
+            try:
+                ids = self._indexes[fields].get(self._key(doc, fields), ())
+            except TypeError:
+                continue
+            if any(_id != ignore_id for _id in ids):
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {'_'.join(fields)}",
+                    11000)
+
+    def _candidates(self, query):
+        """Documents that may match: an index lookup when the query pins every field of one"""
+        _id = query.get("_id", _MISSING)
+        if _id is not _MISSING and not isinstance(_id, (dict, list)):
+            doc = self._docs.get(_id)
+            return [doc] if doc is not None else []
+        for fields, index in self._indexes.items():
+            values = [query.get(f, _MISSING) for f in fields]
+            if any(v is _MISSING or isinstance(v, (dict, list)) for v in values):
+                continue
+            ids = index.get(tuple(values), set()) | self._unhashed[fields]
+            return [self._docs[i] for i in ids]
+        return list(self._docs.values())
+
+    # ── helpers ───────────────────────────────────────────────────────
+    def _insert(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_", 11000)
+        self._check_unique(doc)
+        self._docs[doc["_id"]] = doc
+        self._index(doc)
+        return doc["_id"]
+
+    def _select(self, query):
+        return [d for d in self._candidates(query) if matches(d, query)]
+
+    def _first(self, query, sort=None):
+        docs = self._select(query)
+        if sort:
+            docs = _sorted(docs, _sort_spec(sort))
+        return docs[0] if docs else None
+
+    def _remove(self, doc):
+        del self._docs[doc["_id"]]
+        self._index(doc, add=False)
+
+    def _upsert_doc(self, query):
+        doc = {}
+        for key, condition in query.items():
+            if key.startswith("$"):
+                continue
+            if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+                if "$eq" in condition:
+                    _set(doc, key, copy.deepcopy(condition["$eq"]))
+                continue
+            _set(doc, key, copy.deepcopy(condition))
+        return doc
+
+    def _update(self, query, update, upsert=False, many=False, replace=False):
+        targets = self._select(query)
+        if not many:
+            targets = targets[:1]
+        if not targets:
+            if not upsert:
+                return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+            doc = self._upsert_doc(query)
+            if replace:
+                doc = dict(copy.deepcopy(update), _id=doc.get("_id", ObjectId()))
+            else:
+                _apply_update(doc, update, inserting=True)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=self._insert(doc))
+        modified = 0
+        for target in targets:
+            new = copy.deepcopy(update) if replace else copy.deepcopy(target)
+            new["_id"] = target["_id"]
+            if not replace:
+                _apply_update(new, update)
+            if new != target:
+                self._check_unique(new, ignore_id=target["_id"])
+                self._index(target, add=False)
+                self._docs[target["_id"]] = new
+                self._index(new)
+                modified += 1
+        return SimpleNamespace(matched_count=len(targets), modified_count=modified, upserted_id=None)
+
+    def _delete(self, query, many=False):
+        docs = self._select(query)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            self._remove(doc)
+        return SimpleNamespace(deleted_count=len(docs))
+
+    # ── motor API ─────────────────────────────────────────────────────
+    async def create_index(self, keys, unique=False, **kwargs):
+        await self._round_trip("create_index")
+        fields = tuple(field for field, _ in _sort_spec(keys))
+        if fields not in self._indexes:
+            self._indexes[fields] = {}
+            self._unhashed[fields] = set()
+            for doc in self._docs.values():
+                self._index_one(doc, fields)
+        if unique:
+            self._unique.add(fields)
+        return "_".join(fields)
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return MemoryCursor(self, filter or {}, projection)
+
+    async def find_one(self, filter=None, projection=None, sort=None, session=None, **kwargs):
+        await self._round_trip("find_one")
+        doc = self._first(filter or {}, sort)
+        return _project(doc, projection) if doc is not None else None
+
+    async def insert_one(self, document, session=None):
+        await self._round_trip("insert_one")
+        return SimpleNamespace(inserted_id=self._insert(document))
+
+    async def insert_many(self, documents, ordered=True, session=None):
+        await self._round_trip("insert_many")
+        return SimpleNamespace(inserted_ids=[self._insert(doc) for doc in documents])
+
+    async def update_one(self, filter, update, upsert=False, session=None, **kwargs):
+        await self._round_trip("update_one")
+        return self._update(filter, update, upsert=upsert)
+
+    async def update_many(self, filter, update, upsert=False, session=None, **kwargs):
+        await self._round_trip("update_many")
+        return self._update(filter, update, upsert=upsert, many=True)
+
+    async def replace_one(self, filter, replacement, upsert=False, session=None, **kwargs):
+        await self._round_trip("replace_one")
+        return self._update(filter, replacement, upsert=upsert, replace=True)
+
+    async def delete_one(self, filter, session=None, **kwargs):
+        await self._round_trip("delete_one")
+        return self._delete(filter)
+
+    async def delete_many(self, filter, session=None, **kwargs):
+        await self._round_trip("delete_many")
+        return self._delete(filter, many=True)
+
+    async def find_one_and_delete(self, filter, projection=None, sort=None, session=None, **kwargs):
+        await self._round_trip("find_one_and_delete")
+        doc = self._first(filter, sort)
+        if doc is None:
+            return None
+        self._remove(doc)
+        return _project(doc, projection)
+
+    async def count_documents(self, filter, limit=0, session=None, **kwargs):
+        await self._round_trip("count_documents")
+        count = len(self._select(filter or {}))
+        return min(count, limit) if limit else count
+
+    async def estimated_document_count(self, **kwargs):
+        await self._round_trip("estimated_document_count")
+        return len(self._docs)
+
+    async def bulk_write(self, requests, ordered=True, session=None, **kwargs):
+        await self._round_trip("bulk_write")
+        errors = []
+        counts = Counter()
+        for i, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    counts["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                    result = self._update(
+                        request._filter, request._doc, upsert=request._upsert,
+                        many=isinstance(request, UpdateMany), replace=isinstance(request, ReplaceOne))
+                    counts["nMatched"] += result.matched_count
+                    counts["nModified"] += result.modified_count
+                    counts["nUpserted"] += result.upserted_id is not None
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    counts["nRemoved"] += self._delete(request._filter, many=isinstance(request, DeleteMany)).deleted_count
+                else:
+                    raise NotImplementedError(f"bulk request {type(request).__name__}")
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError(dict(counts, writeErrors=errors))
+        return SimpleNamespace(
+            inserted_count=counts["nInserted"], matched_count=counts["nMatched"],
+            modified_count=counts["nModified"], deleted_count=counts["nRemoved"],
+            upserted_count=counts["nUpserted"])
+
+    async def drop(self):
+        await self._round_trip("drop")
+        self._docs.clear()
+        self._indexes.clear()
+        self._unhashed.clear()
+        self._unique.clear()
+
+
+class MemoryDatabase:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.ops = Counter()    # "collection.method" -> calls
+        self._collections = {}
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self):
+        return list(self._collections)
+
+    def total_ops(self):
+        return sum(self.ops.values())
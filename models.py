@@ -21,10 +21,12 @@ def default_user(user, language="en"):
     }
 
 def default_room(room_id, user1, user2):
+    now = datetime.utcnow().timestamp()
     return {
         "room_id": room_id,
         "users": [user1, user2],
-        "created_at": datetime.utcnow().timestamp(),
+        "created_at": now,
+        "last_message_at": now,
         "messages": [],
         "active": True,
         "reports": []
@@ -39,3 +41,79 @@ def default_report(room_id, reporter_id, reported_id, chat_history):
         "created_at": datetime.utcnow().isoformat(),
         "reviewed": False
     }
+
+class _Record:
+    """
+    Compact slotted record built from a MongoDB document.
+    Fields outside FIELDS are kept in `extra`; fields left out of a
+    projected fetch are simply unset, and get() falls back to its default.
+    """
+    FIELDS = ()
+    __slots__ = ("extra",)
+
+    def __init__(self, **fields):
+        self.extra = None
+        self.update(fields)
+
+    @classmethod
+    def from_doc(cls, doc):
+        return cls(**doc) if doc else None
+
+    def update(self, fields):
+        for key, value in fields.items():
+            if key in self.FIELDS:
+                setattr(self, key, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            return getattr(self, key, default)
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def to_dict(self):
+        """The record as a plain dict; nested lists and dicts are copies, so editing it leaves the record alone"""
+        doc = {key: getattr(self, key) for key in self.FIELDS if hasattr(self, key)}
+        if self.extra:
+            doc.update(self.extra)
+        return _copy(doc)
+
+_MISSING = object()
+
+def _copy(value):
+    """Copy nested dicts and lists; anything else is shared"""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+class User(_Record):
+    FIELDS = (
+        "_id", "user_id", "username", "phone_number", "language", "name",
+        "gender", "region", "country", "is_premium", "premium_expiry",
+        "blocked", "matching_preferences", "profile_photos", "created_at",
+        "referred_by", "referral_count", "is_online", "last_active", "recent_partners"
+    )
+    __slots__ = FIELDS
+
+class Room(_Record):
+    FIELDS = ("_id", "room_id", "users", "created_at", "last_message_at", "messages", "active", "reports")
+    __slots__ = FIELDS
+
+# Field projections for hot paths that only need a few small fields
+USER_VIEWS = {
+    "locale": ("user_id", "language"),
+    "routing": ("user_id", "language", "username", "blocked"),
+}
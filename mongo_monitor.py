@@ -0,0 +1,197 @@
+"""
+MongoDB command monitoring.
+
+CommandMonitor is a pymongo CommandListener registered on the motor client
+in db.py. It keeps, in process:
+
+  • latency histograms per command name and per collection
+  • a slow-query log: commands slower than MONGO_SLOW_MS are logged with
+    their filter shape (values replaced by "?") and kept in a short ring
+  • a histogram of how many commands each Telegram update issued, and
+    of how many lookups its update_scope answered without one
+
+begin_update()/end_update() open and close the update's update_scope;
+bot.py calls them from handlers registered before and after every other
+handler group.
+snapshot() returns everything as a plain dict for /dbstats.
+"""
+
+import logging
+import os
+import threading
+from bisect import bisect_left
+from collections import deque
+
+from pymongo import monitoring
+
+import update_scope
+
+logger = logging.getLogger(__name__)
+
+MONGO_SLOW_MS = float(os.getenv("MONGO_SLOW_MS", "100"))
+
+# Upper bounds (ms) of the latency buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+# Upper bounds of the commands-per-update buckets
+UPDATE_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+# Where each command keeps its filter, for the slow-query log
+_FILTER_PATHS = {
+    "find": ("filter",),
+    "count": ("query",),
+    "distinct": ("query",),
+    "findAndModify": ("query",),
+    "update": ("updates", 0, "q"),
+    "delete": ("deletes", 0, "q"),
+    "aggregate": ("pipeline", 0, "$match"),
+}
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count", "max")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile"""
+        if not self.count:
+            return 0
+        rank = self.count * pct / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 2) if self.count else 0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": round(self.max, 2),
+            "buckets": {label: n for label, n in zip(labels, self.counts) if n},
+        }
+
+
+def filter_shape(value):
+    """Replace every leaf value by "?" so only the query's structure is kept"""
+    if isinstance(value, dict):
+        return {k: filter_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [filter_shape(v) for v in value[:3]]
+    return "?"
+
+
+def _extract_filter(command_name, command):
+    node = command
+    for step in _FILTER_PATHS.get(command_name, ()):
+        try:
+            node = node[step]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return node if node is not command else None
+
+
+class CommandMonitor(monitoring.CommandListener):
+    def __init__(self, slow_ms=MONGO_SLOW_MS, slow_log_size=50):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.by_command = {}
+        self.by_collection = {}
+        self.per_update = Histogram(UPDATE_BUCKETS)
+        self.scope_hits = Histogram(UPDATE_BUCKETS)
+        self.failures = 0
+        self.slow = deque(maxlen=slow_log_size)
+
+    # ── pymongo listener interface ────────────────────────────────────
+    def started(self, event):
+        command = event.command
+        collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = None
+        query = _extract_filter(event.command_name, command)
+        shape = filter_shape(query) if query is not None else None
+        scope = update_scope.current()
+        if scope is not None:
+            scope.commands += 1
+        with self._lock:
+            self._pending[event.request_id] = (collection, shape)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed):
+        duration_ms = event.duration_micros / 1000
+        with self._lock:
+            collection, shape = self._pending.pop(event.request_id, (None, None))
+            if failed:
+                self.failures += 1
+            self._histogram(self.by_command, event.command_name).record(duration_ms)
+            if collection:
+                self._histogram(self.by_collection, collection).record(duration_ms)
+        if duration_ms >= self.slow_ms:
+            entry = {
+                "command": event.command_name,
+                "collection": collection,
+                "filter": shape,
+                "ms": round(duration_ms, 1),
+                "failed": failed,
+            }
+            self.slow.append(entry)
+            logger.warning(
+                f"Slow MongoDB {event.command_name} on {collection}: "
+                f"{duration_ms:.1f}ms filter={shape}"
+            )
+
+    @staticmethod
+    def _histogram(table, key):
+        hist = table.get(key)
+        if hist is None:
+            hist = table[key] = Histogram(LATENCY_BUCKETS_MS)
+        return hist
+
+    # ── per-update accounting ─────────────────────────────────────────
+    def begin_update(self, user_id=None):
+        update_scope.begin(user_id)
+
+    def end_update(self):
+        scope = update_scope.end()
+        if scope is not None:
+            with self._lock:
+                self.per_update.record(scope.commands)
+                self.scope_hits.record(scope.hits)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "slow_threshold_ms": self.slow_ms,
+                "failures": self.failures,
+                "by_command": {k: v.snapshot() for k, v in sorted(self.by_command.items())},
+                "by_collection": {k: v.snapshot() for k, v in sorted(self.by_collection.items())},
+                "commands_per_update": self.per_update.snapshot(),
+                "scope_hits_per_update": self.scope_hits.snapshot(),
+                "slow_queries": list(self.slow),
+            }
+
+
+command_monitor = CommandMonitor()
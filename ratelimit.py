@@ -0,0 +1,137 @@
+"""
+Per-user token buckets.
+
+Every user has one bucket per action class:
+
+    message    a relayed message (anything that is not a command)
+    match      /find and /next, each of which starts a search
+    callback   an inline button press
+
+A bucket holds up to `burst` tokens and refills at `per_minute` tokens a
+minute; each update takes one. An update that finds its bucket empty is
+rejected and puts that action class into a cooldown, which doubles with
+each further overflow (RATE_LIMIT_COOLDOWN_SECONDS up to
+RATE_LIMIT_MAX_COOLDOWN_SECONDS) and falls back to the base once the user
+has gone RATE_LIMIT_FORGIVE_SECONDS without overflowing. Everything of
+that class is rejected until the cooldown ends.
+
+State is in memory, for at most max_users users (least recently seen are
+dropped, which only forgives them early).
+"""
+
+import os
+import time
+from collections import Counter, OrderedDict
+
+RATE_LIMIT_MESSAGE_BURST = int(os.getenv("RATE_LIMIT_MESSAGE_BURST", "10"))
+RATE_LIMIT_MESSAGE_PER_MINUTE = float(os.getenv("RATE_LIMIT_MESSAGE_PER_MINUTE", "30"))
+RATE_LIMIT_MATCH_BURST = int(os.getenv("RATE_LIMIT_MATCH_BURST", "5"))
+RATE_LIMIT_MATCH_PER_MINUTE = float(os.getenv("RATE_LIMIT_MATCH_PER_MINUTE", "10"))
+RATE_LIMIT_CALLBACK_BURST = int(os.getenv("RATE_LIMIT_CALLBACK_BURST", "10"))
+RATE_LIMIT_CALLBACK_PER_MINUTE = float(os.getenv("RATE_LIMIT_CALLBACK_PER_MINUTE", "40"))
+RATE_LIMIT_COOLDOWN_SECONDS = float(os.getenv("RATE_LIMIT_COOLDOWN_SECONDS", "10"))
+RATE_LIMIT_MAX_COOLDOWN_SECONDS = float(os.getenv("RATE_LIMIT_MAX_COOLDOWN_SECONDS", "600"))
+RATE_LIMIT_FORGIVE_SECONDS = float(os.getenv("RATE_LIMIT_FORGIVE_SECONDS", "900"))
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "50000"))
+
+# action class -> (burst, tokens per minute)
+LIMITS = {
+    "message": (RATE_LIMIT_MESSAGE_BURST, RATE_LIMIT_MESSAGE_PER_MINUTE),
+    "match": (RATE_LIMIT_MATCH_BURST, RATE_LIMIT_MATCH_PER_MINUTE),
+    "callback": (RATE_LIMIT_CALLBACK_BURST, RATE_LIMIT_CALLBACK_PER_MINUTE),
+}
+
+MATCH_COMMANDS = ("find", "next")
+
+
+def action_for(update):
+    """The action class of an update, or None when it is not rate limited"""
+    if update.callback_query:
+        return "callback"
+    message = update.message
+    if not message:
+        return None
+    text = message.text or ""
+    if text.startswith("/"):
+        parts = text[1:].split(maxsplit=1)
+        command = parts[0].split("@", 1)[0].lower() if parts else ""
+        return "match" if command in MATCH_COMMANDS else None
+    return "message"
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "blocked_until", "overflows", "overflowed_at")
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+        self.blocked_until = 0.0
+        self.overflows = 0
+        self.overflowed_at = 0.0
+
+
+class RateLimiter:
+    def __init__(self, limits=LIMITS, cooldown=RATE_LIMIT_COOLDOWN_SECONDS,
+                 max_cooldown=RATE_LIMIT_MAX_COOLDOWN_SECONDS,
+                 forgive=RATE_LIMIT_FORGIVE_SECONDS, max_users=RATE_LIMIT_MAX_USERS):
+        self.limits = limits
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.forgive = forgive
+        self.max_users = max_users
+        self._users = OrderedDict()   # user_id -> {action: _Bucket}
+        self.allowed = Counter()
+        self.rejected = Counter()
+        self.cooldowns = Counter()
+
+    def _bucket(self, user_id, action, now):
+        buckets = self._users.get(user_id)
+        if buckets is None:
+            buckets = self._users[user_id] = {}
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        bucket = buckets.get(action)
+        if bucket is None:
+            bucket = buckets[action] = _Bucket(self.limits[action][0], now)
+        return bucket
+
+    def check(self, user_id, action, now=None):
+        """
+        Take a token for one update. Returns (retry_after, started): 0 when
+        the update may go ahead, otherwise the seconds until the cooldown
+        ends, with started True only for the update that began it.
+        """
+        now = now or time.monotonic()
+        burst, per_minute = self.limits[action]
+        bucket = self._bucket(user_id, action, now)
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * per_minute / 60)
+        bucket.updated = now
+
+        if now < bucket.blocked_until:
+            self.rejected[action] += 1
+            return bucket.blocked_until - now, False
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            self.allowed[action] += 1
+            return 0, False
+
+        if now - bucket.overflowed_at >= self.forgive:
+            bucket.overflows = 0
+        bucket.overflows += 1
+        bucket.overflowed_at = now
+        cooldown = min(self.cooldown * 2 ** (bucket.overflows - 1), self.max_cooldown)
+        bucket.blocked_until = now + cooldown
+        self.rejected[action] += 1
+        self.cooldowns[action] += 1
+        return cooldown, True
+
+    def stats(self):
+        return {
+            "users": len(self._users),
+            "limits": {action: {"burst": b, "per_minute": r} for action, (b, r) in self.limits.items()},
+            "allowed": dict(self.allowed),
+            "rejected": dict(self.rejected),
+            "cooldowns": dict(self.cooldowns),
+        }
@@ -0,0 +1,89 @@
+"""
+Recent-partner memory for matchmaking.
+
+Every pairing records each user in the other's history: a ring buffer of
+the last K partner ids (a deque with maxlen) plus a set over the same ids,
+so checking a candidate is a set lookup. Matchers pass exclusions() as the
+`exclude` argument of the pool's claim, which keeps /next from handing a
+user straight back to someone they just left.
+
+Histories are held for at most MAX_USERS users (least recently used are
+dropped) and persisted lazily: record() only queues the new partner ids
+and db.flush_recent_partners() appends everything queued in one bulk
+write ($push with $slice, so the stored list stays at K and a history
+that was never loaded is extended, not overwritten), from a periodic job
+and at shutdown. A history that is not in memory is seeded from the
+user's recent_partners field the next time the user document is at hand.
+"""
+
+from collections import OrderedDict, deque
+
+
+class RecentPartners:
+    def __init__(self, k=5, max_users=50000):
+        self.k = k
+        self.max_users = max_users
+        self._histories = OrderedDict()   # user_id -> (deque, set)
+        self._pending = {}                # user_id -> partner ids not yet saved
+        self.recorded = 0
+        self.evictions = 0
+
+    def _history(self, user_id, seed=None):
+        history = self._histories.get(user_id)
+        if history is None:
+            ring = deque((seed or [])[-self.k:], maxlen=self.k)
+            history = self._histories[user_id] = (ring, set(ring))
+            while len(self._histories) > self.max_users:
+                self._histories.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._histories.move_to_end(user_id)
+        return history
+
+    def _push(self, user_id, partner_id, seed=None):
+        ring, members = self._history(user_id, seed)
+        if partner_id in members:
+            ring.remove(partner_id)
+        elif len(ring) == ring.maxlen:
+            members.discard(ring[0])
+        ring.append(partner_id)
+        members.add(partner_id)
+        pending = self._pending.setdefault(user_id, [])
+        pending.append(partner_id)
+        if len(pending) > self.k:
+            del pending[0]
+
+    def record(self, user1, user2, user1_doc=None, user2_doc=None):
+        """Remember that two users were paired"""
+        if self.k <= 0:
+            return
+        self._push(user1, user2, (user1_doc or {}).get("recent_partners"))
+        self._push(user2, user1, (user2_doc or {}).get("recent_partners"))
+        self.recorded += 1
+
+    def seen(self, user_id, partner_id):
+        history = self._histories.get(user_id)
+        return history is not None and partner_id in history[1]
+
+    def exclusions(self, user_id, user=None):
+        """The user plus their recent partners, as a set for O(1) checks"""
+        if self.k <= 0:
+            return {user_id}
+        seed = user.get("recent_partners") if user else None
+        if user_id not in self._histories and not seed:
+            return {user_id}
+        return self._history(user_id, seed)[1] | {user_id}
+
+    def pop_pending(self):
+        """Partners recorded since the last flush, as {user_id: [ids]}"""
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def stats(self):
+        return {
+            "users": len(self._histories),
+            "pending": len(self._pending),
+            "k": self.k,
+            "recorded": self.recorded,
+            "evictions": self.evictions,
+        }
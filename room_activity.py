@@ -0,0 +1,75 @@
+"""
+Coalesced last-activity tracking for rooms.
+
+touch() only records the time of a room's latest message in a dict, so a
+busy room costs one dict assignment per message. flush() writes every room
+touched since the previous flush with a single unordered bulk_write of
+$max updates on rooms.last_message_at (never moving it backwards, and
+never recreating a room that was closed in the meantime).
+
+The idle-room reaper flushes first, so it always sees activity up to the
+moment it runs; between flushes the stored value lags by at most the
+flush interval.
+"""
+
+import logging
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+def now_ts():
+    """Timestamp in the same clock as models.default_room's created_at"""
+    return datetime.utcnow().timestamp()
+
+
+class RoomActivity:
+    def __init__(self, collection):
+        self.collection = collection
+        self._pending = {}   # room_id -> latest message timestamp
+        self.touches = 0
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def touch(self, room_id, ts=None):
+        ts = ts or now_ts()
+        if ts > self._pending.get(room_id, 0):
+            self._pending[room_id] = ts
+        self.touches += 1
+
+    def discard(self, room_id):
+        self._pending.pop(room_id, None)
+
+    async def flush(self):
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        ops = [
+            UpdateOne({"room_id": room_id}, {"$max": {"last_message_at": ts}})
+            for room_id, ts in pending.items()
+        ]
+        try:
+            await self.collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Room activity flush of {len(ops)} rooms failed: {e}")
+            # Keep the timestamps for the next attempt unless newer ones arrived
+            for room_id, ts in pending.items():
+                if ts > self._pending.get(room_id, 0):
+                    self._pending[room_id] = ts
+            return 0
+        self.written += len(ops)
+        self.flushes += 1
+        return len(ops)
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "touches": self.touches,
+            "written": self.written,
+            "flushes": self.flushes,
+            "errors": self.errors,
+        }
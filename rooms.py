@@ -1,39 +1,176 @@
-import uuid, time
-from db import db, insert_room, get_room, update_room, update_user
+import os, uuid, time, asyncio
+from contextlib import asynccontextmanager
+from db import (
+    db, open_room, close_room_records, update_user, delete_chat_logs, recent_partners, confirm_user_route, match_stats
+)
 from models import default_room
+from matchmaking import MemoryPool, MongoPool
+from search_expiry import SearchDeadlines
 from datetime import datetime
 
-users_online = set()  # In-memory, see note below
+# "memory" keeps the waiting pool in this process; "mongo" shares it through
+# the waiting_pool collection so several bot replicas can match together;
+# "scoring" is in-process and picks the best-scoring candidate (scoring.py).
+POOL_BACKEND = os.getenv("POOL_BACKEND", "memory").lower()
+# Searches are dropped (and the user asked whether to keep searching) after
+# this long without a match; 0 disables expiry
+SEARCH_TIMEOUT_SECONDS = int(os.getenv("SEARCH_TIMEOUT_SECONDS", "600"))
+PREMIUM_SEARCH_TIMEOUT_SECONDS = int(os.getenv("PREMIUM_SEARCH_TIMEOUT_SECONDS", "3600"))
+# Extra lifetime of Mongo pool/queue documents past the deadline. Live bots
+# evict and notify first; the TTL index only clears searches of dead replicas.
+SEARCH_TTL_GRACE_SECONDS = 300
+
+search_deadlines = SearchDeadlines()
+
+# Rooms without a message for this long are closed by the idle reaper; 0 disables it
+ROOM_IDLE_MINUTES = int(os.getenv("ROOM_IDLE_MINUTES", "30"))
+
+if POOL_BACKEND == "mongo":
+    waiting_pool = MongoPool(
+        db.waiting_pool, db.premium_queue,
+        ttl=SEARCH_TIMEOUT_SECONDS + SEARCH_TTL_GRACE_SECONDS if SEARCH_TIMEOUT_SECONDS else None
+    )
+elif POOL_BACKEND == "scoring":
+    from scoring import ScoringPool  # needs numpy
+    waiting_pool = ScoringPool()
+else:
+    waiting_pool = MemoryPool()
+
+# user_id -> [lock, holders + waiters]; entries go away when unused
+_user_locks = {}
+
+@asynccontextmanager
+async def _locked(*user_ids):
+    """Hold the pairing locks of several users, always taken in id order"""
+    user_ids = sorted(set(user_ids))
+    entries = []
+    for user_id in user_ids:
+        entry = _user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        entries.append(entry)
+    acquired = []
+    try:
+        for entry in entries:
+            await entry[0].acquire()
+            acquired.append(entry)
+        yield
+    finally:
+        for entry in acquired:
+            entry[0].release()
+        for user_id, entry in zip(user_ids, entries):
+            entry[1] -= 1
+            if not entry[1]:
+                _user_locks.pop(user_id, None)
 
 async def create_room(user1: int, user2: int):
-    room_id = uuid.uuid4().hex[:8]
-    room_data = default_room(room_id, user1, user2)
-    await insert_room(room_data)
-    users_online.discard(user1)
-    users_online.discard(user2)
+    """
+    Pair two users if neither is in a room yet. Returns the room id, or
+    None when one of them was paired first (in this process: the route
+    check under both users' locks; across processes: open_room's
+    conditional user_rooms upsert).
+    """
+    if user1 == user2:
+        return None
+    async with _locked(user1, user2):
+        if await confirm_user_route(user1) or await confirm_user_route(user2):
+            return None
+        room_id = uuid.uuid4().hex[:8]
+        room_data = default_room(room_id, user1, user2)
+        if not await open_room(room_data, user1, user2):
+            return None
+    recent_partners.record(user1, user2)
+    match_stats.matched(user1, user2, room_id)
+    for user_id in (user1, user2):
+        await waiting_pool.remove(user_id)
+        search_deadlines.cancel("pool", user_id)
     return room_id
 
-async def close_room(room_id: str):
-    await update_room(room_id, {"active": False})
+async def close_room(room_id: str, reason="end"):
+    await close_room_records(room_id)
+    match_stats.room_closed(room_id, reason)
     # Delete all chat logs for this room when closing the room
-    await db.chatlogs.delete_many({"room_id": room_id})
+    await delete_chat_logs(room_id)
+
+def _take_deadline(entry):
+    """Cancel a claimed user's search deadline, keeping it on the entry for release_claim"""
+    entry["deadline"] = search_deadlines.deadline("pool", entry["user_id"])
+    search_deadlines.cancel("pool", entry["user_id"])
+
+async def find_match_for(user_id: int, prefer_filters=None, user=None):
+    """
+    Claim the best waiting user satisfying the filters; they leave the pool.
+    Returns their pool entry (user_id, profile, added_at), or None.
+    """
+    # Prefer filters: gender, region, language, country
+    exclude = recent_partners.exclusions(user_id, user)
+    entry = await waiting_pool.claim(prefer_filters, exclude=exclude, seeker=user)
+    if entry is None:
+        return None
+    _take_deadline(entry)
+    return entry
+
+async def join_pool(user_id: int, user: dict):
+    """
+    Wait in the pool, unless someone who joined at the same moment (possibly
+    on another replica) can be claimed instead. Returns that partner's pool
+    entry or None.
+    """
+    await add_to_pool(user_id, user)
+    exclude = recent_partners.exclusions(user_id, user)
+    entry = await waiting_pool.claim(exclude=exclude, seeker=user)
+    if entry is None:
+        return None
+    # Pair with the claimed user even when someone claimed us meanwhile:
+    # when that someone is the claimed user, handing them back would leave
+    # both of us waiting for the other to pair us. Whichever pairing loses
+    # the race releases its claim (handlers.match.match_user).
+    await remove_from_pool(user_id)
+    _take_deadline(entry)
+    return entry
+
+async def release_claim(entry):
+    """
+    Put a claimed user whose pairing fell through back in the pool, with
+    their original place in the queue and their original deadline
+    """
+    await waiting_pool.restore(entry)
+    deadline = entry.get("deadline")
+    if deadline is not None:
+        search_deadlines.schedule("pool", entry["user_id"], 0, start=deadline)
+
+async def add_to_pool(user_id: int, user: dict):
+    await waiting_pool.add(user_id, user)
+    if SEARCH_TIMEOUT_SECONDS:
+        search_deadlines.schedule("pool", user_id, SEARCH_TIMEOUT_SECONDS)
 
-async def find_match_for(user_id: int, prefer_filters=None):
-    # Prefer filters: gender, region, country, premium_only
-    candidates = [uid for uid in users_online if uid != user_id]  # Must exclude self
-    # TODO: Use DB to filter based on matching_preferences
-    # For now, just pick the first available
-    return candidates[0] if candidates else None
+async def remove_from_pool(user_id: int):
+    search_deadlines.cancel("pool", user_id)
+    return await waiting_pool.remove(user_id)
 
-def add_to_pool(user_id: int):
-    users_online.add(user_id)
+async def is_in_pool(user_id: int):
+    return await waiting_pool.contains(user_id)
 
-def remove_from_pool(user_id: int):
-    users_online.discard(user_id)
+async def load_premium_requests():
+    """
+    Mirror the premium_queue collection into an in-process pool (memory or
+    scoring); MongoPool reads premium_queue directly and needs no reload
+    """
+    if isinstance(waiting_pool, MongoPool):
+        return 0
+    count = 0
+    now = datetime.utcnow()
+    projection = {"_id": 0, "user_id": 1, "filters": 1, "added_at": 1}
+    async for queued in db.premium_queue.find({}, projection).sort("added_at", 1):
+        await waiting_pool.add_request(queued["user_id"], queued.get("filters", {}), queued.get("added_at"))
+        if PREMIUM_SEARCH_TIMEOUT_SECONDS:
+            waited = (now - queued.get("added_at", now)).total_seconds()
+            search_deadlines.schedule("premium", queued["user_id"], PREMIUM_SEARCH_TIMEOUT_SECONDS - waited)
+        count += 1
+    return count
 
 # MongoDB-backed online status for persistence (optional advanced)
-async def mark_user_online(user_id: int):
-    users_online.add(user_id)
+async def mark_user_online(user_id: int, user: dict):
+    await waiting_pool.add(user_id, user)
     await update_user(user_id, {
         "last_active": datetime.utcnow(),
         "is_online": True
@@ -0,0 +1,256 @@
+"""
+Score-based matchmaking over NumPy columns (POOL_BACKEND=scoring).
+
+Users with the same (gender, region, country, language, premium) profile
+score identically except for how long they have waited, so the index keeps
+two column stores:
+
+    profiles    one row per distinct profile; gender, region, country and
+                language as small integer codes (0 = unknown), premium bool
+    slots       one row per waiting user; the user id, their profile row
+                (0 = free slot) and the monotonic time they started waiting
+
+A search scores the few hundred profile rows against the searcher, with
+rows that fail the hard filters (the premium filter menu) set to -inf,
+spreads that over the waiting users with a single take(), adds the wait
+term and takes the argmax:
+
+    region      1 for the same region, NEIGHBOUR_AFFINITY for an adjacent one
+    country     1 for the same country
+    language    1 for the same language
+    premium     1 for premium candidates
+    wait        seconds waited / WAIT_NORM_SECONDS, capped at 1
+
+each multiplied by its weight. DEFAULT_WEIGHTS can be overridden with the
+MATCH_WEIGHTS environment variable (JSON, e.g. {"wait": 5}). With no
+searcher profile (the premium queue sweep) only premium and wait count, so
+the longest-waiting user wins as with the other backends.
+
+Per search that is a fixed handful of array passes over the pool, about
+0.2 ms for 50 000 waiting users. Freed slots are reused and the slot
+arrays double when full.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from matchmaking import MATCH_KEYS, MemoryPool, MatchIndex, _entry
+
+DEFAULT_WEIGHTS = {
+    "region": 2.0,
+    "country": 3.0,
+    "language": 4.0,
+    "premium": 0.5,
+    "wait": 3.0,
+}
+MATCH_WEIGHTS = dict(DEFAULT_WEIGHTS, **json.loads(os.getenv("MATCH_WEIGHTS", "{}")))
+WAIT_NORM_SECONDS = float(os.getenv("MATCH_WAIT_NORM_SECONDS", "60"))
+
+REGIONS = ['Africa', 'Europe', 'Asia', 'North America', 'South America', 'Oceania', 'Antarctica']
+NEIGHBOURS = [
+    ('Europe', 'Asia'), ('Europe', 'Africa'), ('Asia', 'Africa'), ('Asia', 'Oceania'),
+    ('North America', 'South America'), ('South America', 'Antarctica'), ('Oceania', 'Antarctica'),
+]
+NEIGHBOUR_AFFINITY = 0.5
+
+
+def _region_affinity():
+    """Region codes (0 is unknown) and the code x code affinity table"""
+    codes = {region: i + 1 for i, region in enumerate(REGIONS)}
+    table = np.zeros((len(REGIONS) + 1, len(REGIONS) + 1), dtype=np.float32)
+    for code in codes.values():
+        table[code, code] = 1.0
+    for a, b in NEIGHBOURS:
+        table[codes[a], codes[b]] = table[codes[b], codes[a]] = NEIGHBOUR_AFFINITY
+    return codes, table
+
+
+class ScoringIndex:
+    def __init__(self, capacity=1024, weights=None):
+        self.weights = dict(MATCH_WEIGHTS, **(weights or {}))
+        region_codes, self._affinity = _region_affinity()
+        # value -> code per key; region codes are fixed so the affinity
+        # table lines up, the others are assigned on first sight
+        self._codes = {key: {} for key in MATCH_KEYS}
+        self._codes["region"].update(region_codes)
+        # Profile rows; row 0 is the placeholder of free slots
+        self._profile_rows = {}
+        self._profile_list = [None]
+        self._profiles = None      # column arrays, rebuilt when a row is added
+        self._slots = {}   # user_id -> slot
+        self._free = []    # released slots below the high-water mark
+        self._used = 0     # high-water mark
+        self._epoch = time.monotonic()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.profile_of = np.zeros(capacity, dtype=np.int32)
+        # seconds since _epoch; float32 keeps the scoring pass in one dtype
+        self.since = np.zeros(capacity, dtype=np.float32)
+        self._score = np.zeros(capacity, dtype=np.float32)
+        self._wait = np.zeros(capacity, dtype=np.float32)
+
+    def _grow(self):
+        n = len(self.ids)
+        ids, profile_of, since = self.ids, self.profile_of, self.since
+        self._allocate(n * 2)
+        self.ids[:n] = ids
+        self.profile_of[:n] = profile_of
+        self.since[:n] = since
+
+    def _code(self, key, value, assign=True):
+        if not value:
+            return 0
+        codes = self._codes[key]
+        code = codes.get(value)
+        if code is None and assign and key != "region":
+            code = codes[value] = len(codes) + 1
+        return code
+
+    def _profile_row(self, user):
+        profile = tuple(self._code(key, user.get(key)) or 0 for key in MATCH_KEYS)
+        profile += (bool(user.get("is_premium")),)
+        row = self._profile_rows.get(profile)
+        if row is None:
+            row = self._profile_rows[profile] = len(self._profile_list)
+            self._profile_list.append(profile)
+            self._profiles = None
+        return row
+
+    def _profile_columns(self):
+        if self._profiles is None:
+            rows = np.array([(0,) * (len(MATCH_KEYS) + 1)] + self._profile_list[1:], dtype=np.int32)
+            self._profiles = {key: rows[:, i] for i, key in enumerate(MATCH_KEYS)}
+            self._profiles["premium"] = rows[:, len(MATCH_KEYS)].astype(bool)
+        return self._profiles
+
+    # ── membership ────────────────────────────────────────────────────
+    def add(self, user_id, user, since=None):
+        slot = self._slots.get(user_id)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                if self._used == len(self.ids):
+                    self._grow()
+                slot = self._used
+                self._used += 1
+            self._slots[user_id] = slot
+        self.ids[slot] = user_id
+        self.profile_of[slot] = self._profile_row(user)
+        self.since[slot] = (since or time.monotonic()) - self._epoch
+
+    def remove(self, user_id):
+        slot = self._slots.pop(user_id, None)
+        if slot is None:
+            return False
+        self.profile_of[slot] = 0
+        self._free.append(slot)
+        return True
+
+    def __contains__(self, user_id):
+        return user_id in self._slots
+
+    def __len__(self):
+        return len(self._slots)
+
+    def profile(self, user_id):
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return None
+        codes = self._profile_list[int(self.profile_of[slot])]
+        profile = {}
+        for key, code in zip(MATCH_KEYS, codes):
+            profile[key] = next((v for v, c in self._codes[key].items() if c == code), "")
+        profile["is_premium"] = codes[len(MATCH_KEYS)]
+        return profile
+
+    def waiting_since(self, user_id):
+        slot = self._slots.get(user_id)
+        return float(self.since[slot]) + self._epoch if slot is not None else None
+
+    # ── search ────────────────────────────────────────────────────────
+    def _profile_scores(self, filters, seeker):
+        """Static score of every profile row, -inf where the filters fail"""
+        w = self.weights
+        columns = self._profile_columns()
+        scores = columns["premium"] * np.float32(w["premium"])
+        if seeker:
+            region = self._code("region", seeker.get("region"), assign=False)
+            if region:
+                scores += self._affinity[region].take(columns["region"]) * w["region"]
+            for key in ("country", "language"):
+                code = self._code(key, seeker.get(key), assign=False)
+                if code:
+                    scores += (columns[key] == code) * np.float32(w[key])
+        for key, value in (filters or {}).items():
+            if key in columns and value:
+                scores[columns[key] != (self._code(key, value, assign=False) or -1)] = -np.inf
+        scores[0] = -np.inf
+        return scores.astype(np.float32)
+
+    def find(self, filters=None, exclude=(), seeker=None):
+        """Best-scoring waiting user passing `filters`, or None"""
+        if not self._slots:
+            return None
+        n = self._used
+        w = self.weights
+        score, wait = self._score[:n], self._wait[:n]
+        self._profile_scores(filters, seeker).take(self.profile_of[:n], out=score)
+        np.subtract(time.monotonic() - self._epoch, self.since[:n], out=wait)
+        np.multiply(wait, w["wait"] / WAIT_NORM_SECONDS, out=wait)
+        np.minimum(wait, w["wait"], out=wait)
+        np.add(score, wait, out=score)
+        for user_id in exclude:
+            slot = self._slots.get(user_id)
+            if slot is not None:
+                score[slot] = -np.inf
+        best = int(np.argmax(score))
+        if score[best] == -np.inf:
+            return None
+        return int(self.ids[best])
+
+    def stats(self):
+        return {
+            "waiting": len(self._slots),
+            "capacity": len(self.ids),
+            "profiles": len(self._profile_list) - 1,
+            "weights": self.weights,
+        }
+
+
+class ScoringPool(MemoryPool):
+    """MemoryPool whose waiting users are scored; premium requests are unchanged"""
+
+    backend = "scoring"
+
+    def __init__(self, weights=None):
+        super().__init__(MatchIndex())
+        self.scores = ScoringIndex(weights=weights)
+
+    async def add(self, user_id, user):
+        self.scores.add(user_id, user)
+
+    async def remove(self, user_id):
+        return self.scores.remove(user_id)
+
+    async def contains(self, user_id):
+        return user_id in self.scores
+
+    async def claim(self, filters=None, exclude=(), seeker=None):
+        user_id = self.scores.find(filters, exclude, seeker)
+        if user_id is None:
+            return None
+        entry = _entry(user_id, self.scores.profile(user_id), self.scores.waiting_since(user_id))
+        self.scores.remove(user_id)
+        return entry
+
+    async def restore(self, entry):
+        self.scores.add(entry["user_id"], entry, since=entry.get("added_at"))
+
+    async def stats(self):
+        return dict(self.index.stats(), **self.scores.stats(), backend=self.backend)
@@ -0,0 +1,186 @@
+"""
+Message screening.
+
+A Screen runs an ordered list of rules over an incoming message and
+returns a Verdict. The text is prepared once, before any rule runs, in
+two forms:
+
+  • verdict.cleaned (clean()): zero-width and other invisible characters
+    removed, casefolded. The link rule reads this one.
+  • verdict.normalized (normalize()): for the blocked-word check. On top
+    of clean(), Latin, Cyrillic and Greek letters are NFKD-folded
+    (fullwidth and styled letters like ｃｏｍ, 𝐜𝐨𝐦 read as plain ones),
+    lose their combining marks (é, İ) and have HOMOGLYPHS folded
+    (Cyrillic and Greek lookalikes read as Latin), and a 0 next to a
+    Latin letter reads as o. Every other script, and the marks on its
+    letters (Devanagari vowel signs, Arabic harakat), is left as it is.
+
+Plain ASCII text, most messages, skips the Unicode steps.
+
+Rules are registered with the @screen.rule(name) decorator and called as
+rule(verdict, update, context), sync or async, in registration order. A
+rule that returns something truthy stops the screen: verdict.rule is its
+name and verdict.detail what it returned. An async rule that takes longer
+than the screen's timeout is skipped (fail-open, counted in stats).
+
+Every rule's run time goes into a latency histogram and verdict.timings,
+and a screen slower than SCREEN_SLOW_MS in total is logged.
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import re
+import time
+import unicodedata
+
+from mongo_monitor import Histogram, LATENCY_BUCKETS_MS
+
+logger = logging.getLogger(__name__)
+
+SCREEN_SLOW_MS = float(os.getenv("SCREEN_SLOW_MS", "250"))
+SCREEN_RULE_TIMEOUT_SECONDS = float(os.getenv("SCREEN_RULE_TIMEOUT_SECONDS", "5"))
+
+# Removed outright: zero-width space/joiners, word joiner, BOM, soft
+# hyphen, Mongolian vowel separator, bidi marks and embeddings
+INVISIBLE = dict.fromkeys(
+    [0x200B, 0x200C, 0x200D, 0x2060, 0xFEFF, 0x00AD, 0x180E,
+     0x200E, 0x200F, 0x202A, 0x202B, 0x202C, 0x202D, 0x202E,
+     0x2066, 0x2067, 0x2068, 0x2069],
+    None
+)
+
+HOMOGLYPHS = str.maketrans({
+    # Cyrillic
+    "а": "a", "в": "b", "е": "e", "ё": "e", "к": "k", "м": "m", "н": "h", "о": "o",
+    "р": "p", "с": "c", "т": "t", "у": "y", "х": "x", "і": "i", "ї": "i", "ј": "j",
+    "ѕ": "s", "ԁ": "d", "ԛ": "q", "ԝ": "w", "һ": "h", "ɡ": "g",
+    # Greek
+    "α": "a", "β": "b", "ε": "e", "η": "n", "ι": "i", "κ": "k", "ν": "v", "ο": "o",
+    "ρ": "p", "τ": "t", "υ": "u", "χ": "x", "ω": "w",
+})
+
+FOLD_SCRIPTS = ("LATIN", "CYRILLIC", "GREEK")
+
+# A digit zero standing in for the letter o ("s0x", "c0m")
+LETTER_ZERO = re.compile(r"(?<=[a-z])0|0(?=[a-z])")
+
+
+@functools.lru_cache(maxsize=4096)
+def _fold_letter(ch):
+    """ch folded to plain lowercase, or None when it is not a Latin, Cyrillic or Greek letter"""
+    base = "".join(c for c in unicodedata.normalize("NFKD", ch) if not unicodedata.combining(c))
+    if not base or not base[0].isalpha() or not unicodedata.name(base[0], "").startswith(FOLD_SCRIPTS):
+        return None
+    return base.casefold().translate(HOMOGLYPHS)
+
+
+def clean(text):
+    """Strip invisibles and casefold"""
+    if not text:
+        return ""
+    if not text.isascii():
+        text = text.translate(INVISIBLE)
+    return text.casefold()
+
+
+def normalize(text):
+    """clean(), then fold Latin, Cyrillic and Greek letters for word matching"""
+    text = clean(text)
+    if not text.isascii():
+        out = []
+        folding = False     # the last letter was folded, so drop its marks too
+        for ch in text:
+            if unicodedata.combining(ch):
+                if not folding:
+                    out.append(ch)
+                continue
+            folded = _fold_letter(ch)
+            folding = folded is not None
+            out.append(folded if folding else ch)
+        text = "".join(out)
+    return LETTER_ZERO.sub("o", text) if "0" in text else text
+
+
+class Verdict:
+    __slots__ = ("text", "cleaned", "normalized", "rule", "detail", "timings")
+
+    def __init__(self, text):
+        self.text = text
+        self.cleaned = clean(text)
+        self.normalized = normalize(text)
+        self.rule = None
+        self.detail = None
+        self.timings = {}   # rule name -> ms
+
+    @property
+    def allowed(self):
+        return self.rule is None
+
+    def __repr__(self):
+        return f"Verdict(rule={self.rule!r}, detail={self.detail!r})"
+
+
+class Screen:
+    def __init__(self, timeout=SCREEN_RULE_TIMEOUT_SECONDS, slow_ms=SCREEN_SLOW_MS):
+        self.timeout = timeout
+        self.slow_ms = slow_ms
+        self._rules = []
+        self.latency = {}                   # rule name -> Histogram
+        self.total = Histogram(LATENCY_BUCKETS_MS)
+        self.hits = {}                      # rule name -> messages it stopped
+        self.timeouts = {}                  # rule name -> times skipped
+        self.screened = 0
+
+    def rule(self, name):
+        """Decorator appending a rule to the screen"""
+        def register(fn):
+            self._rules.append((name, fn))
+            self.latency[name] = Histogram(LATENCY_BUCKETS_MS)
+            return fn
+        return register
+
+    async def run(self, update, context, text):
+        verdict = Verdict(text)
+        started = time.perf_counter()
+        for name, fn in self._rules:
+            t0 = time.perf_counter()
+            try:
+                result = fn(verdict, update, context)
+                if inspect.isawaitable(result):
+                    result = await asyncio.wait_for(result, self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts[name] = self.timeouts.get(name, 0) + 1
+                logger.warning(f"Screening rule {name} timed out after {self.timeout}s; skipped")
+                result = None
+            ms = (time.perf_counter() - t0) * 1000
+            verdict.timings[name] = ms
+            self.latency[name].record(ms)
+            if result:
+                verdict.rule = name
+                verdict.detail = result
+                self.hits[name] = self.hits.get(name, 0) + 1
+                break
+        total_ms = (time.perf_counter() - started) * 1000
+        self.total.record(total_ms)
+        self.screened += 1
+        if total_ms >= self.slow_ms:
+            steps = ", ".join(f"{name} {ms:.0f}ms" for name, ms in verdict.timings.items())
+            logger.warning(f"Slow screening: {total_ms:.0f}ms ({steps})")
+        return verdict
+
+    def snapshot(self):
+        return {
+            "screened": self.screened,
+            "total_ms": self.total.snapshot(),
+            "rules": {
+                name: {
+                    "ms": self.latency[name].snapshot(),
+                    "hits": self.hits.get(name, 0),
+                    "timeouts": self.timeouts.get(name, 0),
+                }
+                for name, _ in self._rules
+            },
+        }
@@ -0,0 +1,58 @@
+"""
+Search deadlines.
+
+Every open search (a user waiting in the pool, or a premium request) gets a
+deadline. Deadlines sit in a min-heap, so scheduling one and popping the
+earliest are O(log n) and the expiry job only looks at entries that are
+actually due.
+
+Rescheduling or cancelling does not touch the heap: the current deadline
+of each search is kept in a dict and heap entries that no longer match it
+are skipped when they surface. The heap is rebuilt from the dict when such
+stale entries outnumber the live ones.
+"""
+
+import heapq
+import time
+
+
+class SearchDeadlines:
+    def __init__(self):
+        self._heap = []        # (deadline, kind, user_id)
+        self._deadlines = {}   # (kind, user_id) -> deadline
+        self.expired = 0
+
+    def schedule(self, kind, user_id, ttl, start=None):
+        deadline = (start or time.monotonic()) + ttl
+        self._deadlines[(kind, user_id)] = deadline
+        heapq.heappush(self._heap, (deadline, kind, user_id))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+
+    def cancel(self, kind, user_id):
+        self._deadlines.pop((kind, user_id), None)
+
+    def deadline(self, kind, user_id):
+        return self._deadlines.get((kind, user_id))
+
+    def pop_expired(self, now=None):
+        """(kind, user_id) of every search whose deadline has passed"""
+        now = now or time.monotonic()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, kind, user_id = heapq.heappop(self._heap)
+            if self._deadlines.get((kind, user_id)) == deadline:
+                del self._deadlines[(kind, user_id)]
+                expired.append((kind, user_id))
+        self.expired += len(expired)
+        return expired
+
+    def _compact(self):
+        self._heap = [(deadline, kind, user_id) for (kind, user_id), deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def stats(self):
+        return {"pending": len(self._deadlines), "heap": len(self._heap), "expired": self.expired}
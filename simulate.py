@@ -0,0 +1,462 @@
+"""
+simulate.py - offline matchmaking simulation and benchmark.
+
+Drives the real matching code (find_command, do_search, next_command,
+end_command and bot.check_premium_queue_job) with synthetic users, on
+top of the in-memory MongoDB stand-in from memory_mongo.py and a stub bot.
+No MongoDB server or Telegram token is needed.
+
+Time is simulated. Searches arrive as a Poisson process; a user who
+searches is drawn from the users who are neither searching nor chatting.
+A share of them are premium, and premium users search with filters drawn
+from the --filter-* probabilities. Chats last an exponentially distributed
+time, after which one side sends /next (with probability --next) or /end.
+Searchers give up after --patience seconds. Events that fall in the same
+--tick run concurrently, as updates processed together would.
+
+Reported at the end:
+
+  • time to match (simulated seconds), p50/p95/p99, overall and per kind
+    of search (free, premium, premium with filters)
+  • matches per simulated second, and per wall-clock second of handler work
+  • MongoDB operations and Bot API calls per match
+  • handler latency (wall clock) per command
+  • queue depth (waiting pool, premium requests, open rooms) over time
+
+Usage:
+    python simulate.py [--users 5000] [--duration 3600] [--arrival 5]
+                       [--premium 0.1] [--next 0.5] [--chat 120] ...
+
+Run with --help for every knob. POOL_BACKEND selects the pool under test
+(memory, mongo or scoring). The search expiry job and the scoring backend's
+wait term use the real clock, so during a simulated run they barely act.
+"""
+
+import argparse
+import asyncio
+import heapq
+import logging
+import os
+import random
+import sys
+import time
+from contextvars import ContextVar
+from types import SimpleNamespace
+
+from stress_match import StubBot, StubMessage
+
+COUNTRIES = {
+    "Asia": ["Indonesia", "India", "Malaysia"],
+    "Europe": ["Germany", "France", "Turkey"],
+    "Africa": ["Nigeria", "Egypt", "Kenya"],
+    "North America": ["United States", "Mexico", "Canada"],
+    "South America": ["Brazil", "Argentina", "Colombia"],
+    "Oceania": ["Australia", "New Zealand"],
+    "Antarctica": ["Antarctica"],
+}
+
+_now = ContextVar("simulated_time", default=0.0)
+
+
+def weights(spec):
+    """'a:0.6,b:0.4' -> (['a', 'b'], [0.6, 0.4])"""
+    values, probs = [], []
+    for part in spec.split(","):
+        value, _, prob = part.rpartition(":")
+        values.append(value.strip())
+        probs.append(float(prob))
+    return values, probs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000, help="user population")
+    parser.add_argument("--duration", type=float, default=3600, help="simulated seconds")
+    parser.add_argument("--arrival", type=float, default=5.0, help="new searches per simulated second")
+    parser.add_argument("--premium", type=float, default=0.1, help="share of premium users")
+    parser.add_argument("--filtered", type=float, default=0.8,
+                        help="share of premium searches that use filters (do_search)")
+    parser.add_argument("--filter-gender", type=float, default=0.7, help="P(filtered search sets gender)")
+    parser.add_argument("--filter-region", type=float, default=0.3, help="P(filtered search sets region)")
+    parser.add_argument("--filter-language", type=float, default=0.2, help="P(filtered search sets language)")
+    parser.add_argument("--genders", default="male:0.65,female:0.35")
+    parser.add_argument("--regions", default="Asia:0.6,Europe:0.15,Africa:0.1,North America:0.1,South America:0.05")
+    parser.add_argument("--languages", default="id:0.5,en:0.3,hi:0.1,ar:0.1")
+    parser.add_argument("--next", type=float, default=0.5,
+                        help="probability that the side ending a chat sends /next instead of /end")
+    parser.add_argument("--chat", type=float, default=120, help="mean chat length, simulated seconds")
+    parser.add_argument("--patience", type=float, default=300, help="seconds a searcher waits before giving up")
+    parser.add_argument("--sweep", type=float, default=300, help="premium queue sweep interval")
+    parser.add_argument("--tick", type=float, default=1.0, help="events within one tick run concurrently")
+    parser.add_argument("--sample", type=float, default=300, help="queue depth sampling interval")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated MongoDB round-trip time")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(len(values) * pct / 100 + 0.5) - 1))]
+
+
+class IdleUsers:
+    """Set of user ids with O(1) add, remove and random pick"""
+
+    def __init__(self, user_ids=()):
+        self._ids = list(user_ids)
+        self._pos = {uid: i for i, uid in enumerate(self._ids)}
+
+    def add(self, uid):
+        if uid not in self._pos:
+            self._pos[uid] = len(self._ids)
+            self._ids.append(uid)
+
+    def discard(self, uid):
+        i = self._pos.pop(uid, None)
+        if i is None:
+            return
+        last = self._ids.pop()
+        if i < len(self._ids):
+            self._ids[i] = last
+            self._pos[last] = i
+
+    def pick(self, rnd):
+        return self._ids[rnd.randrange(len(self._ids))] if self._ids else None
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class StubQuery:
+    """The callback_query do_search reads: answer, edits, the originating message"""
+
+    def __init__(self, user_id, data=""):
+        self.from_user = SimpleNamespace(id=user_id, language_code="en")
+        self.data = data
+        self.message = StubMessage(user_id)
+        self.message.message_id = 1
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+    async def edit_message_text(self, text, **kwargs):
+        return SimpleNamespace(message_id=1, chat_id=self.message.chat_id)
+
+
+def command_update(user_id):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id, language_code="en"),
+        effective_chat=SimpleNamespace(id=user_id),
+        callback_query=None,
+        message=StubMessage(user_id),
+    )
+
+
+def callback_update(user_id, data):
+    query = StubQuery(user_id, data)
+    return SimpleNamespace(
+        effective_user=query.from_user,
+        effective_chat=SimpleNamespace(id=user_id),
+        callback_query=query,
+        message=None,
+    )
+
+
+class Simulation:
+    def __init__(self, args, modules, memory):
+        self.args = args
+        self.m = modules
+        self.memory = memory
+        self.rnd = random.Random(args.seed)
+        self.bot = StubBot()
+        self.bot_data = {"ADMIN_ID": 0, "ADMIN_GROUP_ID": -100}
+        self.user_data = {}
+        self.events = []
+        self.seq = 0
+        self.premium = set()
+        self.idle = IdleUsers()
+        self.searching = {}     # user_id -> (started, kind, search number)
+        self.search_no = 0
+        self.waits = {"free": [], "premium": [], "filtered": []}
+        self.searches = {"free": 0, "premium": 0, "filtered": 0}
+        self.abandoned = {"free": 0, "premium": 0, "filtered": 0}
+        self.unsought = 0       # matches of users who were not searching
+        self.matches = 0
+        self.latency = {}       # command -> [wall ms]
+        self.samples = []
+
+    # ── setup ─────────────────────────────────────────────────────────
+    async def seed_users(self):
+        from models import default_user
+        a = self.args
+        genders, regions, languages = weights(a.genders), weights(a.regions), weights(a.languages)
+        docs = []
+        for uid in range(1, a.users + 1):
+            region = self.rnd.choices(*regions)[0]
+            doc = default_user(SimpleNamespace(id=uid, username=f"sim{uid}", full_name=f"Sim {uid}"),
+                               language=self.rnd.choices(*languages)[0])
+            doc.update(gender=self.rnd.choices(*genders)[0], region=region,
+                       country=self.rnd.choice(COUNTRIES.get(region, [region])))
+            if self.rnd.random() < a.premium:
+                doc["is_premium"] = True
+                doc["matching_preferences"] = self.draw_filters(doc, genders, regions, languages)
+                self.premium.add(uid)
+            docs.append(doc)
+            self.idle.add(uid)
+        await self.m.db.db.users.insert_many(docs)
+
+    def draw_filters(self, doc, genders, regions, languages):
+        a = self.args
+        filters = {}
+        if self.rnd.random() < a.filter_gender:
+            others = [g for g in genders[0] if g != doc["gender"]]
+            filters["gender"] = others[0] if others else doc["gender"]
+        if self.rnd.random() < a.filter_region:
+            filters["region"] = self.rnd.choices(*regions)[0]
+        if self.rnd.random() < a.filter_language:
+            filters["language"] = self.rnd.choices(*languages)[0]
+        return filters
+
+    def context(self, uid=None):
+        user_data = self.user_data.setdefault(uid, {}) if uid is not None else {}
+        return SimpleNamespace(bot=self.bot, bot_data=self.bot_data, user_data=user_data)
+
+    # ── events ────────────────────────────────────────────────────────
+    def schedule(self, at, kind, uid=None, payload=None):
+        self.seq += 1
+        heapq.heappush(self.events, (at, self.seq, kind, uid, payload))
+
+    def on_room(self, room_id, user1, user2):
+        """create_room succeeded at the current simulated time"""
+        now = _now.get()
+        self.matches += 1
+        for uid in (user1, user2):
+            self.idle.discard(uid)
+            search = self.searching.pop(uid, None)
+            if search:
+                self.waits[search[1]].append(now - search[0])
+            else:
+                self.unsought += 1
+        ender = self.rnd.choice((user1, user2))
+        self.schedule(now + self.rnd.expovariate(1 / self.args.chat), "chat_over", ender, room_id)
+
+    def start_search(self, uid, now, kind):
+        self.idle.discard(uid)
+        self.search_no += 1
+        self.searching[uid] = (now, kind, self.search_no)
+        self.searches[kind] += 1
+        self.schedule(now + self.args.patience, "give_up", uid, self.search_no)
+
+    def settle(self, uid):
+        """After a handler: a user neither searching nor chatting is idle again"""
+        if uid in self.searching or self.m.db.get_user_route(uid):
+            return
+        self.idle.add(uid)
+
+    async def timed(self, command, coro):
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.latency.setdefault(command, []).append((time.perf_counter() - started) * 1000)
+
+    async def arrive(self, now):
+        uid = self.idle.pick(self.rnd)
+        if uid is None:
+            return
+        match = self.m.match
+        if uid in self.premium and self.rnd.random() < self.args.filtered:
+            self.start_search(uid, now, "filtered")
+            await self.timed("do_search", match.do_search(callback_update(uid, "do_search"), self.context(uid)))
+        else:
+            self.start_search(uid, now, "premium" if uid in self.premium else "free")
+            await self.timed("find", match.find_command(command_update(uid), self.context(uid)))
+        self.settle(uid)
+
+    async def chat_over(self, now, uid, room_id):
+        route = self.m.db.get_user_route(uid)
+        if not route or route[0] != room_id:
+            return
+        partner = route[1]
+        if self.rnd.random() < self.args.next:
+            self.start_search(uid, now, "premium" if uid in self.premium else "free")
+            await self.timed("next", self.m.match.next_command(command_update(uid), self.context(uid)))
+        else:
+            await self.timed("end", self.m.match.end_command(command_update(uid), self.context(uid)))
+        self.settle(uid)
+        self.settle(partner)
+
+    async def give_up(self, uid, search_no):
+        search = self.searching.get(uid)
+        if not search or search[2] != search_no:
+            return
+        del self.searching[uid]
+        self.abandoned[search[1]] += 1
+        await self.timed("give_up", self.m.match.end_command(command_update(uid), self.context(uid)))
+        self.settle(uid)
+
+    async def sweep(self):
+        await self.timed("premium_sweep", self.m.bot.check_premium_queue_job(self.context()))
+        for uid in list(self.searching):
+            self.settle(uid)
+
+    async def sample(self, now):
+        stats = await self.m.rooms.waiting_pool.stats()
+        self.samples.append((
+            now,
+            stats.get("waiting", 0),
+            stats.get("premium_requests", 0),
+            len(self.searching),
+            len(self.m.db._routes) // 2,
+        ))
+
+    async def run_event(self, at, kind, uid, payload):
+        _now.set(at)
+        if kind == "arrive":
+            await self.arrive(at)
+        elif kind == "chat_over":
+            await self.chat_over(at, uid, payload)
+        elif kind == "give_up":
+            await self.give_up(uid, payload)
+        elif kind == "sweep":
+            await self.sweep()
+        elif kind == "sample":
+            await self.sample(at)
+
+    async def run(self):
+        a = self.args
+        t = 0.0
+        while True:
+            t += self.rnd.expovariate(a.arrival)
+            if t >= a.duration:
+                break
+            self.schedule(t, "arrive")
+        for t in range_of(a.sweep, a.sweep, a.duration):
+            self.schedule(t, "sweep")
+        for t in range_of(0, a.sample, a.duration + a.sample):
+            self.schedule(min(t, a.duration), "sample")
+
+        started = time.perf_counter()
+        window = 0.0
+        while self.events and self.events[0][0] <= a.duration:
+            window += a.tick
+            batch = []
+            while self.events and self.events[0][0] < window:
+                at, _, kind, uid, payload = heapq.heappop(self.events)
+                batch.append(self.run_event(at, kind, uid, payload))
+            if batch:
+                results = await asyncio.gather(*batch, return_exceptions=True)
+                for r in results:
+                    if isinstance(r, Exception):
+                        logging.getLogger(__name__).error(f"Event failed: {type(r).__name__}: {r}")
+        return time.perf_counter() - started
+
+
+def range_of(start, step, stop):
+    t = start
+    while t < stop:
+        yield t
+        t += step
+
+
+def report(sim, elapsed, ops, api_calls):
+    a = sim.args
+    total_searches = sum(sim.searches.values())
+    total_abandoned = sum(sim.abandoned.values())
+    print(f"Simulated {a.duration:.0f}s with {a.users} users (pool: {sim.m.rooms.POOL_BACKEND}): "
+          f"{total_searches} searches, {sim.matches} matches, {total_abandoned} abandoned")
+
+    print("\nTime to match (simulated seconds)")
+    print(f"  {'search':<10} {'searches':>9} {'matched':>8} {'gave up':>8} {'p50':>7} {'p95':>7} {'p99':>7}")
+    rows = [(kind, sim.waits[kind], sim.searches[kind], sim.abandoned[kind]) for kind in sim.waits]
+    rows.append(("all", [w for waits in sim.waits.values() for w in waits], total_searches, total_abandoned))
+    for kind, waits, searches, abandoned in rows:
+        waits = sorted(waits)
+        print(f"  {kind:<10} {searches:>9} {len(waits):>8} {abandoned:>8} "
+              f"{percentile(waits, 50):>7.1f} {percentile(waits, 95):>7.1f} {percentile(waits, 99):>7.1f}")
+    if sim.unsought:
+        print(f"  ({sim.unsought} matched while not searching: freed partners paired with premium requests)")
+
+    matches = max(sim.matches, 1)
+    print(f"\nThroughput: {sim.matches / a.duration:.2f} matches per simulated second, "
+          f"{sim.matches / elapsed:.0f} per wall-clock second ({elapsed:.2f}s of handler work)")
+    total_ops = sum(ops.values())
+    print(f"MongoDB operations per match: {total_ops / matches:.1f}")
+    for name, count in ops.most_common(8):
+        print(f"  {name:<34} {count / matches:>6.2f}")
+    print(f"Bot API calls per match: {sum(api_calls.values()) / matches:.1f}")
+
+    print("\nHandler latency (wall-clock ms)")
+    print(f"  {'command':<14} {'calls':>7} {'p50':>7} {'p95':>7} {'p99':>7}")
+    for command, values in sorted(sim.latency.items()):
+        values.sort()
+        print(f"  {command:<14} {len(values):>7} {percentile(values, 50):>7.2f} "
+              f"{percentile(values, 95):>7.2f} {percentile(values, 99):>7.2f}")
+
+    print("\nQueue depth")
+    print(f"  {'time':>7} {'pool':>6} {'premium':>8} {'searching':>10} {'rooms':>6}")
+    for now, waiting, premium, searching, rooms in sim.samples:
+        print(f"  {now:>7.0f} {waiting:>6} {premium:>8} {searching:>10} {rooms:>6}")
+
+
+async def run(args):
+    import db as db_module
+    import rooms as rooms_module
+    import bot as bot_module
+    from handlers import match as match_module
+    from memory_mongo import MemoryDatabase
+
+    # Point every module that holds the motor database at the in-memory one
+    memory = MemoryDatabase(latency=args.latency_ms / 1000)
+    real_db = db_module.db
+    for module in list(sys.modules.values()):
+        if getattr(module, "db", None) is real_db:
+            module.db = memory
+    db_module.room_activity.collection = memory.rooms
+    db_module.chat_log_writer.collection = memory.chatlogs
+    pool = rooms_module.waiting_pool
+    if hasattr(pool, "requests_collection"):
+        pool.collection, pool.requests_collection = memory.waiting_pool, memory.premium_queue
+
+    modules = SimpleNamespace(db=db_module, rooms=rooms_module, bot=bot_module, match=match_module)
+    sim = Simulation(args, modules, memory)
+
+    # Every room the handlers open goes through create_room; note its time
+    create_room = match_module.create_room
+
+    async def recording_create_room(user1, user2):
+        room_id = await create_room(user1, user2)
+        if room_id:
+            sim.on_room(room_id, user1, user2)
+        return room_id
+
+    match_module.create_room = recording_create_room
+
+    await db_module.create_indexes()
+    await sim.seed_users()
+    ops_before = memory.ops.copy()
+
+    elapsed = await sim.run()
+
+    ops = memory.ops.copy()
+    ops.subtract(ops_before)
+    report(sim, elapsed, +ops, sim.bot.calls)
+    await db_module.chat_log_writer.stop()
+    return 0
+
+
+def main():
+    args = parse_args()
+    # bot.py reads these at import time; nothing connects to them
+    os.environ.setdefault("BOT_TOKEN", "simulate")
+    os.environ.setdefault("ADMIN_ID", "0")
+    os.environ.setdefault("ADMIN_GROUP_ID", "0")
+    os.environ["REQUIRED_CHANNEL"] = ""
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+stress_match.py - concurrent /find and /next against a LOCAL mongod.
+
+Seeds a scratch database with users that have complete profiles, then
+runs the real find_command / next_command handlers for all of them at
+once, round after round, with a stub bot and stub updates. Everything
+shares one event loop, so handlers interleave at every MongoDB await the
+same way concurrent update processing would interleave them.
+
+After the run it checks that matching never double-booked anyone:
+
+  • no user appears in more than one room
+  • every user_rooms mapping points at an existing room that holds the
+    user and names the other member as partner
+  • every room has both of its users mapped to it
+  • nobody is in a room and in the waiting pool at the same time
+  • the in-process routing table agrees with user_rooms
+  • everyone who sent /find or /next in the last round is either in a
+    room or waiting in the pool (a lost pairing race must not strand a
+    claimed partner outside both)
+
+and, after every round, that matching made progress:
+
+  • no two searchers who could be paired with each other are both still
+    waiting in the pool
+  • a round with at least MIN_SEARCHERS searchers opened a room
+
+Exits 1 if any check fails.
+
+Usage:
+    python stress_match.py [--uri mongodb://localhost:27017]
+                           [--db anonindochat_stress]
+                           [--users 500] [--rounds 10] [--next 0.5]
+
+The scratch database is dropped before and after the run. Set
+POOL_BACKEND to stress the mongo or scoring pool instead of the default.
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+# A round with this many searchers that opens no room has stalled
+MIN_SEARCHERS = 10
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="anonindochat_stress")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--next", type=float, default=0.5,
+                        help="probability that a matched user sends /next in the following round")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+class StubBot:
+    """Accepts every Bot API call the handlers make and counts them"""
+
+    def __init__(self):
+        self.calls = {}
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if name == "get_chat":
+                raise RuntimeError("stub bot has no chats")
+            return SimpleNamespace(message_id=1)
+        return call
+
+
+class StubMessage:
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+
+    async def reply_text(self, text, **kwargs):
+        return SimpleNamespace(message_id=1, chat_id=self.chat_id)
+
+
+def make_update(user_id):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id, language_code="en"),
+        effective_chat=SimpleNamespace(id=user_id),
+        callback_query=None,
+        message=StubMessage(user_id),
+    )
+
+
+async def seed(db_module, n_users, rnd):
+    from models import default_user
+    docs = []
+    for uid in range(1, n_users + 1):
+        doc = default_user(SimpleNamespace(id=uid, username=f"stress{uid}", full_name=f"Stress {uid}"))
+        doc.update(
+            gender=rnd.choice(["male", "female"]),
+            region=rnd.choice(["Asia", "Europe", "Africa"]),
+            country=rnd.choice(["Indonesia", "India", "Brazil"]),
+        )
+        docs.append(doc)
+    await db_module.db.users.insert_many(docs)
+
+
+async def check_invariants(db_module, rooms_module, searching=()):
+    db = db_module.db
+    problems = []
+
+    rooms = {}
+    seats = {}
+    async for room in db.rooms.find({}, {"_id": 0, "room_id": 1, "users": 1}):
+        rooms[room["room_id"]] = room["users"]
+        for uid in room["users"]:
+            seats.setdefault(uid, []).append(room["room_id"])
+    for uid, room_ids in seats.items():
+        if len(room_ids) > 1:
+            problems.append(f"user {uid} is in {len(room_ids)} rooms: {room_ids}")
+
+    mapped = {}
+    async for m in db.user_rooms.find({}, {"_id": 0}):
+        uid, room_id = m["user_id"], m.get("room_id")
+        mapped[uid] = room_id
+        users = rooms.get(room_id)
+        if users is None:
+            problems.append(f"user {uid} mapped to missing room {room_id}")
+        elif uid not in users:
+            problems.append(f"user {uid} mapped to room {room_id} of {users}")
+        elif m.get("partner_id") not in users or m.get("partner_id") == uid:
+            problems.append(f"user {uid} in room {room_id} has partner {m.get('partner_id')}")
+    for room_id, users in rooms.items():
+        for uid in users:
+            if mapped.get(uid) != room_id:
+                problems.append(f"room {room_id} member {uid} is mapped to {mapped.get(uid)}")
+
+    for uid in mapped:
+        if await rooms_module.is_in_pool(uid):
+            problems.append(f"user {uid} is in a room and in the waiting pool")
+        route = db_module.get_user_route(uid)
+        if not route or route[0] != mapped[uid]:
+            problems.append(f"route of {uid} is {route}, user_rooms says {mapped[uid]}")
+
+    for uid in searching:
+        if uid not in mapped and not await rooms_module.is_in_pool(uid):
+            problems.append(f"user {uid} is searching but in neither the pool nor a room")
+
+    return problems, len(rooms)
+
+
+async def check_progress(db_module, rooms_module, round_no, searching, opened):
+    """A round stalled if two searchers who could pair are both still waiting, or nobody was paired"""
+    problems = []
+    waiting = sorted([
+        uid for uid in searching
+        if not db_module.get_user_route(uid) and await rooms_module.is_in_pool(uid)
+    ])
+    # The stress run searches without filters, so only recent partners are excluded
+    exclusions = {uid: rooms_module.recent_partners.exclusions(uid) for uid in waiting}
+    for a, b in itertools.combinations(waiting, 2):
+        if b not in exclusions[a] and a not in exclusions[b]:
+            problems.append(f"round {round_no}: users {a} and {b} could be paired but are both waiting")
+    if len(searching) >= MIN_SEARCHERS and not opened:
+        problems.append(f"round {round_no}: {len(searching)} users searched and no room was opened")
+    return problems
+
+
+async def run(args):
+    import db as db_module
+    import rooms as rooms_module
+    from handlers.match import find_command, next_command
+
+    rnd = random.Random(args.seed)
+    await db_module.client.drop_database(args.db)
+    await db_module.test_connection()
+    await db_module.create_indexes()
+    await seed(db_module, args.users, rnd)
+
+    context_for = {}
+    bot = StubBot()
+
+    def context(uid):
+        if uid not in context_for:
+            context_for[uid] = SimpleNamespace(bot=bot, bot_data={}, user_data={})
+        return context_for[uid]
+
+    users = list(range(1, args.users + 1))
+    started = time.perf_counter()
+    searching = set()
+    stalls = []
+    for round_no in range(1, args.rounds + 1):
+        tasks = []
+        searching = set()
+        rooms_before = {route[0] for uid in users if (route := db_module.get_user_route(uid))}
+        for uid in users:
+            if db_module.get_user_route(uid):
+                if rnd.random() < args.next:
+                    tasks.append(next_command(make_update(uid), context(uid)))
+                    searching.add(uid)
+            else:
+                tasks.append(find_command(make_update(uid), context(uid)))
+                searching.add(uid)
+        rnd.shuffle(tasks)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        in_rooms = sum(1 for uid in users if db_module.get_user_route(uid))
+        rooms_after = {route[0] for uid in users if (route := db_module.get_user_route(uid))}
+        opened = len(rooms_after - rooms_before)
+        print(f"round {round_no:>3}: {len(tasks):>5} commands, {opened:>5} rooms opened, "
+              f"{in_rooms:>5} users in rooms, {len(errors)} handler errors")
+        for e in errors[:3]:
+            print(f"    {type(e).__name__}: {e}")
+        stalls += await check_progress(db_module, rooms_module, round_no, searching, opened)
+    elapsed = time.perf_counter() - started
+
+    problems, n_rooms = await check_invariants(db_module, rooms_module, searching)
+    problems = stalls + problems
+    print(f"\n{n_rooms} rooms open after {args.rounds} rounds in {elapsed:.1f}s "
+          f"({bot.calls.get('send_message', 0)} messages sent to users)")
+    if problems:
+        print(f"{len(problems)} invariant violations:")
+        for p in problems[:50]:
+            print(f"  {p}")
+    else:
+        print("No double-booked users, all mappings consistent.")
+
+    await db_module.chat_log_writer.stop()
+    await db_module.client.drop_database(args.db)
+    return 1 if problems else 0
+
+
+def main():
+    args = parse_args()
+    # The handlers import bot.py, which reads these at import time
+    os.environ["MONGODB_URI"] = args.uri
+    os.environ["MONGODB_DB"] = args.db
+    os.environ.setdefault("BOT_TOKEN", "stress")
+    os.environ.setdefault("ADMIN_ID", "0")
+    os.environ.setdefault("ADMIN_GROUP_ID", "0")
+    os.environ.setdefault("REQUIRED_CHANNEL", "")
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
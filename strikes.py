@@ -0,0 +1,131 @@
+"""
+Sliding-window strike counting.
+
+A StrikeTracker counts a user's violations of one kind (e.g. "link") over
+the last `window` seconds. Each user's recent strike times sit in a deque
+capped at `keep`; entries older than the window are dropped from the left
+whenever the user is looked at, so a count is O(1) amortized and strikes
+decay on their own instead of adding up forever.
+
+Users are held for at most max_users (least recently used are dropped).
+New strikes are queued and flush() appends them to the user's document in
+the strikes collection with one bulk write ($push with $slice, so other
+replicas' strikes are extended, not overwritten), from a periodic job and
+at shutdown. A user who is not in memory is loaded from that document on
+their next strike, so counts survive restarts. A TTL index on expire_at
+removes documents once their last strike has left the window.
+"""
+
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+class StrikeTracker:
+    def __init__(self, collection, kind, window, keep=10, max_users=50000):
+        self.collection = collection
+        self.kind = kind
+        self.window = window
+        self.keep = keep
+        self.max_users = max_users
+        self._users = OrderedDict()   # user_id -> deque of strike times
+        self._pending = {}            # user_id -> strike times not yet saved
+        self.strikes = 0
+        self.loads = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _prune(self, times, now):
+        cutoff = now - self.window
+        while times and times[0] <= cutoff:
+            times.popleft()
+
+    def _remember(self, user_id, times):
+        self._users[user_id] = times
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+            self.evictions += 1
+
+    async def _load(self, user_id):
+        doc = await self.collection.find_one(
+            {"kind": self.kind, "user_id": user_id}, {"_id": 0, "strikes": 1}
+        )
+        self.loads += 1
+        times = self._users.get(user_id)
+        if times is None:
+            # Strikes queued but not flushed yet are newer than the stored ones
+            stored = (doc or {}).get("strikes", []) + self._pending.get(user_id, [])
+            times = deque(sorted(stored)[-self.keep:], maxlen=self.keep)
+            self._remember(user_id, times)
+        return times
+
+    async def add(self, user_id, now=None):
+        """Record a strike; returns the user's strikes within the window"""
+        now = now or time.time()
+        times = self._users.get(user_id)
+        if times is None:
+            times = await self._load(user_id)
+        else:
+            self._users.move_to_end(user_id)
+        times.append(now)
+        self._prune(times, now)
+        pending = self._pending.setdefault(user_id, [])
+        pending.append(now)
+        if len(pending) > self.keep:
+            del pending[0]
+        self.strikes += 1
+        return len(times)
+
+    def count(self, user_id, now=None):
+        """Strikes within the window, from memory only"""
+        times = self._users.get(user_id)
+        if times is None:
+            return 0
+        self._prune(times, now or time.time())
+        return len(times)
+
+    async def flush(self):
+        """Append queued strikes to the stored histories; returns users written"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        expire_at = datetime.utcnow() + timedelta(seconds=self.window)
+        ops = [
+            UpdateOne(
+                {"kind": self.kind, "user_id": user_id},
+                {
+                    "$push": {"strikes": {"$each": times, "$slice": -self.keep}},
+                    "$max": {"expire_at": expire_at},
+                },
+                upsert=True
+            )
+            for user_id, times in pending.items()
+        ]
+        try:
+            await self.collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"{self.kind} strikes flush of {len(ops)} users failed: {e}")
+            for user_id, times in pending.items():
+                merged = times + self._pending.get(user_id, [])
+                self._pending[user_id] = merged[-self.keep:]
+            return 0
+        return len(ops)
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "window": self.window,
+            "users": len(self._users),
+            "pending": len(self._pending),
+            "strikes": self.strikes,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
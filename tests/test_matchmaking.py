@@ -0,0 +1,57 @@
+import random
+from datetime import datetime, timedelta
+
+from matchmaking import MATCH_KEYS, MatchIndex, bucket_key
+
+
+def test_restored_request_keeps_its_place_in_the_queue():
+    index = MatchIndex()
+    start = datetime(2026, 1, 1)
+    index.add_request(1, {"region": "Asia"}, start)
+    index.add_request(2, {}, start + timedelta(seconds=1))
+    index.add_request(3, {}, start + timedelta(seconds=2))
+
+    request = index.request(1)
+    index.remove_request(1)
+    index.add_request(request["user_id"], request["filters"], request["added_at"])
+
+    assert index.requests() == [(1, {"region": "Asia"}), (2, {}), (3, {})]
+
+
+def test_find_matches_a_scan_of_every_bucket():
+    rnd = random.Random(3)
+    values = {
+        "gender": ["male", "female", ""],
+        "region": ["Asia", "Europe", "Africa"],
+        "language": ["en", "hi", "id", ""],
+        "country": ["India", "Indonesia", "Brazil"],
+    }
+    index = MatchIndex()
+    for user_id in range(300):
+        index.add(user_id, {key: rnd.choice(choices) for key, choices in values.items()}, since=user_id + 1)
+    for user_id in rnd.sample(range(300), 150):
+        index.remove(user_id)
+
+    for _ in range(200):
+        filters = {key: rnd.choice(choices + [None]) for key, choices in values.items()}
+        exclude = set(rnd.sample(range(300), 50))
+        wanted = tuple(filters[key] or None for key in MATCH_KEYS)
+        expected = min(
+            (user_id for user_id in index
+             if user_id not in exclude and all(w is None or w == v for v, w in zip(bucket_key(index.profile(user_id)), wanted))),
+            default=None,
+        )
+        assert index.find(filters, exclude) == expected
+
+
+def test_restored_user_keeps_their_place_in_the_bucket():
+    index = MatchIndex()
+    profile = {"gender": "male", "region": "Asia", "language": "en", "country": "India"}
+    for user_id in (1, 2, 3):
+        index.add(user_id, profile, since=float(user_id))
+
+    index.remove(1)
+    index.add(1, profile, since=1.0)
+
+    assert index.find() == 1
+    assert index.find(exclude={1}) == 2
@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import rooms
+from matchmaking import MemoryPool, MongoPool
+from memory_mongo import MemoryDatabase
+from search_expiry import SearchDeadlines
+
+
+def _pool(backend, memory):
+    if backend == "memory":
+        return MemoryPool()
+    if backend == "scoring":
+        pytest.importorskip("numpy")
+        from scoring import ScoringPool
+        return ScoringPool()
+    return MongoPool(memory.waiting_pool, memory.premium_queue)
+
+
+async def _reload(monkeypatch, backend):
+    memory = MemoryDatabase()
+    now = datetime.utcnow()
+    await memory.premium_queue.insert_many([
+        {"user_id": 1, "filters": {"gender": "female"}, "added_at": now - timedelta(minutes=5)},
+        {"user_id": 2, "filters": {}, "added_at": now},
+    ])
+    pool = _pool(backend, memory)
+    monkeypatch.setattr(rooms, "db", memory)
+    monkeypatch.setattr(rooms, "waiting_pool", pool)
+    monkeypatch.setattr(rooms, "search_deadlines", SearchDeadlines())
+    loaded = await rooms.load_premium_requests()
+    return pool, loaded
+
+
+@pytest.mark.parametrize("backend", ["memory", "scoring"])
+def test_in_process_pools_reload_premium_requests(monkeypatch, backend):
+    pool, loaded = asyncio.run(_reload(monkeypatch, backend))
+    assert loaded == 2
+    assert asyncio.run(pool.requests()) == [(1, {"gender": "female"}), (2, {})]
+    assert rooms.search_deadlines.deadline("premium", 1) is not None
+
+
+def test_mongo_pool_reads_premium_queue_directly(monkeypatch):
+    pool, loaded = asyncio.run(_reload(monkeypatch, "mongo"))
+    assert loaded == 0
+    assert [user_id for user_id, _ in asyncio.run(pool.requests())] == [1, 2]
@@ -0,0 +1,34 @@
+import asyncio
+
+import db
+import rooms
+from matchmaking import MongoPool
+from memory_mongo import MemoryDatabase
+from search_expiry import SearchDeadlines
+
+PROFILE = {"gender": "male", "region": "Asia", "language": "en", "country": "India"}
+
+
+def test_concurrent_joins_on_mongo_pool_pair_up(monkeypatch):
+    # Latency makes both joins add themselves before either claims
+    memory = MemoryDatabase(latency=0.001)
+    pool = MongoPool(memory.waiting_pool, memory.premium_queue)
+    monkeypatch.setattr(db, "db", memory)
+    monkeypatch.setattr(db, "_routes", {})
+    monkeypatch.setattr(rooms, "waiting_pool", pool)
+    monkeypatch.setattr(rooms, "search_deadlines", SearchDeadlines())
+
+    async def join_and_pair(user_id):
+        entry = await rooms.join_pool(user_id, dict(PROFILE, user_id=user_id))
+        if entry is None:
+            return None
+        return await rooms.create_room(user_id, entry["user_id"])
+
+    async def run():
+        results = await asyncio.gather(join_and_pair(1), join_and_pair(2))
+        assert any(results)
+        assert db.get_user_route(1)[1] == 2
+        assert db.get_user_route(2)[1] == 1
+        assert not await pool.contains(1) and not await pool.contains(2)
+
+    asyncio.run(run())
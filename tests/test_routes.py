@@ -0,0 +1,67 @@
+import asyncio
+
+import db
+from memory_mongo import MemoryDatabase
+
+
+def test_route_miss_falls_back_to_user_rooms(monkeypatch):
+    memory = MemoryDatabase()
+    monkeypatch.setattr(db, "db", memory)
+    monkeypatch.setattr(db, "_routes", {})
+    monkeypatch.setattr(db, "_route_checked", {})
+
+    async def run():
+        # Mapped by another replica; this process has never seen the room
+        await memory.user_rooms.insert_one({"user_id": 1, "room_id": "r1", "partner_id": 2})
+        assert db.get_user_route(1) is None
+        assert await db.resolve_user_route(1) == ("r1", 2)
+        assert db.get_user_route(1) == ("r1", 2)
+        assert await db.resolve_user_route(3) is None
+
+        # Closed elsewhere: the next user_rooms read drops the cached route
+        await memory.user_rooms.delete_one({"user_id": 1})
+        assert await db.get_user_room(1) is None
+        assert db.get_user_route(1) is None
+
+    asyncio.run(run())
+
+
+def test_routes_closed_by_another_replica_are_rechecked(monkeypatch):
+    memory = MemoryDatabase()
+    monkeypatch.setattr(db, "db", memory)
+    monkeypatch.setattr(db, "_routes", {})
+    monkeypatch.setattr(db, "_route_checked", {})
+    monkeypatch.setattr(db, "ROUTE_RECHECK_SECONDS", 30)
+
+    async def run():
+        await memory.user_rooms.insert_many([
+            {"user_id": 1, "room_id": "r1", "partner_id": 2},
+            {"user_id": 2, "room_id": "r1", "partner_id": 1},
+        ])
+        assert await db.resolve_user_route(1) == ("r1", 2)
+        assert await db.resolve_user_route(2) == ("r1", 1)
+
+        # Another replica closes the room
+        await memory.user_rooms.delete_many({"room_id": "r1"})
+        assert await db.resolve_user_route(1) == ("r1", 2)    # within the recheck window
+        assert await db.confirm_user_route(2) is None         # pairing always re-reads
+        db._route_checked[1] -= 30
+        assert await db.resolve_user_route(1) is None
+        assert db.get_user_route(1) is None and db.get_user_route(2) is None
+
+    asyncio.run(run())
+
+
+def test_single_replica_trusts_its_routes(monkeypatch):
+    memory = MemoryDatabase()
+    monkeypatch.setattr(db, "db", memory)
+    monkeypatch.setattr(db, "_routes", {1: ("r1", 2)})
+    monkeypatch.setattr(db, "_route_checked", {})
+    monkeypatch.setattr(db, "ROUTE_RECHECK_SECONDS", 0)
+
+    async def run():
+        assert await db.confirm_user_route(1) == ("r1", 2)
+        assert await db.resolve_user_route(1) == ("r1", 2)
+        assert memory.total_ops() == 0
+
+    asyncio.run(run())
@@ -0,0 +1,32 @@
+import pytest
+
+from content_filter import compile_words
+from handlers.message_router import link_or_bot_regex
+from screening import Verdict, clean, normalize
+
+HINDI = "नमस्ते! आप कैसे हैं? मैं 100 किलोमीटर दूर हूँ, कल मिलेंगे।"
+ARABIC = "مَرْحَبًا، كَيْفَ حَالُكَ؟ أَنَا بِخَيْرٍ وَالْحَمْدُ لِلَّهِ ٢٠٢٤"
+
+
+@pytest.mark.parametrize("text", [HINDI, ARABIC])
+def test_other_scripts_pass_unchanged(text):
+    verdict = Verdict(text)
+    assert verdict.cleaned == text
+    assert verdict.normalized == text
+    assert link_or_bot_regex.search(verdict.cleaned) is None
+    assert compile_words(["o", "in", "com"]).search(verdict.normalized) is None
+
+
+def test_blocked_words_fold_latin_lookalikes():
+    matcher = compile_words(["sex", "casino"])
+    assert matcher.search(normalize("ѕех")) == "sex"          # Cyrillic
+    assert matcher.search(normalize("ＣＡＳＩＮＯ")) == "casino"  # fullwidth
+    assert matcher.search(normalize("cásin0")) == "casino"
+    assert matcher.search(normalize("ca​sino")) == "casino"
+
+
+def test_link_rule_reads_cleaned_text():
+    assert clean("Visit EXAMPLE.​COM") == "visit example.com"
+    assert link_or_bot_regex.search(Verdict("join t.me/x or exa​mple.com").cleaned)
+    # Lookalike folding is for blocked words only
+    assert not link_or_bot_regex.search(Verdict("ready at 10.00 sharp").cleaned)
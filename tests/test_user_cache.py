@@ -0,0 +1,24 @@
+import asyncio
+
+import db
+from memory_mongo import MemoryDatabase
+
+
+def test_editing_a_fetched_user_leaves_the_cache_alone(monkeypatch):
+    memory = MemoryDatabase()
+    monkeypatch.setattr(db, "db", memory)
+    monkeypatch.setattr(db, "user_cache", db.UserCache(10, 300))
+
+    async def run():
+        await memory.users.insert_one({"user_id": 1, "matching_preferences": {"gender": "female"}})
+
+        user = await db.get_user(1)    # miss
+        user["matching_preferences"]["gender"] = "male"
+        user = await db.get_user(1)    # hit
+        assert user["matching_preferences"] == {"gender": "female"}
+
+        user["matching_preferences"]["gender"] = "male"
+        assert (await db.get_user(1))["matching_preferences"] == {"gender": "female"}
+        assert db.user_cache.stats()["hits"] == 2
+
+    asyncio.run(run())
@@ -0,0 +1,65 @@
+"""
+Per-update request scope.
+
+One UpdateScope lives for the handling of one Telegram update, in a
+ContextVar: bot.py opens it (command_monitor.begin_update) before every
+other handler group and closes it after the last. It holds what the
+handlers of that update keep asking for about the user who sent it:
+
+  • user      the models.User record, loaded before the handlers run
+  • room_id   the user's current room, looked up at most once per update
+
+db.get_user, get_user_view and get_user_room serve the update's own user
+from the scope, and db's writers update or forget the scoped values, so
+the handlers of one update see their own writes. Lookups of other users
+(partners, admin targets) go through the normal path.
+
+The scope also counts the MongoDB commands the update issued (see
+mongo_monitor) and the lookups the scope answered instead.
+"""
+
+from contextvars import ContextVar
+
+# room_id not looked up yet in this update (None means "in no room")
+UNKNOWN = object()
+
+_current = ContextVar("update_scope", default=None)
+
+
+class UpdateScope:
+    __slots__ = ("user_id", "user", "room_id", "commands", "hits", "closed")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.user = None
+        self.room_id = UNKNOWN
+        self.commands = 0
+        self.hits = 0
+        self.closed = False
+
+
+def begin(user_id=None):
+    scope = UpdateScope(user_id)
+    _current.set(scope)
+    return scope
+
+
+def end():
+    """Close the current scope and return it, or None if none was open"""
+    scope = _current.get()
+    if scope is not None:
+        # Tasks spawned during the update keep a reference; stop serving them
+        scope.closed = True
+        _current.set(None)
+    return scope
+
+
+def current():
+    scope = _current.get()
+    return scope if scope is not None and not scope.closed else None
+
+
+def for_user(user_id):
+    """The open scope if it belongs to user_id, else None"""
+    scope = current()
+    return scope if scope is not None and scope.user_id == user_id else None